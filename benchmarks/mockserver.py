@@ -0,0 +1,490 @@
+# encoding: utf8
+"""
+A local stand-in for a Genesis SOAP backend.
+
+Serves WSDLs for TestService, RechercheService_2010 and DownloadService
+and answers their operations with synthetic, deterministic data of
+configurable size. Meant for benchmarking GenesisClient offline:
+
+    python benchmarks/mockserver.py --port 8099 --tables 2000
+
+A GenesisClient can then be pointed at it by registering an extra site:
+
+    gc = GenesisClient('MOCK', sites={'MOCK': {
+        'webservice_url': 'http://127.0.0.1:8099/genesisws'}})
+"""
+import fnmatch
+import io
+import random
+import re
+import sys
+import threading
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from lxml import etree
+
+
+COMMON = ['kennung', 'passwort']
+TAIL = ['listenLaenge', 'sprache']
+DOWNLOAD = COMMON + ['name', 'bereich', 'format', 'komprimierung',
+                     'startjahr', 'endjahr', 'zeitscheiben',
+                     'regionalschluessel', 'sachmerkmal', 'sachschluessel',
+                     'sprache']
+
+OPERATIONS = {
+    'TestService': {
+        'whoami': [],
+        'exception': [],
+    },
+    'RechercheService_2010': {
+        'Recherche': ['luceneString'] + COMMON + TAIL + ['kategorie'],
+        'BegriffeKatalog': COMMON + ['filter'] + TAIL,
+        'MerkmalsKatalog': COMMON + ['filter', 'kriterium', 'typ',
+                                     'bereich'] + TAIL,
+        'MerkmalAuspraegungenKatalog': COMMON + ['name', 'auswahl',
+                                                 'kriterium',
+                                                 'bereich'] + TAIL,
+        'MerkmalDatenKatalog': COMMON + ['name', 'auswahl', 'bereich'] + TAIL,
+        'MerkmalStatistikenKatalog': COMMON + ['name', 'auswahl', 'kriterium',
+                                               'bereich'] + TAIL,
+        'MerkmalTabellenKatalog': COMMON + ['name', 'auswahl',
+                                            'bereich'] + TAIL,
+        'StatistikKatalog': COMMON + ['filter', 'kriterium',
+                                      'bereich'] + TAIL,
+        'StatistikDatenKatalog': COMMON + ['name', 'auswahl',
+                                           'bereich'] + TAIL,
+        'StatistikMerkmaleKatalog': COMMON + ['name', 'auswahl', 'kriterium',
+                                              'bereich'] + TAIL,
+        'StatistikTabellenKatalog': COMMON + ['name', 'auswahl',
+                                              'bereich'] + TAIL,
+        'TabellenKatalog': COMMON + ['filter', 'bereich'] + TAIL,
+        'DatenKatalog': COMMON + ['filter', 'bereich'] + TAIL,
+    },
+    'DownloadService': {
+        'TabellenDownload': DOWNLOAD,
+        'ExcelDownload': [p for p in DOWNLOAD if p != 'format'],
+    },
+}
+
+NAMESPACE = 'http://mock.genesis.local/'
+BOUNDARY = '----=_Part_0_1234567.1234567890'
+
+
+def wsdl(service, location):
+    """Return a rpc/literal WSDL document for one of the mocked services"""
+    ops = OPERATIONS[service]
+    out = ['<?xml version="1.0" encoding="UTF-8"?>',
+           '<wsdl:definitions targetNamespace="%s"' % NAMESPACE,
+           ' xmlns:tns="%s"' % NAMESPACE,
+           ' xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/"',
+           ' xmlns:wsdlsoap="http://schemas.xmlsoap.org/wsdl/soap/"',
+           ' xmlns:xsd="http://www.w3.org/2001/XMLSchema">']
+    for name, params in sorted(ops.items()):
+        out.append('<wsdl:message name="%sRequest">' % name)
+        for p in params:
+            out.append('<wsdl:part name="%s" type="xsd:string"/>' % p)
+        out.append('</wsdl:message>')
+        out.append('<wsdl:message name="%sResponse">' % name)
+        out.append('<wsdl:part name="%sReturn" type="xsd:string"/>' % name)
+        out.append('</wsdl:message>')
+    out.append('<wsdl:portType name="%s">' % service)
+    for name in sorted(ops):
+        out.append('<wsdl:operation name="%s">' % name)
+        out.append('<wsdl:input message="tns:%sRequest"/>' % name)
+        out.append('<wsdl:output message="tns:%sResponse"/>' % name)
+        out.append('</wsdl:operation>')
+    out.append('</wsdl:portType>')
+    out.append('<wsdl:binding name="%sSoapBinding" type="tns:%s">'
+               % (service, service))
+    out.append('<wsdlsoap:binding style="rpc"'
+               ' transport="http://schemas.xmlsoap.org/soap/http"/>')
+    for name in sorted(ops):
+        out.append('<wsdl:operation name="%s">' % name)
+        out.append('<wsdlsoap:operation soapAction=""/>')
+        for direction in ('input', 'output'):
+            out.append('<wsdl:%s><wsdlsoap:body use="literal"'
+                       ' namespace="%s"/></wsdl:%s>'
+                       % (direction, NAMESPACE, direction))
+        out.append('</wsdl:operation>')
+    out.append('</wsdl:binding>')
+    out.append('<wsdl:service name="%sService">' % service)
+    out.append('<wsdl:port binding="tns:%sSoapBinding" name="%s">'
+               % (service, service))
+    out.append('<wsdlsoap:address location="%s"/>' % escape(location))
+    out.append('</wsdl:port></wsdl:service></wsdl:definitions>')
+    return '\n'.join(out).encode('utf-8')
+
+
+class Dataset(object):
+    """
+    Deterministic synthetic catalogue content.
+    """
+
+    def __init__(self, statistics=50, tables_per_statistic=10,
+                 properties=200, occurrences=50, terms=500, regions=400,
+                 years=20, seed=1):
+        rnd = random.Random(seed)
+        self.statistics = [('%05d' % (10000 + i * 7),
+                            'Statistik Nummer %d' % i)
+                           for i in range(statistics)]
+        self.tables = []
+        for code, _ in self.statistics:
+            for j in range(tables_per_statistic):
+                self.tables.append(('%s-%04d' % (code, j + 1),
+                                    'Tabelle %d der Statistik %s' % (j + 1, code)))
+        self.properties = [('MK%04d' % i, 'Merkmal Nummer %d' % i)
+                           for i in range(properties)]
+        self.occurrences = occurrences
+        self.terms = sorted(set(
+            ''.join(rnd.choice('abcdefghiklmnoprstuvwz') for _ in range(
+                rnd.randint(3, 9))) for _ in range(terms)))
+        self.regions = ['%05d' % (1000 + i * 3) for i in range(regions)]
+        self.years = list(range(2000, 2000 + years))
+        self.stand = '01.01.2020 10:00:00'
+
+    def occurrences_for(self, prop):
+        return [('%s-%03d' % (prop.lower(), i),
+                 'Auspraegung %d von %s' % (i, prop))
+                for i in range(self.occurrences)]
+
+    def table_csv(self, code, startjahr, endjahr, regionalschluessel):
+        """Render a table in Genesis' CSV flavour"""
+        start = int(startjahr or 0)
+        end = int(endjahr or 9999)
+        regions = self.regions
+        if regionalschluessel not in ('', '*', None):
+            keys = [k.strip() for k in regionalschluessel.split(',')]
+            regions = [r for r in regions
+                       if any(fnmatch.fnmatch(r, k + '*') for k in keys)]
+        rnd = random.Random(code)
+        lines = ['GENESIS-Tabelle: %s' % code,
+                 'Synthetische Tabelle %s;' % code,
+                 'Mock-Statistik;',
+                 'Stichtag;',
+                 ';;;Werte;Anteil',
+                 'Jahr;Regionalschl.;Region;Anzahl;Prozent']
+        for year in self.years:
+            if year < start or year > end:
+                continue
+            for r in regions:
+                n = rnd.randint(0, 10 ** 6)
+                if n % 97 == 0:
+                    value, share = '-', '.'
+                elif n % 89 == 0:
+                    value, share = 'x', '...'
+                else:
+                    value = str(n)
+                    share = ('%.1f' % (n / 10000.0)).replace('.', ',')
+                lines.append('31.12.%d;%s;Region %s;%s;%s'
+                             % (year, r, r, value, share))
+        lines += ['__________',
+                  '(C)opyright Mock Statistisches Amt',
+                  'Stand: %s' % self.stand]
+        return ('\r\n'.join(lines) + '\r\n').encode('latin-1')
+
+
+def match(value, pattern):
+    if pattern in (None, ''):
+        return True
+    return fnmatch.fnmatch(value.lower(), pattern.lower())
+
+
+class MockGenesis(object):
+    """
+    Request dispatcher shared by all handler threads.
+    """
+
+    def __init__(self, dataset=None, latency=0.0, fault_rate=0.0, seed=1,
+                 cut_downloads=0, keep_alive=True):
+        self.dataset = dataset or Dataset()
+        self.latency = latency
+        self.fault_rate = fault_rate
+        # number of the next downloads to break off halfway
+        self.cut_downloads = cut_downloads
+        # if false, connections are closed after every response without
+        # telling the client, like a server dropping idle connections
+        self.keep_alive = keep_alive
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {}
+
+    def count(self, operation):
+        with self.lock:
+            self.requests[operation] = self.requests.get(operation, 0) + 1
+
+    def should_fail(self):
+        if not self.fault_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.fault_rate
+
+    def catalogue(self, operation, params):
+        ds = self.dataset
+        limit = int(params.get('listenLaenge') or 500)
+        name = params.get('name')
+        selection = params.get('auswahl')
+        tag = operation[0].lower() + operation[1:] + 'Eintraege'
+        entries = []
+        if operation == 'BegriffeKatalog':
+            entries = [(t, t) for t in ds.terms
+                       if match(t, params.get('filter'))]
+        elif operation == 'MerkmalsKatalog':
+            entries = [e for e in ds.properties
+                       if match(e[0], params.get('filter'))]
+        elif operation in ('MerkmalAuspraegungenKatalog',
+                           'MerkmalDatenKatalog'):
+            for code, _ in ds.properties:
+                if match(code, name):
+                    entries += [e for e in ds.occurrences_for(code)
+                                if match(e[0], selection)]
+        elif operation == 'StatistikKatalog':
+            entries = [e for e in ds.statistics
+                       if match(e[0], params.get('filter'))]
+        elif operation in ('StatistikTabellenKatalog',
+                           'MerkmalTabellenKatalog'):
+            entries = [e for e in ds.tables
+                       if match(e[0].split('-')[0], name)
+                       and match(e[0], selection)]
+        elif operation in ('StatistikMerkmaleKatalog',
+                           'MerkmalStatistikenKatalog'):
+            entries = [e for e in ds.properties[:20] if match(e[0], selection)]
+        elif operation == 'StatistikDatenKatalog':
+            entries = [e for e in ds.statistics if match(e[0], name)]
+        elif operation in ('TabellenKatalog', 'DatenKatalog'):
+            entries = [e for e in ds.tables
+                       if match(e[0], params.get('filter'))]
+        out = []
+        for code, inhalt in entries[:limit]:
+            out.append('<%s><code>%s</code><inhalt>%s</inhalt>'
+                       '<beschriftungstext>%s\nmit Zeilenumbruch'
+                       '</beschriftungstext>'
+                       % (tag, escape(code), escape(inhalt), escape(inhalt)))
+            if operation == 'DatenKatalog':
+                out.append('<stand>%s</stand>' % ds.stand)
+            out.append('</%s>' % tag)
+        return ''.join(out)
+
+    def recherche(self, params):
+        ds = self.dataset
+        limit = int(params.get('listenLaenge') or 500)
+        term = (params.get('luceneString') or '*').strip('*').lower()
+        hits = [('Tabelle', c, d) for c, d in ds.tables if term in d.lower()]
+        hits += [('Statistik', c, d) for c, d in ds.statistics
+                 if term in d.lower()]
+        out = []
+        for otype in ('Tabelle', 'Statistik'):
+            out.append('<trefferUebersicht><objektTyp>%s</objektTyp>'
+                       '<trefferAnzahl>%d</trefferAnzahl></trefferUebersicht>'
+                       % (otype, len([h for h in hits if h[0] == otype])))
+        for otype, code, desc in hits[:limit]:
+            out.append('<trefferListe><EVAS>%s</EVAS><name>%s</name>'
+                       '<kurztext>%s</kurztext><objektTyp>%s</objektTyp>'
+                       '</trefferListe>' % (code, code, escape(desc), otype))
+        return ''.join(out)
+
+    def envelope(self, operation, body):
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<soapenv:Envelope xmlns:soapenv='
+                '"http://schemas.xmlsoap.org/soap/envelope/">'
+                '<soapenv:Body><ns1:%sResponse xmlns:ns1="%s">'
+                '<%sReturn>%s</%sReturn></ns1:%sResponse>'
+                '</soapenv:Body></soapenv:Envelope>'
+                % (operation, NAMESPACE, operation, body, operation,
+                   operation)).encode('utf-8')
+
+    def should_cut(self):
+        with self.lock:
+            if self.cut_downloads <= 0:
+                return False
+            self.cut_downloads -= 1
+            return True
+
+    def fault(self, message):
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<soapenv:Envelope xmlns:soapenv='
+                '"http://schemas.xmlsoap.org/soap/envelope/">'
+                '<soapenv:Body><soapenv:Fault>'
+                '<faultcode>soapenv:Server</faultcode>'
+                '<faultstring>%s</faultstring>'
+                '</soapenv:Fault></soapenv:Body></soapenv:Envelope>'
+                % escape(message)).encode('utf-8')
+
+    def download(self, operation, params):
+        data = self.dataset.table_csv(params.get('name'),
+                                      params.get('startjahr'),
+                                      params.get('endjahr'),
+                                      params.get('regionalschluessel'))
+        ctype = 'text/plain'
+        if (params.get('komprimierung') or '').lower() == 'true':
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+                z.writestr('%s.csv' % params.get('name'), data)
+            data = buf.getvalue()
+            ctype = 'application/zip'
+        soap = self.envelope(operation, '')
+        return b''.join([
+            b'\r\n--', BOUNDARY.encode('ascii'), b'\r\n',
+            b'Content-Type: text/xml; charset=UTF-8\r\n',
+            b'Content-Transfer-Encoding: binary\r\n',
+            b'Content-Id: <soappart>\r\n\r\n',
+            soap,
+            b'\r\n--', BOUNDARY.encode('ascii'), b'\r\n',
+            b'Content-Type: ', ctype.encode('ascii'), b'\r\n',
+            b'Content-Transfer-Encoding: binary\r\n',
+            b'Content-Id: <attachment>\r\n\r\n',
+            data,
+            b'\r\n--', BOUNDARY.encode('ascii'), b'--\r\n',
+        ])
+
+    def handle(self, body):
+        """Return (status, content type, payload) for a SOAP request body"""
+        root = etree.fromstring(body)
+        call = root.find('{http://schemas.xmlsoap.org/soap/envelope/}Body')[0]
+        operation = etree.QName(call).localname
+        params = dict((etree.QName(c).localname, c.text or '') for c in call)
+        self.count(operation)
+        if self.latency:
+            time.sleep(self.latency)
+        if operation == 'exception':
+            return 500, 'text/xml; charset=utf-8', self.fault(
+                'Mock fault in %s' % operation)
+        if self.should_fail():
+            # an overloaded server
+            return 503, 'text/plain', b'Service Unavailable'
+        if operation in ('TabellenDownload', 'ExcelDownload'):
+            ctype = ('multipart/related; type="text/xml"; boundary="%s"'
+                     % BOUNDARY)
+            payload = self.download(operation, params)
+            if self.should_cut():
+                payload = Truncated(payload)
+            return 200, ctype, payload
+        if operation == 'Recherche':
+            payload = self.recherche(params)
+        elif operation == 'whoami':
+            payload = 'mock'
+        else:
+            payload = self.catalogue(operation, params)
+        return 200, 'text/xml; charset=utf-8', self.envelope(operation,
+                                                             payload)
+
+
+class Truncated(bytes):
+    """Payload of which only the first half is sent"""
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, ctype, payload):
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(payload)))
+        # headers and body in one write, to avoid delayed ACK stalls on
+        # keep-alive connections
+        self._headers_buffer.append(b'\r\n')
+        if isinstance(payload, Truncated):
+            payload = payload[:len(payload) // 2]
+            self.close_connection = True
+        self._headers_buffer.append(payload)
+        self.flush_headers()
+
+    def do_GET(self):
+        m = re.match(r'^/[^/]+/services/([A-Za-z_0-9]+)\?wsdl$', self.path)
+        if m is None or m.group(1) not in OPERATIONS:
+            return self.send(404, 'text/plain', b'not found')
+        host = self.headers.get('Host') or '%s:%d' % self.server.server_address
+        location = 'http://%s%s' % (host, self.path.split('?')[0])
+        self.send(200, 'text/xml; charset=utf-8', wsdl(m.group(1), location))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        status, ctype, payload = self.server.genesis.handle(body)
+        self.send(status, ctype, payload)
+        if not self.server.genesis.keep_alive:
+            self.close_connection = True
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server answering like a Genesis webservice.
+    Use start()/stop() to run it in a background thread.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, genesis=None, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), Handler)
+        self.genesis = genesis or MockGenesis()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d/genesisws' % self.server_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Run a local stand-in for a Genesis webservice')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--statistics', type=int, default=50)
+    parser.add_argument('--tables', type=int, default=10,
+                        help='Tables per statistic')
+    parser.add_argument('--properties', type=int, default=200)
+    parser.add_argument('--occurrences', type=int, default=50,
+                        help='Occurrences per property')
+    parser.add_argument('--terms', type=int, default=500)
+    parser.add_argument('--regions', type=int, default=400,
+                        help='Rows per year in table exports')
+    parser.add_argument('--years', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds to wait before each response')
+    parser.add_argument('--fault-rate', type=float, default=0.0,
+                        help='Share of requests answered with HTTP 503')
+    parser.add_argument('--cut-downloads', type=int, default=0,
+                        help='Number of downloads to break off halfway')
+    args = parser.parse_args()
+    dataset = Dataset(statistics=args.statistics,
+                      tables_per_statistic=args.tables,
+                      properties=args.properties,
+                      occurrences=args.occurrences,
+                      terms=args.terms,
+                      regions=args.regions,
+                      years=args.years)
+    server = MockServer(MockGenesis(dataset, latency=args.latency,
+                                    fault_rate=args.fault_rate,
+                                    cut_downloads=args.cut_downloads),
+                        host=args.host, port=args.port)
+    print('Serving mock Genesis webservice at %s' % server.url)
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+# encoding: utf8
+"""
+Benchmarks for GenesisClient against a local mock webservice.
+
+    python benchmarks/run.py --repeat 10 --output results.json
+
+Starts benchmarks/mockserver.py in a separate process, runs every
+benchmark once to warm up and then repeat times, and writes the results
+as JSON: latency statistics, throughput, response sizes, the time spent
+decoding responses (catalogue responses and parse_table()) and peak
+Python memory usage (measured with tracemalloc in an additional, untimed
+run).
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from genesisclient import (GenesisClient, MetricsCollector, RateLimiter,
+                           parse_table)
+
+MOCKSERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'mockserver.py')
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    """Registers a function taking a client as benchmark name"""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+@benchmark('search')
+def bench_search(client):
+    client.search('Tabelle', limit=500)
+
+
+@benchmark('statistics')
+def bench_statistics(client):
+    client.statistics(limit=10000)
+
+
+@benchmark('tables')
+def bench_tables(client):
+    client.tables(limit=100000)
+
+
+@benchmark('properties')
+def bench_properties(client):
+    client.properties(limit=100000)
+
+
+@benchmark('property_occurrences')
+def bench_property_occurrences(client):
+    client.property_occurrences('MK*', limit=1000000)
+
+
+@benchmark('terms')
+def bench_terms(client):
+    client.terms(limit=100000)
+
+
+@benchmark('lookup_all')
+def bench_lookup_all(client):
+    client.lookup_all('10007')
+
+
+@benchmark('iter_tables')
+def bench_iter_tables(client):
+    for _ in client.iter_tables(page_size=100):
+        pass
+
+
+@benchmark('table_export')
+def bench_table_export(client):
+    client.table_export('10000-0001')
+
+
+@benchmark('parse_table')
+def bench_parse_table(client):
+    data = client.table_export('10000-0001')
+    start = time.time()
+    parse_table(data)
+    client.metrics.parse(client.site, 'parse_table', time.time() - start)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+
+def run_benchmark(client, func, repeat):
+    """Runs func repeat times and returns a dict of measurements"""
+    func(client)
+    latencies = []
+    decode_times = []
+    received = 0
+    for _ in range(repeat):
+        client.metrics.reset()
+        start = time.time()
+        func(client)
+        latencies.append(time.time() - start)
+        operations = client.metrics.snapshot().get(client.site, {}).values()
+        decode_times.append(sum(o['parse_seconds'] for o in operations))
+        received = sum(o['bytes'] for o in operations)
+    tracemalloc.start()
+    try:
+        func(client)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    total = sum(latencies)
+    return OrderedDict([
+        ('repeat', repeat),
+        ('latency', OrderedDict([
+            ('min', min(latencies)),
+            ('median', percentile(latencies, 0.5)),
+            ('mean', total / len(latencies)),
+            ('p95', percentile(latencies, 0.95)),
+            ('max', max(latencies)),
+        ])),
+        ('throughput', OrderedDict([
+            ('calls_per_second', len(latencies) / total if total else None),
+            ('bytes_per_second', received * len(latencies) / total
+                                 if total else None),
+        ])),
+        ('response_bytes', received),
+        ('decode_time', percentile(decode_times, 0.5)),
+        ('peak_memory', peak),
+    ])
+
+
+def start_server(args):
+    """Starts the mock server and returns (process, URL)"""
+    command = [sys.executable, MOCKSERVER, '--port', '0',
+               '--statistics', str(args.statistics),
+               '--tables', str(args.tables),
+               '--properties', str(args.properties),
+               '--occurrences', str(args.occurrences),
+               '--terms', str(args.terms),
+               '--regions', str(args.regions),
+               '--years', str(args.years),
+               '--latency', str(args.latency)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               universal_newlines=True)
+    line = process.stdout.readline()
+    if not line:
+        process.wait()
+        raise RuntimeError('Mock server did not start')
+    return process, line.split()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark GenesisClient against a local mock webservice')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Timed runs per benchmark. Default is 5.')
+    parser.add_argument('-o', '--output', default=None, metavar='FILE',
+                        help='Write results to FILE instead of stdout')
+    parser.add_argument('--url', default=None,
+                        help='Use a mock server already running at URL')
+    parser.add_argument('benchmarks', nargs='*', metavar='NAME',
+                        help='Benchmarks to run: %s. Default is all.'
+                             % ', '.join(BENCHMARKS))
+    size = parser.add_argument_group('mock data size')
+    size.add_argument('--statistics', type=int, default=50)
+    size.add_argument('--tables', type=int, default=10,
+                      help='Tables per statistic')
+    size.add_argument('--properties', type=int, default=200)
+    size.add_argument('--occurrences', type=int, default=50,
+                      help='Occurrences per property')
+    size.add_argument('--terms', type=int, default=500)
+    size.add_argument('--regions', type=int, default=400,
+                      help='Rows per year in table exports')
+    size.add_argument('--years', type=int, default=20)
+    size.add_argument('--latency', type=float, default=0.0,
+                      help='Seconds the server waits before each response')
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark %s' % name)
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_server(args)
+    try:
+        client = GenesisClient('MOCK', sites={'MOCK': {'webservice_url': url}},
+                               wsdl_dir=None, metrics=MetricsCollector(),
+                               rate_limiter=RateLimiter())
+        results = OrderedDict()
+        for name in args.benchmarks or BENCHMARKS:
+            results[name] = run_benchmark(client, BENCHMARKS[name],
+                                          args.repeat)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = OrderedDict([
+        ('date', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('config', OrderedDict((key, getattr(args, key)) for key in (
+            'repeat', 'statistics', 'tables', 'properties', 'occurrences',
+            'terms', 'regions', 'years', 'latency'))),
+        ('results', results),
+    ])
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
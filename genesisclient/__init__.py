@@ -1,14 +1,85 @@
 # encoding: utf8
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import suds
+import suds.cache
+import suds.client
+import suds.options
+import suds.transport.https
 import logging
-from lxml import etree
 
-gc = None
+from genesisclient import batch, columnar, compression, jobs, multipart, paging, regions, resolve, responses, snapshot, soap
+from genesisclient.cache import MemoryCache, SqliteCache, make_key
+from genesisclient.index import KINDS, MetadataIndex
+from genesisclient.manager import ClientManager
+from genesisclient.metrics import Metrics, MetricsCollector, StatsdMetrics
+from genesisclient.parse import parse_table, to_dataframe
+from genesisclient.ratelimit import AdaptiveRateLimiter, RateLimiter, site_limiter
+from genesisclient.responses import clean
+from genesisclient.singleflight import SingleFlight
+from genesisclient.store import TableStore
+from genesisclient.sync import IncrementalSync
+from genesisclient.table import GenesisTable
+from genesisclient.transport import ConnectionPool, PooledTransport, default_pool
 
+# Directory with WSDL files bundled with the package, one sub directory
+# per site, e.g. wsdl/DESTATIS/RechercheService_2010.wsdl
+BUNDLED_WSDL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'wsdl')
 
-class GenesisClient(object):
 
-    def __init__(self, site, username=None, password=None):
+class BaseGenesisClient(object):
+    """
+    Configuration, SOAP clients and the requests of the Genesis web
+    services shared by GenesisClient and aio.AsyncGenesisClient. The
+    catalogue methods return what _request() returns, which subclasses
+    implement either as a blocking call or as a coroutine.
+    """
+
+    # Services whose responses may be served from the cache
+    cached_services = ('RechercheService_2010',)
+
+    # Catalogue methods used by lookup_all() and the name of their
+    # filter argument, in output order
+    lookup_methods = (
+        ('statistics', 'filter'),
+        ('statistic_data', 'statistic_code'),
+        ('statistic_properties', 'statistic_code'),
+        ('statistic_tables', 'statistic_code'),
+        ('properties', 'filter'),
+        ('property_occurrences', 'property_code'),
+        ('property_data', 'property_code'),
+        ('tables', 'filter'),
+        ('terms', 'filter'),
+    )
+
+    # Catalogue methods supported by iter_catalogue() and the name of
+    # their argument filtering on entry codes
+    paged_methods = {
+        'statistics': 'filter',
+        'statistic_data': 'selection',
+        'statistic_properties': 'selection',
+        'statistic_tables': 'selection',
+        'properties': 'filter',
+        'property_occurrences': 'selection',
+        'property_data': 'selection',
+        'property_statistics': 'selection',
+        'property_tables': 'selection',
+        'tables': 'filter',
+        'terms': 'filter',
+        'catalogue_entries': 'filter',
+    }
+
+    def __init__(self, site, username=None, password=None, cache=None,
+                 wsdl_cache=None, wsdl_cache_days=30,
+                 wsdl_dir=BUNDLED_WSDL_DIR,
+                 connection_pool=None, transport=None, sites=None,
+                 metrics=None, rate_limiter=None, retries=3, backoff=1.0):
         self.sites = {
             'DESTATIS': {
                 'webservice_url': 'https://www-genesis.destatis.de/genesisWS'
@@ -29,6 +100,9 @@ class GenesisClient(object):
                 'webservice_url': 'https://www.bildungsmonitoring.de/bildungws'
             }
         }
+        if sites is not None:
+            # additional sites, e.g. a local test server
+            self.sites.update(sites)
         self.endpoints = {
             'TestService': '/services/TestService?wsdl',
             #'RechercheService': '/services/RechercheService?wsdl',
@@ -50,33 +124,130 @@ class GenesisClient(object):
         self.username = None
         self.password = None
         self.service_clients = {}
+        self.service_clients_lock = threading.Lock()
+        self.local = threading.local()
+        self.cache = cache
+        self.wsdl_cache = wsdl_cache
+        self.wsdl_cache_days = wsdl_cache_days
+        self.wsdl_dir = wsdl_dir
+        # HTTP connections are pooled and shared by all service clients,
+        # by default with all other clients in the process, too.
+        # transport may be a function returning a different suds
+        # transport for each service client.
+        self.connection_pool = connection_pool or default_pool()
+        self.transport = transport
+        # receives timings, sizes and errors of all requests, see
+        # genesisclient.metrics
+        self.metrics = metrics or Metrics()
+        # requests to a site are rate limited by a limiter shared by all
+        # clients of the site, unless another one is given. Failed
+        # requests are retried retries times, see batch.retry().
+        self.rate_limiter = rate_limiter or site_limiter(site)
+        self.retries = retries
+        self.backoff = backoff
         if username is not None:
             self.username = username
         if password is not None:
             self.password = password
 
+    def wsdl_url(self, name):
+        """
+        Returns the URL of the WSDL for endpoint name. A local copy
+        in wsdl_dir is preferred over the remote one.
+        """
+        if self.wsdl_dir is not None:
+            path = os.path.join(self.wsdl_dir, self.site, name + '.wsdl')
+            if os.path.exists(path):
+                return 'file://' + os.path.abspath(path)
+        return self.sites[self.site]['webservice_url'] + self.endpoints[name]
+
+    def new_transport(self):
+        """Returns a suds transport for a new service client"""
+        if self.transport is not None:
+            return self.transport()
+        return PooledTransport(self.connection_pool)
+
+    def service_client_options(self, name):
+        """
+        Returns keyword arguments for creating the suds client of
+        endpoint name.
+        """
+        options = dict(retxml=True, transport=self.new_transport())
+        if self.wsdl_url(name).startswith('file://'):
+            # a local WSDL still has to talk to the remote service
+            options['location'] = (self.sites[self.site]['webservice_url']
+                                   + self.endpoints[name].split('?')[0])
+        if self.wsdl_cache is not None:
+            if isinstance(self.wsdl_cache, suds.cache.Cache):
+                options['cache'] = self.wsdl_cache
+            else:
+                options['cache'] = suds.cache.ObjectCache(
+                    location=self.wsdl_cache, days=self.wsdl_cache_days)
+        return options
+
     def init_service_client(self, name):
         """
         Initializes a client for a certain endpoint, identified by name,
         returns it and stores it internally for later re-use.
+        Suds clients must not be used by several threads at once, so
+        every thread gets its own clone sharing the parsed WSDL.
         """
-        if name not in self.service_clients:
-            url = (self.sites[self.site]['webservice_url']
-                  + self.endpoints[name])
-            self.service_clients[name] = suds.client.Client(url, retxml=True)
-        return self.service_clients[name]
+        clients = getattr(self.local, 'clients', None)
+        if clients is None:
+            clients = self.local.clients = {}
+        if name not in clients:
+            with self.service_clients_lock:
+                if name not in self.service_clients:
+                    self.service_clients[name] = suds.client.Client(
+                        self.wsdl_url(name),
+                        **self.service_client_options(name))
+                    clients[name] = self.service_clients[name]
+                else:
+                    clients[name] = clone_client(
+                        self.service_clients[name],
+                        **self.service_client_options(name))
+        return clients[name]
 
-    def test_service(self):
+    def save_wsdl(self, directory):
         """
-        Calls functions for test purposes.
-        whoami and Exception handling.
+        Downloads the WSDLs of all endpoints of the current site into
+        directory/SITE/, where they can be used via wsdl_dir.
         """
-        client = self.init_service_client('TestService')
-        client.service.whoami()
-        try:
-            client.service.exception()
-        except suds.WebFault:
-            pass
+        from suds.transport import Request
+        target = os.path.join(directory, self.site)
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        paths = []
+        for name in sorted(self.endpoints.keys()):
+            url = self.sites[self.site]['webservice_url'] + self.endpoints[name]
+            data = self.new_transport().open(Request(url)).read()
+            path = os.path.join(target, name + '.wsdl')
+            with open(path, 'wb') as f:
+                f.write(data)
+            paths.append(path)
+        return paths
+
+    def cache_key(self, service, method, params):
+        """
+        Returns the cache key for a call, or None if its response must
+        not be cached.
+        """
+        if self.cache is None or service not in self.cached_services:
+            return None
+        return make_key(self.site, method, params)
+
+    def _call(self, service, method, params):
+        """Invokes a SOAP method and returns the raw response"""
+        raise NotImplementedError
+
+    def _request(self, service, method, params, parser):
+        """Invokes a SOAP method and returns the response decoded by parser"""
+        raise NotImplementedError
+
+    def iter_catalogue(self, method, filter='*', page_size=paging.PAGE_SIZE,
+                       **kwargs):
+        """Iterates over all entries of a catalogue whose codes match filter"""
+        raise NotImplementedError
 
     def search(self, searchterm='*:*', limit=500, category='alle'):
         """
@@ -88,8 +259,6 @@ class GenesisClient(object):
             "Zeitreihe" for time series,
             "Datenquader", "Merkmal", "Statistik"
         """
-        client = self.init_service_client('RechercheService_2010')
-        #print client
         params = dict(luceneString=searchterm,
                       kennung=self.username,
                       passwort=self.password,
@@ -97,35 +266,8 @@ class GenesisClient(object):
                       sprache='de',
                       kategorie=category
                       )
-        result = client.service.Recherche(**params)
-        root = etree.fromstring(result)
-        out = {
-            'meta': {},
-            'results': []
-        }
-        for element in root.iter("trefferUebersicht"):
-            otype = element.find("objektTyp")
-            num = element.find("trefferAnzahl")
-            if otype is not None and num is not None:
-                out['meta'][otype.text] = int(num.text)
-        for element in root.iter("trefferListe"):
-
-            code = element.find('EVAS')
-            description = element.find('kurztext')
-            name = element.find('name')
-            if name is not None:
-                name = name.text
-            otype = element.find("objektTyp")
-            if otype is not None:
-                otype = otype.text
-            if code is not None:
-                out['results'].append({
-                    'id': code.text,
-                    'type': otype,
-                    'name': name,
-                    'description': clean(description.text)
-                })
-        return out
+        return self._request('RechercheService_2010', 'Recherche', params,
+                             responses.parse_search)
 
     def terms(self, filter='*', limit=20):
         """
@@ -133,25 +275,14 @@ class GenesisClient(object):
         filter='bev*' will return only terms starting with "bev". Can be used
         to implement search term auto-completion.
         """
-        client = self.init_service_client('RechercheService_2010')
-        #print client
         params = dict(kennung=self.username,
                       passwort=self.password,
                       filter=filter,
                       listenLaenge=str(limit),
                       sprache='de')
-        result = client.service.BegriffeKatalog(**params)
-        root = etree.fromstring(result)
-        out = []
-        for element in root.iter("begriffeKatalogEintraege"):
-            code = element.find('code')
-            inhalt = element.find('inhalt')
-            if code is not None:
-                out.append({
-                    'id': code.text,
-                    'description': clean(inhalt.text)
-                })
-        return out
+        return self._request('RechercheService_2010', 'BegriffeKatalog', params,
+                             responses.entries_parser(
+                                 'begriffeKatalogEintraege'))
 
     def properties(self, filter='*', criteria='Code', type="alle", limit=500):
         """
@@ -173,8 +304,6 @@ class GenesisClient(object):
             "alle" (default)
         area
         """
-        client = self.init_service_client('RechercheService_2010')
-        #print client
         params = dict(kennung=self.username,
                       passwort=self.password,
                       filter=filter,
@@ -183,18 +312,9 @@ class GenesisClient(object):
                       bereich='Alle',
                       listenLaenge=str(limit),
                       sprache='de')
-        result = client.service.MerkmalsKatalog(**params)
-        root = etree.fromstring(result)
-        out = []
-        for element in root.iter("merkmalsKatalogEintraege"):
-            code = element.find('code')
-            inhalt = element.find('inhalt')
-            if code is not None:
-                out.append({
-                    'id': code.text,
-                    'description': clean(inhalt.text)
-                })
-        return out
+        return self._request('RechercheService_2010', 'MerkmalsKatalog', params,
+                             responses.entries_parser(
+                                 'merkmalsKatalogEintraege'))
 
     def property_occurrences(self, property_code, selection='*',
                              criteria="Code", limit=500):
@@ -204,7 +324,6 @@ class GenesisClient(object):
         using the selection parameter which supports asterisk notation
         (e.g. selection='hs18*').
         """
-        client = self.init_service_client('RechercheService_2010')
         params = dict(kennung=self.username,
                       passwort=self.password,
                       name=property_code,
@@ -213,22 +332,12 @@ class GenesisClient(object):
                       bereich='Alle',
                       listenLaenge=str(limit),
                       sprache='de')
-        result = client.service.MerkmalAuspraegungenKatalog(**params)
-        root = etree.fromstring(result)
-        out = []
-        for element in root.iter("merkmalAuspraegungenKatalogEintraege"):
-            code = element.find('code')
-            inhalt = element.find('inhalt')
-            if code is not None:
-                out.append({
-                    'id': code.text,
-                    'description': clean(inhalt.text)
-                })
-        return out
+        return self._request('RechercheService_2010', 'MerkmalAuspraegungenKatalog', params,
+                             responses.entries_parser(
+                                 'merkmalAuspraegungenKatalogEintraege'))
 
     def property_data(self, property_code='*', selection='*',
                              criteria="Code", limit=500):
-        client = self.init_service_client('RechercheService_2010')
         params = dict(kennung=self.username,
                       passwort=self.password,
                       name=property_code,
@@ -236,24 +345,12 @@ class GenesisClient(object):
                       bereich='Alle',
                       listenLaenge=str(limit),
                       sprache='de')
-        result = client.service.MerkmalDatenKatalog(**params)
-        root = etree.fromstring(result)
-        out = []
-        for element in root.iter("merkmalDatenKatalogEintraege"):
-            code = element.find('code')
-            inhalt = element.find('inhalt')
-            beschriftungstext = element.find('beschriftungstext')
-            if code is not None:
-                out.append({
-                    'id': code.text,
-                    'description': clean(inhalt.text),
-                    'longdescription': clean(beschriftungstext.text)
-                })
-        return out
+        return self._request('RechercheService_2010', 'MerkmalDatenKatalog', params,
+                             responses.entries_parser(
+                                 'merkmalDatenKatalogEintraege', long=True))
 
     def property_statistics(self, property_code='*', selection='*',
                              criteria="Code", limit=500):
-        client = self.init_service_client('RechercheService_2010')
         params = dict(kennung=self.username,
                       passwort=self.password,
                       name=property_code,
@@ -262,11 +359,11 @@ class GenesisClient(object):
                       bereich='Alle',
                       listenLaenge=str(limit),
                       sprache='de')
-        result = client.service.MerkmalStatistikenKatalog(**params)
-        print(result)
+        return self._request('RechercheService_2010', 'MerkmalStatistikenKatalog', params,
+                             responses.entries_parser(
+                                 'merkmalStatistikenKatalogEintraege'))
 
     def property_tables(self, property_code='*', selection='*', limit=500):
-        client = self.init_service_client('RechercheService_2010')
         params = dict(kennung=self.username,
                       passwort=self.password,
                       name=property_code,
@@ -274,14 +371,14 @@ class GenesisClient(object):
                       bereich='Alle',
                       listenLaenge=str(limit),
                       sprache='de')
-        result = client.service.MerkmalTabellenKatalog(**params)
-        print(result)
+        return self._request('RechercheService_2010', 'MerkmalTabellenKatalog', params,
+                             responses.entries_parser(
+                                 'merkmalTabellenKatalogEintraege'))
 
     def statistics(self, filter='*', criteria='Code', limit=500):
         """
         Load information on statistics
         """
-        client = self.init_service_client('RechercheService_2010')
         params = dict(kennung=self.username,
                       passwort=self.password,
                       filter=filter,
@@ -289,21 +386,11 @@ class GenesisClient(object):
                       bereich='Alle',
                       listenLaenge=str(limit),
                       sprache='de')
-        result = client.service.StatistikKatalog(**params)
-        root = etree.fromstring(result)
-        out = []
-        for element in root.iter("statistikKatalogEintraege"):
-            code = element.find('code')
-            inhalt = element.find('inhalt')
-            if code is not None:
-                out.append({
-                    'id': code.text,
-                    'description': clean(inhalt.text)
-                })
-        return out
+        return self._request('RechercheService_2010', 'StatistikKatalog', params,
+                             responses.entries_parser(
+                                 'statistikKatalogEintraege'))
 
     def statistic_data(self, statistic_code='*', selection='*', limit=500):
-        client = self.init_service_client('RechercheService_2010')
         params = dict(kennung=self.username,
                       passwort=self.password,
                       name=statistic_code,
@@ -311,23 +398,11 @@ class GenesisClient(object):
                       bereich='Alle',
                       listenLaenge=str(limit),
                       sprache='de')
-        result = client.service.StatistikDatenKatalog(**params)
-        root = etree.fromstring(result)
-        out = []
-        for element in root.iter("statistikDatenKatalogEintraege"):
-            code = element.find('code')
-            inhalt = element.find('inhalt')
-            beschriftungstext = element.find('beschriftungstext')
-            if code is not None:
-                out.append({
-                    'id': code.text,
-                    'description': clean(inhalt.text),
-                    'longdescription': clean(beschriftungstext.text)
-                })
-        return out
+        return self._request('RechercheService_2010', 'StatistikDatenKatalog', params,
+                             responses.entries_parser(
+                                 'statistikDatenKatalogEintraege', long=True))
 
     def statistic_properties(self, statistic_code='*', criteria='Code', selection='*', limit=500):
-        client = self.init_service_client('RechercheService_2010')
         params = dict(kennung=self.username,
                       passwort=self.password,
                       name=statistic_code,
@@ -336,21 +411,11 @@ class GenesisClient(object):
                       bereich='Alle',
                       listenLaenge=str(limit),
                       sprache='de')
-        result = client.service.StatistikMerkmaleKatalog(**params)
-        root = etree.fromstring(result)
-        out = []
-        for element in root.iter("statistikMerkmaleKatalogEintraege"):
-            code = element.find('code')
-            inhalt = element.find('inhalt')
-            if code is not None:
-                out.append({
-                    'id': code.text,
-                    'description': clean(inhalt.text)
-                })
-        return out
+        return self._request('RechercheService_2010', 'StatistikMerkmaleKatalog', params,
+                             responses.entries_parser(
+                                 'statistikMerkmaleKatalogEintraege'))
 
     def statistic_tables(self, statistic_code='*', selection='*', limit=500):
-        client = self.init_service_client('RechercheService_2010')
         params = dict(kennung=self.username,
                       passwort=self.password,
                       name=statistic_code,
@@ -358,49 +423,47 @@ class GenesisClient(object):
                       bereich='Alle',
                       listenLaenge=str(limit),
                       sprache='de')
-        result = client.service.StatistikTabellenKatalog(**params)
-        root = etree.fromstring(result)
-        out = []
-        for element in root.iter("statistikTabellenKatalogEintraege"):
-            code = element.find('code')
-            inhalt = element.find('inhalt')
-            if code is not None:
-                out.append({
-                    'id': code.text,
-                    'description': clean(inhalt.text)
-                })
-        return out
+        return self._request('RechercheService_2010', 'StatistikTabellenKatalog', params,
+                             responses.entries_parser(
+                                 'statistikTabellenKatalogEintraege'))
 
     def tables(self, filter='*', limit=500):
         """
         Retrieve information on tables
         """
-        client = self.init_service_client('RechercheService_2010')
         params = dict(kennung=self.username,
                       passwort=self.password,
                       filter=filter,
                       bereich='Alle',
                       listenLaenge=str(limit),
                       sprache='de')
-        result = client.service.TabellenKatalog(**params)
-        root = etree.fromstring(result)
-        out = []
-        for element in root.iter("tabellenKatalogEintraege"):
-            code = element.find('code')
-            inhalt = element.find('inhalt')
-            if code is not None:
-                out.append({
-                    'id': code.text,
-                    'description': clean(inhalt.text)
-                })
-        return out
+        return self._request('RechercheService_2010', 'TabellenKatalog', params,
+                             responses.entries_parser(
+                                 'tabellenKatalogEintraege'))
+
+    def iter_statistics(self, filter='*', page_size=paging.PAGE_SIZE):
+        return self.iter_catalogue('statistics', filter, page_size)
+
+    def iter_properties(self, filter='*', type='alle',
+                        page_size=paging.PAGE_SIZE):
+        return self.iter_catalogue('properties', filter, page_size, type=type)
+
+    def iter_property_occurrences(self, property_code, selection='*',
+                                  page_size=paging.PAGE_SIZE):
+        return self.iter_catalogue('property_occurrences', selection,
+                                   page_size, property_code=property_code)
+
+    def iter_tables(self, filter='*', page_size=paging.PAGE_SIZE):
+        return self.iter_catalogue('tables', filter, page_size)
+
+    def iter_terms(self, filter='*', page_size=paging.PAGE_SIZE):
+        return self.iter_catalogue('terms', filter, page_size)
 
     def catalogue(self, filter='*', limit=500):
         """
         Retrieve metadata on data offerings. Can be filtered by code, e.g.
         filter='11111*' delivers all entries with codes starting with '11111'.
         """
-        client = self.init_service_client('RechercheService_2010')
         params = dict(kennung=self.username,
                       passwort=self.password,
                       filter=filter,
@@ -408,59 +471,531 @@ class GenesisClient(object):
                       listenLaenge=str(limit),
                       sprache='de'
                       )
-        result = client.service.DatenKatalog(**params)
+        result = self._call('RechercheService_2010', 'DatenKatalog', params)
         return result
 
-    def table_export(self, table_code,
-            regionalschluessel='',
-            format='csv'):
+    def catalogue_entries(self, filter='*', limit=500):
         """
-        Return data for a given table
+        Like catalogue(), but returns a list of DataEntry records with
+        id, description and stand, the date of the last update.
         """
-        client = self.init_service_client('DownloadService')
+        params = dict(kennung=self.username,
+                      passwort=self.password,
+                      filter=filter,
+                      bereich='Alle',
+                      listenLaenge=str(limit),
+                      sprache='de'
+                      )
+        return self._request('RechercheService_2010', 'DatenKatalog', params,
+                             responses.parse_data_entries)
+
+    def export_request(self, table_code, regionalschluessel='', format='csv',
+                       startjahr='1900', endjahr='2100', zeitscheiben='',
+                       compress=False):
+        """
+        Returns the DownloadService method and parameters for exporting
+        a table, see iter_table_export().
+        """
+        if format in columnar.FORMATS:
+            raise ValueError('Format %s is not offered by the webservice, '
+                             'table_export() converts csv downloads to it'
+                             % format)
         params = dict(kennung=self.username,
                       passwort=self.password,
                       name=table_code,
                       bereich='Alle',
                       format=format,
-                      komprimierung=False,
-                      startjahr='1900',
-                      endjahr='2100',
-                      zeitscheiben='',
+                      komprimierung=bool(compress),
+                      startjahr=str(startjahr),
+                      endjahr=str(endjahr),
+                      zeitscheiben=str(zeitscheiben),
                       regionalschluessel=regionalschluessel,
                       sachmerkmal='',
                       sachschluessel='',
                       sprache='de',
                       )
-        result = None
+        method = 'TabellenDownload'
         if format == 'xls':
             del params['format']
-            result = client.service.ExcelDownload(**params)
-            # Really nasty way to treat a multipart message...
-            # (room for improvement)
-            parts = result.split("\r\n")
-            for i in range(0, 12):
-                parts.pop(0)
-            parts.pop()
-            parts.pop()
-            return "\r\n".join(parts)
-        else:
-            result = client.service.TabellenDownload(**params)
-            parts = result.split(result.split("\r\n")[1])
-            data = parts[2].split("\r\n\r\n", 1)[-1]
-            #data = unicode(data.decode('latin-1'))
-            #data = unicode(data.decode('utf-8'))
-            return data
+            method = 'ExcelDownload'
+        return method, params
+
+
+class GenesisClient(BaseGenesisClient):
+    """
+    Blocking client of the Genesis web services of site, safe to share
+    between threads.
+    pool_size: number of threads for concurrent operations
+    store: optional TableStore serving table_export()
+    Further keyword arguments are those of BaseGenesisClient.
+    """
+
+    def __init__(self, site, username=None, password=None, pool_size=9,
+                 store=None, **kwargs):
+        BaseGenesisClient.__init__(self, site, username=username,
+                                   password=password, **kwargs)
+        self.pool = None
+        self.pool_size = pool_size
+        # optional TableStore serving table_export()
+        self.store = store
+        # identical concurrent requests are only sent once
+        self.flights = SingleFlight()
+
+    def _call(self, service, method, params):
+        """
+        Invokes a SOAP method on the given service and returns the raw
+        response. Responses of catalogue services are served from and
+        stored in the cache, if one is configured. Concurrent identical
+        calls share one request.
+        """
+        key = self.cache_key(service, method, params)
+        if key is not None:
+            result = self.cache.get(key)
+            self.metrics.cache(self.site, method, result is not None)
+            if result is not None:
+                return result
+        client = self.init_service_client(service)
+
+        def send():
+            with self.rate_limiter.request():
+                with self.metrics.timer(self.site, method) as timer:
+                    try:
+                        result = getattr(client.service, method)(**params)
+                    except Exception as e:
+                        error = soap.http_error(e)
+                        if error is None:
+                            raise
+                        raise error
+                    timer.size = len(result)
+            return result
+
+        def call():
+            result = batch.retry(send, retries=self.retries,
+                                 backoff=self.backoff)
+            if key is not None:
+                self.cache.set(key, result)
+            return result
+        return self.flights.do(('call', service, make_key(self.site, method,
+                                                          params)), call)
+
+    def get_pool(self):
+        """
+        Returns the thread pool shared by all concurrent operations of
+        this client, creating it on first use.
+        """
+        with self.service_clients_lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.pool_size)
+        return self.pool
+
+    def _request(self, service, method, params, parser):
+        """
+        Invokes a SOAP method and returns the response decoded by parser.
+        Concurrent identical requests share one decoded result, so each
+        method must always be decoded by the same parser. Every caller
+        but the first gets a copy of it.
+        """
+        def request():
+            result = self._call(service, method, params)
+            start = time.time()
+            result = parser(result)
+            self.metrics.parse(self.site, method, time.time() - start)
+            return result
+        return self.flights.do(('request', service, make_key(self.site, method,
+                                                             params)), request,
+                               copy=responses.copy_result)
 
+    def _stream(self, service, method, params):
+        """
+        Invokes a SOAP method on the given service and returns the open
+        response as a file-like object, without reading it. Not retried,
+        see _download().
+        """
+        client = self.init_service_client(service)
+        with self.rate_limiter.request():
+            return soap.call_stream(client, method, params)
+
+    def test_service(self):
+        """
+        Calls functions for test purposes.
+        whoami and Exception handling.
+        """
+        client = self.init_service_client('TestService')
+        client.service.whoami()
+        try:
+            client.service.exception()
+        except suds.WebFault:
+            pass
 
-def clean(s):
-    """Clean up a string"""
-    if s is None:
+    def iter_lookup(self, term, limit=500):
+        """
+        Queries all catalogues listed in lookup_methods for term
+        concurrently. Yields (method name, entries) tuples in the order
+        of lookup_methods, each as soon as it and all preceding ones are
+        complete. property_occurrences is skipped for terms containing
+        an asterisk.
+        """
+        pool = self.get_pool()
+        futures = []
+        for name, argument in self.lookup_methods:
+            if name == 'property_occurrences' and '*' in term:
+                continue
+            kwargs = {argument: term, 'limit': limit}
+            futures.append((name, pool.submit(getattr(self, name), **kwargs)))
+        for name, future in futures:
+            yield name, future.result()
+
+    def lookup_all(self, term, limit=500):
+        """
+        Looks up term in all catalogues concurrently. Returns an
+        OrderedDict mapping catalogue method names to lists of entries.
+        """
+        return OrderedDict(self.iter_lookup(term, limit=limit))
+
+    def iter_catalogue(self, method, filter='*', page_size=paging.PAGE_SIZE,
+                       **kwargs):
+        """
+        Yields all entries of a catalogue, e.g. method='tables', whose
+        codes match filter, not just the first limit ones. The catalogue
+        is requested in pages of at most page_size entries while the
+        entries are consumed (see genesisclient.paging). Further keyword
+        arguments are passed on to method.
+        """
+        argument = self.paged_methods[method]
+
+        def fetch(filter, limit):
+            params = dict(kwargs)
+            params[argument] = filter
+            params['limit'] = limit
+            return getattr(self, method)(**params)
+        return paging.iter_pages(fetch, filter, page_size)
+
+    def table_stand(self, table_code):
+        """
+        Returns the date the data of a table was last updated, as given
+        by the DatenKatalog, or None if it is unknown.
+        """
+        for entry in self.catalogue_entries(table_code, limit=10):
+            if entry.id == table_code:
+                return entry.stand
         return None
-    s = s.replace("\n", " ")
-    s = s.replace("  ", " ")
-    s = s.strip()
-    return s
+
+    def iter_table_export(self, table_code,
+            regionalschluessel='',
+            format='csv',
+            startjahr='1900',
+            endjahr='2100',
+            zeitscheiben='',
+            compress=False,
+            keep=None):
+        """
+        Return data for a given table as an iterator over chunks of bytes.
+        The response is decoded while it is received into a temporary
+        file, so memory usage does not depend on the size of the table,
+        and a download failing halfway is retried as a whole.
+        startjahr, endjahr: restrict the data to these years
+        zeitscheiben: number of most recent time slices to return
+        compress: have the server compress the table (as ZIP archive),
+            which is unpacked while it is received
+        keep: optional file object the data is written to as received,
+            i.e. still compressed if compress is true
+        """
+        method, params = self.export_request(table_code,
+                                             regionalschluessel=regionalschluessel,
+                                             format=format,
+                                             startjahr=startjahr,
+                                             endjahr=endjahr,
+                                             zeitscheiben=zeitscheiben,
+                                             compress=compress)
+        with tempfile.TemporaryFile() as f:
+            self._download(method, params, f, format, compress, keep)
+            f.seek(0)
+            while True:
+                chunk = f.read(multipart.CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def _download(self, method, params, fileobj, format, compress, keep):
+        """
+        Sends an export request, writes the table to fileobj (converted
+        if format is one of columnar.FORMATS) and the data as received
+        to keep, and returns the number of bytes written to fileobj.
+        A download failing at any point is retried as a whole: fileobj
+        and keep are truncated to where they started, or written to
+        via temporary files if they cannot seek.
+        """
+        out = batch.RestartableFile(fileobj)
+        kept = batch.RestartableFile(keep) if keep is not None else None
+
+        def attempt():
+            out.restart()
+            if kept is not None:
+                kept.restart()
+            chunks = self._export_chunks(method, params, compress,
+                                         kept.file if kept else None)
+            if format in columnar.FORMATS:
+                return columnar.convert(chunks, out.file, format=format)
+            size = 0
+            for chunk in chunks:
+                out.file.write(chunk)
+                size += len(chunk)
+            return size
+        try:
+            size = batch.retry(attempt, retries=self.retries,
+                               backoff=self.backoff)
+            out.finish()
+            if kept is not None:
+                kept.finish()
+        finally:
+            out.close()
+            if kept is not None:
+                kept.close()
+        return size
+
+    def _export_chunks(self, method, params, compress, keep):
+        """
+        Sends an export request once and yields the attachment of the
+        response in chunks of bytes, decompressed if compress is true.
+        """
+        with self.metrics.timer(self.site, method) as timer:
+            response = self._stream('DownloadService', method, params)
+            try:
+                boundary = multipart.boundary_from_content_type(
+                    response.headers.get('Content-Type'))
+                reader = multipart.MultipartReader(response, boundary=boundary)
+                envelope = None
+                for part in reader.parts():
+                    if envelope is None:
+                        envelope = part.read()
+                        continue
+                    decompressor = None
+                    if compress:
+                        decompressor = compression.Decompressor()
+                    for chunk in part.iter_chunks():
+                        timer.size += len(chunk)
+                        if keep is not None:
+                            keep.write(chunk)
+                        if decompressor is not None:
+                            chunk = decompressor.decompress(chunk)
+                        if chunk:
+                            yield chunk
+                    if decompressor is not None:
+                        chunk = decompressor.flush()
+                        if chunk:
+                            yield chunk
+                    return
+                raise multipart.MultipartError(
+                    'No attachment in response: %s' % envelope)
+            finally:
+                response.close()
+
+    def table_export(self, table_code,
+            regionalschluessel='',
+            format='csv',
+            fileobj=None,
+            startjahr='1900',
+            endjahr='2100',
+            zeitscheiben='',
+            compress=False,
+            keep=None):
+        """
+        Return data for a given table. If fileobj is given, the data is
+        written to it as it arrives and the number of bytes is returned.
+        Besides the formats of the webservice, format can be 'parquet',
+        'arrow' or 'feather': the table is then downloaded as CSV and
+        converted while it arrives (see genesisclient.columnar).
+        If the client has a store, complete tables (no years or time
+        slices selected, no keep) are read from it and only downloaded
+        if they have changed (see genesisclient.store.TableStore).
+        Concurrent identical calls without fileobj share one download,
+        as do concurrent downloads into the store.
+        See iter_table_export() for the other parameters.
+        """
+        if fileobj is None and keep is None:
+            key = make_key(self.site, 'table_export', dict(
+                name=table_code, regionalschluessel=regionalschluessel,
+                format=format, startjahr=str(startjahr), endjahr=str(endjahr),
+                zeitscheiben=str(zeitscheiben), komprimierung=bool(compress)))
+            return self.flights.do(
+                ('export', key),
+                lambda: self._table_export(table_code, regionalschluessel,
+                                           format, None, startjahr, endjahr,
+                                           zeitscheiben, compress, None))
+        return self._table_export(table_code, regionalschluessel, format,
+                                  fileobj, startjahr, endjahr, zeitscheiben,
+                                  compress, keep)
+
+    def _table_export(self, table_code, regionalschluessel, format, fileobj,
+                      startjahr, endjahr, zeitscheiben, compress, keep):
+        download_format = format
+        if format in columnar.FORMATS:
+            download_format = 'csv'
+        if (self.store is not None and keep is None
+                and str(startjahr) == '1900' and str(endjahr) == '2100'
+                and not zeitscheiben):
+            key = make_key(self.site, 'store', dict(
+                name=table_code, regionalschluessel=regionalschluessel,
+                format=download_format))
+            stored = self.flights.do(('store', key), lambda: self.store.fetch(
+                self, table_code, regionalschluessel=regionalschluessel,
+                format=download_format, compress=compress))
+            chunks = self.store.iter_chunks(stored)
+        else:
+            method, params = self.export_request(
+                table_code, regionalschluessel=regionalschluessel,
+                format=download_format, startjahr=startjahr, endjahr=endjahr,
+                zeitscheiben=zeitscheiben, compress=compress)
+            out = fileobj
+            if out is None:
+                out = io.BytesIO()
+            size = self._download(method, params, out, format, compress, keep)
+            if fileobj is None:
+                return out.getvalue()
+            return size
+        if format in columnar.FORMATS:
+            out = fileobj
+            if out is None:
+                out = io.BytesIO()
+            size = columnar.convert(chunks, out, format=format)
+            if fileobj is None:
+                return out.getvalue()
+            return size
+        if fileobj is None:
+            return b''.join(chunks)
+        size = 0
+        for chunk in chunks:
+            fileobj.write(chunk)
+            size += len(chunk)
+        return size
+
+    def export_many(self, table_codes, regionalschluessel='', format='csv',
+                    workers=4, target=None, compress=False,
+                    keep_compressed=False):
+        """
+        Download several tables concurrently. Yields ExportResult tuples
+        (table_code, data, error) in the order the downloads finish.
+        workers: number of threads to use. The number of concurrent
+            requests is additionally limited per site (see
+            genesisclient.batch.DEFAULT_SITE_LIMIT).
+        target: optional function returning a file path for a table code.
+            Tables are then streamed to these files instead of being
+            returned.
+        compress: download compressed tables, see iter_table_export()
+        keep_compressed: with target, also keep the data as received
+            in a file with the suffix .zip next to each table.
+        """
+        return batch.export_many(self, table_codes,
+                                 regionalschluessel=regionalschluessel,
+                                 format=format, workers=workers,
+                                 target=target, compress=compress,
+                                 keep_compressed=keep_compressed)
+
+    def resolve(self, codes, kind='table', page_size=paging.PAGE_SIZE):
+        """
+        Looks up the catalogue entries of many codes of one kind
+        ('statistic', 'table' or 'property') at once. Codes sharing a
+        prefix are fetched by one wildcard query, the queries run
+        concurrently. Returns an OrderedDict mapping each code to its
+        entry, or to None if it was not found. See genesisclient.resolve.
+        """
+        return resolve.resolve(self, codes, kind=kind, page_size=page_size)
+
+    def catalogue_snapshot(self, workers=4, page_size=paging.PAGE_SIZE):
+        """
+        Harvest the statistics, tables, properties and property
+        occurrences of the site concurrently and return them as a dict.
+        See genesisclient.snapshot for the format and for comparing
+        snapshots.
+        """
+        return snapshot.take_snapshot(self, workers=workers,
+                                      page_size=page_size)
+
+    def export_regions(self, table_code, keys, fileobj=None,
+                       batch_size=20, workers=4, startjahr='1900', endjahr='2100', zeitscheiben='',
+                       compress=False, max_rows=regions.MAX_ROWS):
+        """
+        Download a table for many regions concurrently and merge the
+        data into one CSV table with an additional first column holding
+        the region key. keys is a list (or comma separated string) of
+        region keys, where prefix patterns like '05*' are split into
+        narrower ones, and further if an export for a pattern reaches
+        max_rows lines. Rows contained in several responses are only
+        included once. If fileobj is given, the table is written to it
+        and the number of rows is returned, otherwise the table is
+        returned as bytes. See genesisclient.regions for details.
+        """
+        out = fileobj
+        if out is None:
+            out = io.BytesIO()
+        rows = regions.export_regions(self, table_code, keys, out,
+                                      batch_size=batch_size, workers=workers,
+                                      startjahr=startjahr, endjahr=endjahr,
+                                      zeitscheiben=zeitscheiben,
+                                      compress=compress, max_rows=max_rows)
+        if fileobj is None:
+            return out.getvalue()
+        return rows
+
+
+def clone_client(client, **options):
+    """
+    Returns a new suds client sharing the parsed WSDL of client, with
+    its own options. Like suds.client.Client.clone(), which fails with
+    suds-py3 because its options cannot be deep-copied.
+    """
+    clone = suds.client.Client.__new__(suds.client.Client)
+    clone.options = suds.options.Options()
+    if 'transport' not in options:
+        clone.options.transport = suds.transport.https.HttpAuthenticated()
+    clone.set_options(**options)
+    clone.wsdl = client.wsdl
+    clone.factory = client.factory
+    clone.service = suds.client.ServiceSelector(clone, client.wsdl.services)
+    clone.sd = client.sd
+    clone.messages = dict(tx=None, rx=None)
+    return clone
+
+
+def download_path(table_code, args):
+    """
+    Returns the output file name for a table
+    """
+    if args.regionalschluessel is not None and args.regionalschluessel != '*':
+        return '%s_%s.%s' % (table_code, args.regionalschluessel, args.format)
+    return '%s.%s' % (table_code, args.format)
+
+
+def download_codes(args):
+    """
+    Returns the table codes to download, read from the -d option
+    (comma separated) and the file named by --download-list.
+    """
+    codes = []
+    if args.download is not None:
+        codes += [c.strip() for c in args.download.split(',')]
+    if args.download_list is not None:
+        if args.download_list == '-':
+            import sys
+            codes += [line.strip() for line in sys.stdin]
+        else:
+            with open(args.download_list) as f:
+                codes += [line.strip() for line in f]
+    return [c for c in codes if c and not c.startswith('#')]
+
+
+def region_list(args):
+    """
+    Returns the region keys given via --rs (comma separated) and the file
+    named by --rs-list.
+    """
+    keys = []
+    if args.regionalschluessel not in (None, '*'):
+        keys += args.regionalschluessel.split(',')
+    if args.rs_list is not None:
+        with open(args.rs_list) as f:
+            keys += [line.strip() for line in f]
+    return [k.strip() for k in keys if k.strip() and not k.startswith('#')]
 
 
 def download(client, args):
@@ -468,15 +1003,61 @@ def download(client, args):
     Issue a download from command line arguments
     """
     rs = '*'
-    path = '%s.%s' % (args.download, args.format)
     if args.regionalschluessel is not None and args.regionalschluessel != '*':
         rs = args.regionalschluessel
-        path = '%s_%s.%s' % (args.download, args.regionalschluessel, args.format)
-    print("Downloading to file %s" % path)
-    result = client.table_export(args.download,
-            regionalschluessel=rs,
-            format=args.format)
-    open(path, 'wb').write(result)
+    codes = download_codes(args)
+    if args.sync is not None:
+        syncer = IncrementalSync(client, args.sync)
+        for code in codes:
+            result = syncer.sync(code, regionalschluessel=rs if rs != '*' else '')
+            print("%s: %d rows %s, latest year %s" % (
+                result['path'], result['rows'],
+                'downloaded' if result['full'] else 'updated',
+                result['latest']))
+        return
+    if args.fanout or args.rs_list is not None:
+        keys = region_list(args)
+        for code in codes:
+            path = '%s_regions.csv' % code
+            print("Downloading %s for %d region keys to file %s" % (
+                code, len(regions.region_keys(keys)), path))
+            with open(path, 'wb') as f:
+                rows = client.export_regions(code, keys, fileobj=f,
+                                             workers=args.jobs,
+                                             compress=args.compress)
+            print("Wrote %d rows" % rows)
+        return
+    if len(codes) == 1:
+        path = download_path(codes[0], args)
+        print("Downloading to file %s" % path)
+        keep = None
+        if args.keep_compressed:
+            keep = open(path + compression.COMPRESSED_SUFFIX, 'wb')
+        try:
+            with open(path, 'wb') as f:
+                client.table_export(codes[0],
+                        regionalschluessel=rs,
+                        format=args.format,
+                        fileobj=f,
+                        compress=args.compress,
+                        keep=keep)
+        finally:
+            if keep is not None:
+                keep.close()
+        return
+    failed = 0
+    for result in client.export_many(codes, regionalschluessel=rs,
+                                     format=args.format, workers=args.jobs,
+                                     target=lambda code: download_path(code, args),
+                                     compress=args.compress,
+                                     keep_compressed=args.keep_compressed):
+        if result.error is not None:
+            failed += 1
+            print("Failed to download %s: %s" % (result.table_code, result.error))
+            continue
+        print("Downloaded to file %s" % result.data)
+    if failed:
+        print("%d of %d downloads failed" % (failed, len(codes)))
 
 
 def search(client, args):
@@ -487,7 +1068,10 @@ def search(client, args):
     term = args.searchterm
     if type(term) != str:
         term = term.decode('utf8')
-    result = client.search(term)
+    if args.index is not None:
+        result = MetadataIndex(args.index).search(client.site, term)
+    else:
+        result = client.search(term)
     for cat in list(result['meta'].keys()):
         if result['meta'][cat] > 0:
             print("Hits of type '%s': %d" % (cat.upper(), result['meta'][cat]))
@@ -510,25 +1094,63 @@ def lookup(client, args):
     term = args.lookup
     if type(term) != str:
         term = term.decode('utf8')
-    for stat in gc.statistics(filter=term):
-        print("STATISTIC: %s %s" % (stat['id'], stat['description']))
-    for s in gc.statistic_data(statistic_code=term):
-        print("STATISTIC DATA: %s %s" % (s['id'], s['description']))
-    for s in gc.statistic_properties(statistic_code=term):
-        print("STATISTIC PROPERTY: %s %s" % (s['id'], s['description']))
-    for s in gc.statistic_tables(statistic_code=term):
-        print("STATISTIC TABLE: %s %s" % (s['id'], s['description']))
-    for prop in gc.properties(filter=term):
-        print("PROPERTY: %s %s" % (prop['id'], prop['description']))
-    if '*' not in term:
-        for prop in gc.property_occurrences(property_code=term):
-            print("PROPERTY OCCURRENCE: %s %s" % (prop['id'], prop['description']))
-    for prop in gc.property_data(property_code=term):
-        print("PROPERTY DATA: %s %s" % (prop['id'], prop['longdescription']))
-    for table in gc.tables(filter=term):
-        print("TABLE: %s %s" % (table['id'], table['description']))
-    for term in gc.terms(filter=term):
-        print("TERM: %s %s" % (term['id'], term['description']))
+    labels = {
+        'statistics': 'STATISTIC',
+        'statistic_data': 'STATISTIC DATA',
+        'statistic_properties': 'STATISTIC PROPERTY',
+        'statistic_tables': 'STATISTIC TABLE',
+        'properties': 'PROPERTY',
+        'property_occurrences': 'PROPERTY OCCURRENCE',
+        'property_data': 'PROPERTY DATA',
+        'tables': 'TABLE',
+        'terms': 'TERM',
+    }
+    if args.index is not None:
+        result = MetadataIndex(args.index).lookup(client.site, term)
+        results = [(KINDS[kind][1], result[kind])
+                   for kind in ('statistic', 'property', 'table', 'term')]
+    else:
+        results = client.iter_lookup(term)
+    for name, entries in results:
+        for entry in entries:
+            description = entry['description']
+            if name == 'property_data':
+                description = entry['longdescription']
+            print("%s: %s %s" % (labels[name], entry['id'], description))
+
+
+def run_batch(client, args):
+    """
+    Run the download jobs of the spec given via --batch, continuing
+    where an earlier run with the same queue file stopped
+    """
+    import sys
+    queue = jobs.JobQueue(args.queue or args.batch + '.queue')
+    added = queue.add(jobs.load_spec(args.batch))
+    if args.retry_failed:
+        queue.retry_failed()
+    counts = queue.counts()
+    print("%d new jobs, %d pending, %d done, %d failed" % (
+        added, counts['pending'] + counts['running'], counts['done'],
+        counts['failed']))
+    jobs.run(client, queue, workers=args.jobs,
+             progress=jobs.Progress(queue, stream=sys.stdout))
+    for table_code, rs, format, error in queue.errors():
+        print("Failed to download %s %s %s: %s" % (table_code, rs, format,
+                                                  error))
+
+
+def diff(args):
+    """
+    Print the differences between the two snapshots given via --diff
+    """
+    changes = snapshot.diff_snapshots(snapshot.load_snapshot(args.diff[0]),
+                                      snapshot.load_snapshot(args.diff[1]))
+    for kind in snapshot.KINDS:
+        for change, sign in (('added', '+'), ('removed', '-'),
+                             ('changed', '~')):
+            for code in changes[kind][change]:
+                print("%s %s %s" % (sign, kind, code))
 
 
 def main():
@@ -552,27 +1174,118 @@ def main():
                    help='Find an item using an actual search engine. Should accept Lucene syntax.')
     parser.add_argument('-d', '--downlaod', dest='download', default=None,
                    metavar="TABLE_ID",
-                   help='Download table with the ID TABLE_ID')
+                   help='Download table with the ID TABLE_ID. Several IDs can be given separated by commas.')
+    parser.add_argument('--download-list', dest='download_list', default=None,
+                   metavar="FILE", help='Download all tables listed in FILE, one ID per line (- for stdin)')
+    parser.add_argument('--sync', dest='sync', default=None,
+                   metavar="DIR", help='Keep CSV copies of the tables in DIR and only download data newer than the local copy')
+    parser.add_argument('-j', '--jobs', dest='jobs', default=4, type=int,
+                   metavar="N", help='Download up to N tables concurrently. Default is 4.')
     parser.add_argument('--rs', dest='regionalschluessel', default=None,
                    metavar="RS", help='Only select data for region key RS')
+    parser.add_argument('--rs-list', dest='rs_list', default=None,
+                   metavar="FILE", help='Download data for all region keys listed in FILE, one per line, into one file (see --fanout)')
+    parser.add_argument('--fanout', dest='fanout', action='store_true',
+                   help='Request the region keys given via --rs (comma separated, prefixes like 05* are split) concurrently and merge them into one CSV file with a region column')
+    parser.add_argument('-z', '--compress', dest='compress', action='store_true',
+                   help='Have the server compress downloads and unpack them while they arrive')
+    parser.add_argument('--keep-compressed', dest='keep_compressed', action='store_true',
+                   help='Also keep the compressed data next to each downloaded file (suffix .zip). Implies -z.')
     parser.add_argument('-f', '--format', dest='format', default='csv',
-                   metavar="FORMAT", help='Download data in this format (csv, html, xls). Default ist csv.')
+                   metavar="FORMAT", help='Download data in this format (csv, html, xls, parquet, arrow, feather). Default ist csv.')
+    parser.add_argument('--wsdl-cache', dest='wsdl_cache',
+                   default=os.path.join(os.path.expanduser('~'), '.genesisclient', 'wsdl-cache'),
+                   metavar="DIR", help='Keep parsed WSDLs in DIR. Default is ~/.genesisclient/wsdl-cache.')
+    parser.add_argument('--wsdl-dir', dest='wsdl_dir', default=BUNDLED_WSDL_DIR,
+                   metavar="DIR", help='Read WSDL files from DIR/SITE/ instead of fetching them')
+    parser.add_argument('--save-wsdl', dest='save_wsdl', default=None,
+                   metavar="DIR", help='Download the WSDLs of the site into DIR/SITE/ and exit')
+    parser.add_argument('--index', dest='index', default=None,
+                   metavar="FILE", help='Answer searches and lookups from the local metadata index FILE')
+    parser.add_argument('--harvest', dest='harvest', action='store_true',
+                   help='Load the catalogues of the site into the index given via --index and exit')
+    parser.add_argument('--cache', dest='cache', default=None,
+                   metavar="FILE", help='Cache catalogue responses in SQLite file FILE')
+    parser.add_argument('--cache-ttl', dest='cache_ttl', default=86400, type=int,
+                   metavar="SECONDS", help='Keep cached catalogue responses for SECONDS. Default is 86400.')
+    parser.add_argument('--store', dest='store', default=None,
+                   metavar="DIR", help='Keep downloaded tables in a local store in DIR and only download them again if they have changed')
+    parser.add_argument('--batch', dest='batch', default=None,
+                   metavar="SPEC", help='Download all combinations of the tables, regions and formats in the JSON job spec SPEC. Interrupted runs continue where they stopped.')
+    parser.add_argument('--queue', dest='queue', default=None,
+                   metavar="FILE", help='Keep the job queue of --batch in FILE. Default is SPEC.queue.')
+    parser.add_argument('--retry-failed', dest='retry_failed', action='store_true',
+                   help='With --batch, run failed jobs again')
+    parser.add_argument('--snapshot', dest='snapshot', default=None,
+                   metavar="FILE", help='Write a snapshot of all statistics, tables, properties and property occurrences of the site to FILE')
+    parser.add_argument('--diff', dest='diff', default=None, nargs=2,
+                   metavar=("OLD", "NEW"), help='Print the entries added, removed or changed between two snapshots')
+    parser.add_argument('--metrics', dest='metrics', action='store_true',
+                   help='Print request timings, sizes and errors per operation to stderr when done')
+    parser.add_argument('--statsd', dest='statsd', default=None,
+                   metavar="HOST:PORT", help='Send request metrics to the StatsD server at HOST:PORT')
 
     args = parser.parse_args()
+    if (args.fanout or args.rs_list is not None) and args.format != 'csv':
+        parser.error('--fanout and --rs-list only support the csv format')
+    if (args.fanout and args.regionalschluessel in (None, '*')
+            and args.rs_list is None):
+        parser.error('--fanout requires region keys given via --rs or --rs-list')
+    if args.keep_compressed:
+        args.compress = True
+    if args.diff is not None:
+        diff(args)
+        return
+
+    cache = None
+    if args.cache is not None:
+        cache = SqliteCache(args.cache, ttl=args.cache_ttl)
+
+    metrics = None
+    if args.statsd is not None:
+        host, _, port = args.statsd.partition(':')
+        metrics = StatsdMetrics(host, int(port or 8125))
+    elif args.metrics:
+        metrics = MetricsCollector()
 
     # create the webservice client
     gc = GenesisClient(args.site, username=args.username,
-                    password=args.password)
+                    password=args.password, cache=cache,
+                    wsdl_cache=args.wsdl_cache or None,
+                    wsdl_dir=args.wsdl_dir, metrics=metrics,
+                    store=TableStore(args.store) if args.store else None)
     # test if the service works
     #gc.test_service()
 
-    if args.download is not None:
+    if args.batch is not None:
+        run_batch(gc, args)
+    elif args.snapshot is not None:
+        result = gc.catalogue_snapshot(workers=args.jobs)
+        snapshot.save_snapshot(result, args.snapshot)
+        for kind in snapshot.KINDS:
+            print("Saved %d entries of type %s" % (
+                len(snapshot.flatten(result, kind)), kind))
+    elif args.harvest:
+        if args.index is None:
+            parser.error('--harvest requires --index')
+        counts = MetadataIndex(args.index).harvest(gc)
+        for kind in sorted(counts):
+            print("Indexed %d entries of type %s" % (counts[kind], kind))
+    elif args.save_wsdl is not None:
+        for path in gc.save_wsdl(args.save_wsdl):
+            print("Saved %s" % path)
+    elif args.download is not None or args.download_list is not None:
         download(gc, args)
     elif args.searchterm is not None:
         search(gc, args)
     elif args.lookup is not None:
         lookup(gc, args)
 
+    if isinstance(metrics, MetricsCollector):
+        import json
+        json.dump(metrics.snapshot(), sys.stderr, indent=2, sort_keys=True)
+        sys.stderr.write('\n')
+
     # See? All I allow you to do is download stuff.
     sys.exit()
 
@@ -0,0 +1,363 @@
+# encoding: utf8
+"""
+asyncio interface to the Genesis web services. Requires aiohttp.
+
+AsyncGenesisClient offers the catalogue methods and table downloads of
+GenesisClient as coroutines. Operations built on top of them, like
+export_many() or resolve(), are only offered by GenesisClient. SOAP
+requests are built by suds and responses decoded exactly like
+GenesisClient does it, but they are sent over an aiohttp session, so
+many requests can be in flight in a single thread.
+
+    async with AsyncGenesisClient('DESTATIS') as client:
+        tables, terms = await asyncio.gather(client.tables('11111*'),
+                                             client.terms('bev*'))
+"""
+import asyncio
+import io
+import logging
+import time
+from collections import OrderedDict
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from suds.transport import TransportError
+
+from genesisclient import (BaseGenesisClient, batch, columnar, compression,
+                           multipart, paging, soap)
+from genesisclient.metrics import error_kind
+from genesisclient.ratelimit import LimitedRequest
+
+# Default maximum number of concurrent requests to the site
+DEFAULT_CONCURRENCY = 20
+
+
+def retry_exceptions():
+    """Errors worth another attempt, see genesisclient.batch.is_transient()"""
+    return batch.RETRY_EXCEPTIONS + (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class AsyncLimitedRequest(LimitedRequest):
+    """LimitedRequest for use with async with"""
+
+    def __init__(self, limiter):
+        LimitedRequest.__init__(self, limiter)
+        self.exceptions = retry_exceptions()
+
+    async def __aenter__(self):
+        delay = self.limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.start = time.time()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return self.__exit__(exc_type, exc_value, traceback)
+
+
+async def retry(func, retries=3, backoff=1.0):
+    """
+    Coroutine version of genesisclient.batch.retry(), awaiting func()
+    until it succeeds, at most retries + 1 times.
+    """
+    exceptions = retry_exceptions()
+    attempt = 0
+    while True:
+        try:
+            return await func()
+        except exceptions as e:
+            if attempt >= retries or not batch.is_transient(e, exceptions):
+                raise
+            wait = backoff * (2 ** attempt)
+            logging.warning('Attempt %d failed (%s), retrying in %.1f s',
+                            attempt + 1, e, wait)
+            await asyncio.sleep(wait)
+            attempt += 1
+
+
+class AsyncGenesisClient(BaseGenesisClient):
+    """
+    Client whose methods are coroutines. Takes the arguments of
+    BaseGenesisClient and additionally:
+    concurrency: maximum number of concurrent requests to the site.
+        Further requests wait until one of them has finished.
+    session: aiohttp.ClientSession to use. By default the client
+        creates its own, which is closed by close().
+    """
+
+    def __init__(self, site, username=None, password=None,
+                 concurrency=DEFAULT_CONCURRENCY, session=None, **kwargs):
+        if aiohttp is None:
+            raise ImportError('AsyncGenesisClient requires aiohttp')
+        BaseGenesisClient.__init__(self, site, username=username,
+                                   password=password, **kwargs)
+        self.concurrency = concurrency
+        self.session = session
+        self.own_session = session is None
+        self.semaphore = None
+        self.async_service_clients = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """Closes the HTTP session, if it was created by the client"""
+        if self.own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def get_session(self):
+        """Returns the aiohttp session, creating it on first use"""
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit_per_host=self.concurrency)
+            timeout = aiohttp.ClientTimeout(
+                total=None, sock_read=self.connection_pool.timeout)
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 timeout=timeout)
+        return self.session
+
+    def get_semaphore(self):
+        """Returns the semaphore limiting concurrent requests"""
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.semaphore
+
+    async def service_client(self, name):
+        """
+        Returns the suds client of endpoint name, used to build requests
+        and decode faults. Loading the WSDL blocks, so it is done in a
+        thread.
+        """
+        if name not in self.async_service_clients:
+            loop = asyncio.get_running_loop()
+            client = await loop.run_in_executor(None, self.init_service_client,
+                                                name)
+            self.async_service_clients.setdefault(name, client)
+        return self.async_service_clients[name]
+
+    async def check(self, client, method, response):
+        """Raises WebFault or TransportError for unsuccessful responses"""
+        if response.status == 200:
+            return
+        body = await response.read()
+        if response.status == 500:
+            soap.raise_fault(client, method, body)
+        raise TransportError(response.reason, response.status)
+
+    async def _call(self, service, method, params):
+        """
+        Coroutine version of GenesisClient._call(), sharing its cache.
+        """
+        key = self.cache_key(service, method, params)
+        loop = asyncio.get_running_loop()
+        if key is not None:
+            # the cache may block on disk (SqliteCache)
+            result = await loop.run_in_executor(None, self.cache.get, key)
+            self.metrics.cache(self.site, method, result is not None)
+            if result is not None:
+                return result
+        client = await self.service_client(service)
+        request = soap.build_request(client, method, params)
+
+        async def send():
+            async with AsyncLimitedRequest(self.rate_limiter):
+                async with self.get_semaphore():
+                    with self.metrics.timer(self.site, method) as timer:
+                        async with self.get_session().post(
+                                request.url, data=request.message,
+                                headers=request.headers) as response:
+                            await self.check(client, method, response)
+                            result = await response.read()
+                            timer.size = len(result)
+            return result
+        result = await retry(send, retries=self.retries, backoff=self.backoff)
+        if key is not None:
+            await loop.run_in_executor(None, self.cache.set, key, result)
+        return result
+
+    async def _request(self, service, method, params, parser):
+        result = await self._call(service, method, params)
+        start = time.time()
+        result = parser(result)
+        self.metrics.parse(self.site, method, time.time() - start)
+        return result
+
+    async def iter_table_export(self, table_code,
+            regionalschluessel='',
+            format='csv',
+            startjahr='1900',
+            endjahr='2100',
+            zeitscheiben='',
+            compress=False,
+            keep=None):
+        """
+        Return data for a given table as an asynchronous iterator over
+        chunks of bytes. See GenesisClient.iter_table_export().
+        """
+        method, params = self.export_request(table_code,
+                                             regionalschluessel=regionalschluessel,
+                                             format=format,
+                                             startjahr=startjahr,
+                                             endjahr=endjahr,
+                                             zeitscheiben=zeitscheiben,
+                                             compress=compress)
+        client = await self.service_client('DownloadService')
+        request = soap.build_request(client, method, params)
+
+        async def send():
+            start = time.time()
+            try:
+                async with AsyncLimitedRequest(self.rate_limiter):
+                    response = await self.get_session().post(
+                        request.url, data=request.message,
+                        headers=request.headers)
+                    try:
+                        await self.check(client, method, response)
+                    except BaseException:
+                        response.release()
+                        raise
+                    return start, response
+            except Exception as e:
+                # every failed attempt is a request of its own
+                self.metrics.request(self.site, method, time.time() - start,
+                                     0, error_kind(e))
+                raise
+        async with self.get_semaphore():
+            # only opening the response is retried
+            start, response = await retry(send, retries=self.retries,
+                                          backoff=self.backoff)
+            with self.metrics.timer(self.site, method) as timer:
+                timer.start = start
+                async with response:
+                    reader = aiohttp.MultipartReader.from_response(response)
+                    envelope = None
+                    while True:
+                        part = await reader.next()
+                        if part is None:
+                            break
+                        if envelope is None:
+                            envelope = await part.read()
+                            continue
+                        decompressor = None
+                        if compress:
+                            decompressor = compression.Decompressor()
+                        while True:
+                            chunk = await part.read_chunk(multipart.CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            timer.size += len(chunk)
+                            if keep is not None:
+                                keep.write(chunk)
+                            if decompressor is not None:
+                                chunk = decompressor.decompress(chunk)
+                            if chunk:
+                                yield chunk
+                        if decompressor is not None:
+                            chunk = decompressor.flush()
+                            if chunk:
+                                yield chunk
+                        return
+                    raise multipart.MultipartError(
+                        'No attachment in response: %s' % envelope)
+
+    async def table_export(self, table_code,
+            regionalschluessel='',
+            format='csv',
+            fileobj=None,
+            startjahr='1900',
+            endjahr='2100',
+            zeitscheiben='',
+            compress=False,
+            keep=None):
+        """
+        Return data for a given table. If fileobj is given, the data is
+        written to it as it arrives and the number of bytes is returned.
+        Like GenesisClient.table_export(), the columnar formats are
+        downloaded as csv and converted while the data arrives. See
+        GenesisClient.iter_table_export() for the other parameters.
+        """
+        download_format = format
+        if format in columnar.FORMATS:
+            download_format = 'csv'
+        chunks = self.iter_table_export(table_code,
+                                        regionalschluessel=regionalschluessel,
+                                        format=download_format,
+                                        startjahr=startjahr,
+                                        endjahr=endjahr,
+                                        zeitscheiben=zeitscheiben,
+                                        compress=compress,
+                                        keep=keep)
+        if format in columnar.FORMATS:
+            out = fileobj
+            if out is None:
+                out = io.BytesIO()
+            converter = columnar.Converter(out, format=format)
+            async for chunk in chunks:
+                converter.feed(chunk)
+            size = converter.close()
+            if fileobj is None:
+                return out.getvalue()
+            return size
+        if fileobj is None:
+            return b''.join([chunk async for chunk in chunks])
+        size = 0
+        async for chunk in chunks:
+            fileobj.write(chunk)
+            size += len(chunk)
+        return size
+
+    async def iter_lookup(self, term, limit=500):
+        """
+        Queries all catalogues listed in lookup_methods for term
+        concurrently. Yields (method name, entries) tuples in the order
+        of lookup_methods, see GenesisClient.iter_lookup().
+        """
+        names = []
+        tasks = []
+        for name, argument in self.lookup_methods:
+            if name == 'property_occurrences' and '*' in term:
+                continue
+            kwargs = {argument: term, 'limit': limit}
+            names.append(name)
+            tasks.append(asyncio.ensure_future(getattr(self, name)(**kwargs)))
+        try:
+            for name, task in zip(names, tasks):
+                yield name, await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def lookup_all(self, term, limit=500):
+        """
+        Looks up term in all catalogues concurrently. Returns an
+        OrderedDict mapping catalogue method names to lists of entries.
+        """
+        return OrderedDict([item async for item in
+                            self.iter_lookup(term, limit=limit)])
+
+    async def iter_catalogue(self, method, filter='*',
+                             page_size=paging.PAGE_SIZE, **kwargs):
+        """
+        Asynchronous iterator over all entries of a catalogue whose codes
+        match filter, see GenesisClient.iter_catalogue().
+        """
+        argument = self.paged_methods[method]
+        pager = paging.Pager(filter, page_size)
+        while True:
+            current = pager.next()
+            if current is None:
+                break
+            params = dict(kwargs)
+            params[argument] = current
+            params['limit'] = page_size
+            entries = await getattr(self, method)(**params)
+            for entry in pager.add(current, entries):
+                yield entry
+        for entry in pager.leftovers():
+            yield entry
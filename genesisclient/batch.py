@@ -0,0 +1,170 @@
+# encoding: utf8
+"""
+Concurrent download of many tables.
+"""
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    from http.client import HTTPException
+except ImportError:  # Python 2
+    from httplib import HTTPException
+
+import suds
+import suds.transport
+
+from genesisclient.compression import COMPRESSED_SUFFIX
+from genesisclient.multipart import MultipartError
+
+# Errors that may be worth another attempt: HTTP errors, network errors
+# (URLError and socket errors are subclasses of IOError) and responses
+# cut off while being read. See is_transient().
+RETRY_EXCEPTIONS = (suds.transport.TransportError, IOError, HTTPException,
+                    MultipartError)
+
+# Maximum number of concurrent requests per site
+DEFAULT_SITE_LIMIT = 4
+
+_site_semaphores = {}
+_site_semaphores_lock = threading.Lock()
+
+ExportResult = namedtuple('ExportResult', ['table_code', 'data', 'error'])
+
+
+class RestartableFile(object):
+    """
+    Target of a download that may have to start over. Writes go to
+    file, which is fileobj itself if it can seek, otherwise a temporary
+    file copied to fileobj by finish().
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        seekable = getattr(fileobj, 'seekable', None)
+        if seekable is not None and seekable():
+            self.file = fileobj
+            self.start = fileobj.tell()
+        else:
+            self.file = tempfile.TemporaryFile()
+            self.start = 0
+
+    def restart(self):
+        """Discards everything written so far"""
+        self.file.seek(self.start)
+        self.file.truncate()
+
+    def finish(self):
+        """Copies the data to fileobj if it was written elsewhere"""
+        if self.file is not self.fileobj:
+            self.file.seek(0)
+            shutil.copyfileobj(self.file, self.fileobj)
+
+    def close(self):
+        if self.file is not self.fileobj:
+            self.file.close()
+
+
+def site_semaphore(site):
+    """
+    Returns the semaphore limiting concurrent requests to site. It is
+    shared by all clients in the process.
+    """
+    with _site_semaphores_lock:
+        if site not in _site_semaphores:
+            _site_semaphores[site] = threading.BoundedSemaphore(
+                DEFAULT_SITE_LIMIT)
+        return _site_semaphores[site]
+
+
+def is_transient(exception, exceptions=RETRY_EXCEPTIONS):
+    """
+    Returns whether exception, one of exceptions, is worth another
+    attempt: network errors, cut off responses and HTTP errors with
+    status 429 or 5xx. SOAP faults (e.g. for an unknown table or wrong
+    credentials) and other HTTP errors are not.
+    """
+    if not isinstance(exception, exceptions):
+        return False
+    status = getattr(exception, 'httpcode', None)
+    if status is None:
+        # urllib's HTTPError
+        status = getattr(exception, 'code', None)
+    if not isinstance(status, int):
+        return True
+    return status == 429 or status >= 500
+
+
+def retry(func, retries=3, backoff=1.0, exceptions=RETRY_EXCEPTIONS):
+    """
+    Calls func until it succeeds, at most retries + 1 times. Waits
+    backoff, 2 * backoff, 4 * backoff, ... seconds between attempts.
+    Errors that are not transient (see is_transient()) are raised at
+    once.
+    """
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except exceptions as e:
+            if attempt >= retries or not is_transient(e, exceptions):
+                raise
+            wait = backoff * (2 ** attempt)
+            logging.warning('Attempt %d failed (%s), retrying in %.1f s',
+                            attempt + 1, e, wait)
+            time.sleep(wait)
+            attempt += 1
+
+
+def export_many(client, table_codes, regionalschluessel='', format='csv',
+                workers=4, target=None, compress=False,
+                keep_compressed=False):
+    """
+    Downloads the tables in table_codes concurrently using up to workers
+    threads, but never more concurrent requests than the site allows.
+    Yields an ExportResult per table as soon as it is finished. Failed
+    downloads, after the retries of the client, are reported via
+    ExportResult.error.
+    If target is given, it is called with each table code and must
+    return a file path. Data is then streamed to that file and
+    ExportResult.data holds the path. compress is passed on to
+    client.table_export(). With keep_compressed, the data as received is
+    also written to the target path with COMPRESSED_SUFFIX appended.
+    """
+    semaphore = site_semaphore(client.site)
+
+    def export(table_code):
+        with semaphore:
+            if target is None:
+                return client.table_export(
+                    table_code, regionalschluessel=regionalschluessel,
+                    format=format, compress=compress)
+            path = target(table_code)
+            keep = None
+            if keep_compressed:
+                keep = open(path + COMPRESSED_SUFFIX, 'wb')
+            try:
+                with open(path, 'wb') as f:
+                    client.table_export(table_code,
+                                        regionalschluessel=regionalschluessel,
+                                        format=format, fileobj=f,
+                                        compress=compress, keep=keep)
+            finally:
+                if keep is not None:
+                    keep.close()
+            return path
+
+    def job(table_code):
+        try:
+            return ExportResult(table_code, export(table_code), None)
+        except Exception as e:
+            return ExportResult(table_code, None, e)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(job, code) for code in table_codes]
+        for future in as_completed(futures):
+            yield future.result()
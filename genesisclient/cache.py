@@ -0,0 +1,163 @@
+# encoding: utf8
+"""
+Response caches for catalogue calls.
+
+A cache maps a key (see make_key) to a raw SOAP response. Caches expire
+entries after `ttl` seconds and evict the least recently used entries
+once more than `maxsize` entries are stored. All caches count hits and
+misses and are safe to share between threads.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(site, method, params):
+    """
+    Build a cache key from site, SOAP method name and parameters.
+    The credentials (kennung and passwort) enter the key only as a hash
+    of both, so that responses are never served to other accounts or to
+    callers with a wrong password.
+    """
+    params = dict(params)
+    credentials = '%s\0%s' % (params.pop('kennung', None),
+                               params.pop('passwort', None))
+    normalized = json.dumps(params, sort_keys=True, default=str)
+    return '%s:%s:%s:%s' % (
+        site, hashlib.sha256(credentials.encode('utf-8')).hexdigest()[:32],
+        method, hashlib.sha1(normalized.encode('utf-8')).hexdigest())
+
+
+class BaseCache(object):
+
+    def __init__(self, maxsize=1024, ttl=86400):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self)
+        }
+
+    def get(self, key):
+        """Return the cached value for key or None"""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemoryCache(BaseCache):
+    """
+    In-process LRU cache with TTL.
+    """
+
+    def __init__(self, maxsize=1024, ttl=86400):
+        super(MemoryCache, self).__init__(maxsize=maxsize, ttl=ttl)
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class SqliteCache(BaseCache):
+    """
+    On-disk LRU cache with TTL, stored in a single SQLite file, so that
+    it survives across processes. Values must be bytes and are stored
+    as they are.
+    """
+
+    def __init__(self, path, maxsize=100000, ttl=86400):
+        super(SqliteCache, self).__init__(maxsize=maxsize, ttl=ttl)
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS cache ('
+                        'key TEXT PRIMARY KEY, '
+                        'expires REAL, '
+                        'accessed REAL, '
+                        'value BLOB)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS cache_accessed '
+                        'ON cache (accessed)')
+        self.db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT expires, value FROM cache '
+                                  'WHERE key = ?', (key,)).fetchone()
+            if row is not None and row[0] < now:
+                self.db.execute('DELETE FROM cache WHERE key = ?', (key,))
+                self.db.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute('UPDATE cache SET accessed = ? WHERE key = ?',
+                            (now, key))
+            self.db.commit()
+            self.hits += 1
+        return bytes(row[1])
+
+    def set(self, key, value):
+        now = time.time()
+        blob = sqlite3.Binary(value)
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO cache '
+                            '(key, expires, accessed, value) '
+                            'VALUES (?, ?, ?, ?)',
+                            (key, now + self.ttl, now, blob))
+            count = self.db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+            if count > self.maxsize:
+                self.db.execute('DELETE FROM cache WHERE key IN ('
+                                'SELECT key FROM cache ORDER BY accessed '
+                                'LIMIT ?)', (count - self.maxsize,))
+            self.db.commit()
+
+    def clear(self):
+        with self.lock:
+            self.db.execute('DELETE FROM cache')
+            self.db.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
@@ -0,0 +1,261 @@
+# encoding: utf8
+"""
+Conversion of CSV table exports to columnar formats: Parquet, Arrow IPC
+files (format "arrow") and Feather V2 (Arrow IPC files compressed with
+LZ4).
+
+The CSV export is converted while it is downloaded, in record batches
+of BATCH_SIZE rows, so memory usage does not depend on the size of the
+table. Column types are derived from the first batch as in
+parse_table(): value columns become float64 (NaN for placeholders),
+with an additional dictionary encoded column NAME_flag holding the
+placeholders, dimension columns become dictionary encoded strings
+whose field metadata holds their type ("time", "region" or
+"property"). The metadata lines above the table are stored as JSON in
+the schema metadata (key "meta"); Parquet files also hold the footer
+in their key-value metadata (key "footer"). Requires numpy and pyarrow.
+"""
+import codecs
+import json
+
+from genesisclient import parse
+from genesisclient.parse import (FOOTER_PREFIX, column_names, column_types,
+                                 split_blocks, split_cells, typed_columns)
+
+FORMATS = ('parquet', 'arrow', 'feather')
+
+# Rows per record batch (and Parquet row group)
+BATCH_SIZE = 65536
+
+ENCODING = 'latin-1'
+
+# pyarrow is optional and imported on first use
+pa = None
+
+
+def _import():
+    global pa
+    parse._import()
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.ipc
+        except ImportError:
+            raise ImportError('Columnar formats require pyarrow')
+        pa = pyarrow
+
+
+class CountingFile(object):
+    """Writable file object counting the bytes written to fileobj"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.size = 0
+        self.closed = False
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        if hasattr(self.fileobj, 'flush'):
+            self.fileobj.flush()
+
+    def close(self):
+        # the caller owns fileobj
+        self.closed = True
+
+
+class Dictionary(object):
+    """
+    Growing dictionary of a column. Later batches only append values, so
+    Arrow IPC files can store them as dictionary deltas.
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, column):
+        unique, inverse = parse.np.unique(column, return_inverse=True)
+        mapping = parse.np.empty(len(unique), dtype=parse.np.int32)
+        for i, value in enumerate(unique.tolist()):
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.values)
+                self.values.append(value)
+            mapping[i] = code
+        return pa.DictionaryArray.from_arrays(
+            pa.array(mapping[inverse.reshape(-1)], type=pa.int32()),
+            pa.array(self.values, type=pa.string()))
+
+
+class ColumnarWriter(object):
+    """
+    Converts a CSV table export fed to it in pieces of text (see feed())
+    to format and writes it to fileobj. Call close() after the last piece.
+    """
+
+    def __init__(self, fileobj, format='parquet', batch_size=BATCH_SIZE):
+        if format not in FORMATS:
+            raise ValueError('Unknown format %s' % format)
+        _import()
+        self.fileobj = fileobj
+        self.format = format
+        self.batch_size = batch_size
+        self.buffer = ''
+        self.head = ''
+        self.lines = []
+        self.meta = None
+        self.footer = None
+        self.width = None
+        self.types = None
+        self.schema = None
+        self.dictionaries = {}
+        self.writer = None
+        self.rows = 0
+
+    def feed(self, text):
+        self.buffer += text
+        end = self.buffer.rfind('\n')
+        if end < 0:
+            return
+        lines, self.buffer = self.buffer[:end + 1], self.buffer[end + 1:]
+        self._add(lines)
+
+    def _add(self, text, final=False):
+        if self.footer is not None:
+            self.footer += text.splitlines()
+            return
+        if self.types is None:
+            # collect a full batch to derive the column types from
+            self.head += text
+            if not final and self.head.count('\n') < self.batch_size:
+                return
+            blocks = split_blocks(self.head)
+            if not blocks['data']:
+                return
+            self.head = ''
+            self._start(blocks)
+            if blocks['footer']:
+                self.footer = blocks['footer']
+            lines = blocks['data'].splitlines()
+        else:
+            if text.startswith(FOOTER_PREFIX):
+                footer = 0
+            else:
+                footer = text.find('\n' + FOOTER_PREFIX) + 1 or len(text)
+            if footer < len(text):
+                self.footer = text[footer:].splitlines()
+            lines = text[:footer].splitlines()
+        self.lines += [line for line in lines if line.strip(';').strip()]
+        while len(self.lines) >= self.batch_size:
+            self._write(self.lines[:self.batch_size])
+            del self.lines[:self.batch_size]
+
+    def _start(self, blocks):
+        names = column_names(blocks)
+        self.width = len(names)
+        self.meta = blocks['meta']
+        lines = parse.head_lines(blocks['data'], self.batch_size)
+        self.types = column_types(names, split_cells('\n'.join(lines),
+                                                     self.width))
+        fields = []
+        for name, kind in self.types.values():
+            if kind == 'value':
+                fields.append(pa.field(name, pa.float64()))
+                fields.append(pa.field(name + '_flag', pa.dictionary(
+                    pa.int32(), pa.string())))
+            else:
+                fields.append(pa.field(name, pa.dictionary(
+                    pa.int32(), pa.string()), metadata={'type': kind}))
+        self.schema = pa.schema(fields, metadata={
+            'meta': json.dumps(self.meta)})
+        if self.format == 'parquet':
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(self.fileobj,
+                                                        self.schema)
+            return
+        compression = None
+        if self.format == 'feather' and pa.Codec.is_available('lz4'):
+            compression = 'lz4'
+        options = pa.ipc.IpcWriteOptions(compression=compression,
+                                         emit_dictionary_deltas=True)
+        self.writer = pa.ipc.new_file(self.fileobj, self.schema,
+                                      options=options)
+
+    def _write(self, lines):
+        cells = split_cells('\n'.join(lines), self.width)
+        # the schema is fixed, text in value columns goes to the flags
+        columns, flags = typed_columns(cells, self.types, text_as_flags=True)
+        arrays = []
+        for name, kind in self.types.values():
+            if kind == 'value':
+                arrays.append(pa.array(columns[name], type=pa.float64()))
+                arrays.append(self._encode(name + '_flag', flags[name]))
+            else:
+                arrays.append(self._encode(name, columns[name]))
+        self.writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        self.rows += len(lines)
+
+    def _encode(self, name, column):
+        if name not in self.dictionaries:
+            self.dictionaries[name] = Dictionary()
+        return self.dictionaries[name].encode(column)
+
+    def close(self):
+        """Writes the remaining rows and closes the writer"""
+        if self.buffer or self.types is None:
+            self._add(self.buffer, final=True)
+            self.buffer = ''
+        if self.types is None:
+            raise ValueError('Table contains no data')
+        if self.lines:
+            self._write(self.lines)
+            self.lines = []
+        if self.format == 'parquet' and self.footer:
+            self.writer.add_key_value_metadata(
+                {'footer': json.dumps(self.footer)})
+        self.writer.close()
+
+
+class Converter(object):
+    """
+    Converts a CSV table export fed to it in chunks of bytes to format
+    and writes it to fileobj.
+    """
+
+    def __init__(self, fileobj, format='parquet', encoding=ENCODING,
+                 batch_size=BATCH_SIZE):
+        self.out = CountingFile(fileobj)
+        self.writer = ColumnarWriter(self.out, format=format,
+                                     batch_size=batch_size)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+
+    def feed(self, chunk):
+        self.writer.feed(self.decoder.decode(chunk))
+
+    def close(self):
+        """Finishes the file and returns the number of bytes written"""
+        self.writer.feed(self.decoder.decode(b'', final=True))
+        self.writer.close()
+        return self.out.size
+
+
+def convert(chunks, fileobj, format='parquet', encoding=ENCODING,
+            batch_size=BATCH_SIZE):
+    """
+    Converts a CSV table export, given as an iterable of byte strings
+    (e.g. GenesisClient.iter_table_export()), to format ("parquet",
+    "arrow" or "feather") and writes it to fileobj. Returns the number
+    of bytes written.
+    """
+    converter = Converter(fileobj, format=format, encoding=encoding,
+                          batch_size=batch_size)
+    for chunk in chunks:
+        converter.feed(chunk)
+    return converter.close()
@@ -0,0 +1,107 @@
+# encoding: utf8
+"""
+Decompression of compressed table exports.
+
+With komprimierung=true, the DownloadService returns the table as a ZIP
+archive. Decompressor unpacks it while it is received, without
+buffering the archive: ZIP archives are read from their local file
+headers (only the first file is returned), gzip data is decompressed
+as well, anything else is passed through unchanged.
+"""
+import struct
+import zlib
+
+ZIP_MAGIC = b'PK\x03\x04'
+GZIP_MAGIC = b'\x1f\x8b'
+
+# File name suffix for compressed data kept on disk
+COMPRESSED_SUFFIX = '.zip'
+
+_zip_header = struct.Struct('<4sHHHHHIIIHH')
+
+
+class Decompressor(object):
+    """
+    Incremental decompressor with the interface of zlib decompression
+    objects: pass the data to decompress() in chunks of any size, and
+    call flush() at the end. Raises ValueError for unsupported or
+    truncated archives.
+    """
+
+    def __init__(self):
+        self.buffer = b''
+        self.mode = None
+        self.inflater = None
+        self.remaining = 0
+
+    def decompress(self, data):
+        if self.mode == 'done':
+            return b''
+        if self.buffer:
+            data = self.buffer + data
+            self.buffer = b''
+        if self.mode is None:
+            if len(data) < len(ZIP_MAGIC):
+                self.buffer = data
+                return b''
+            if data.startswith(ZIP_MAGIC):
+                self.mode = 'zip'
+            elif data.startswith(GZIP_MAGIC):
+                self.mode = 'inflate'
+                self.inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                self.mode = 'plain'
+        if self.mode == 'zip':
+            data = self._read_header(data)
+            if data is None or self.mode == 'done':
+                return b''
+        if self.mode == 'plain':
+            return data
+        if self.mode == 'stored':
+            data = data[:self.remaining]
+            self.remaining -= len(data)
+            if not self.remaining:
+                self.mode = 'done'
+            return data
+        out = self.inflater.decompress(data)
+        if self.inflater.eof:
+            # the rest is the central directory of the archive
+            self.mode = 'done'
+        return out
+
+    def _read_header(self, data):
+        """
+        Reads the local header of the first file in a ZIP archive and
+        returns the data following it, or None if it is incomplete.
+        """
+        if len(data) >= _zip_header.size:
+            (_, _, flags, method, _, _, _, size, _, name_length,
+             extra_length) = _zip_header.unpack_from(data)
+            end = _zip_header.size + name_length + extra_length
+            if len(data) >= end:
+                if method == zlib.DEFLATED:
+                    self.mode = 'inflate'
+                    self.inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+                elif method == 0 and not flags & 0x08 and size != 0xffffffff:
+                    self.mode = 'stored' if size else 'done'
+                    self.remaining = size
+                else:
+                    raise ValueError('Unsupported ZIP compression method %d'
+                                     % method)
+                return data[end:]
+        self.buffer = data
+        return None
+
+    def flush(self):
+        """Returns the remaining data"""
+        if self.mode is None:
+            self.mode = 'done'
+            return self.buffer
+        if self.mode == 'inflate':
+            out = self.inflater.flush()
+            if not self.inflater.eof:
+                raise ValueError('Compressed data is truncated')
+            return out
+        if self.mode in ('zip', 'stored'):
+            raise ValueError('Compressed data is truncated')
+        return b''
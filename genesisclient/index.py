@@ -0,0 +1,187 @@
+# encoding: utf8
+"""
+Local full-text index over the catalogues of a Genesis site.
+
+MetadataIndex.harvest() bulk-loads statistics, tables, properties and
+terms into an SQLite database with an FTS5 full-text index over code,
+description (inhalt) and long description (beschriftungstext). search()
+and lookup() then answer like GenesisClient.search() and the catalogue
+methods, without contacting the server.
+"""
+import re
+import sqlite3
+import threading
+
+from genesisclient.paging import PAGE_SIZE
+from genesisclient.responses import Entry, Hit
+
+# kind -> (object type as reported by Recherche, catalogue method, name
+# of the filter parameter)
+KINDS = {
+    'statistic': ('Statistik', 'statistics', 'filter'),
+    'table': ('Tabelle', 'tables', 'filter'),
+    'property': ('Merkmal', 'properties', 'filter'),
+    'term': ('Begriff', 'terms', 'filter'),
+}
+
+
+_token_re = re.compile(r'"[^"]*"|\S+')
+
+# Search terms matching every entry
+MATCH_ALL = ('*:*', '*')
+
+
+def fts_query(searchterm):
+    """
+    Translates a search term in the server's notation into an FTS5
+    query. Words are matched as prefixes if they end with "*", AND, OR
+    and NOT are kept as operators. Returns None for the server's default
+    term "*:*" (or "*"), which matches everything.
+    """
+    if searchterm.strip() in MATCH_ALL:
+        return None
+    out = []
+    for token in _token_re.findall(searchterm):
+        if token in ('AND', 'OR', 'NOT'):
+            out.append(token)
+            continue
+        prefix = token.endswith('*')
+        token = token.strip('*"').replace('"', '')
+        if not token:
+            continue
+        out.append('"%s"%s' % (token, '*' if prefix else ''))
+    return ' '.join(out)
+
+
+def like_pattern(filter):
+    """Translates a code filter with * wildcards into a LIKE pattern"""
+    escaped = filter.replace('\\', '\\\\').replace('%', '\\%')
+    escaped = escaped.replace('_', '\\_')
+    return escaped.replace('*', '%')
+
+
+class MetadataIndex(object):
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries ('
+                        'id INTEGER PRIMARY KEY, '
+                        'site TEXT, kind TEXT, code TEXT, '
+                        'description TEXT, longdescription TEXT, '
+                        'UNIQUE (site, kind, code))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_code '
+                        'ON entries (site, code COLLATE NOCASE)')
+        self.db.execute('CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts '
+                        'USING fts5(code, description, longdescription, '
+                        "content='entries', content_rowid='id')")
+        self.db.commit()
+
+    def add(self, site, kind, entries):
+        """
+        Adds or replaces catalogue entries (dicts with id, description
+        and optionally longdescription) of the given kind. Returns the
+        number of entries.
+        """
+        count = 0
+        with self.lock:
+            for entry in entries:
+                row = self.db.execute(
+                    'SELECT id, code, description, longdescription '
+                    'FROM entries WHERE site = ? AND kind = ? AND code = ?',
+                    (site, kind, entry['id'])).fetchone()
+                if row is not None:
+                    self.db.execute(
+                        'INSERT INTO entries_fts (entries_fts, rowid, code, '
+                        "description, longdescription) "
+                        "VALUES ('delete', ?, ?, ?, ?)", row)
+                    self.db.execute('DELETE FROM entries WHERE id = ?',
+                                    (row[0],))
+                cursor = self.db.execute(
+                    'INSERT INTO entries (site, kind, code, description, '
+                    'longdescription) VALUES (?, ?, ?, ?, ?)',
+                    (site, kind, entry['id'], entry.get('description'),
+                     entry.get('longdescription')))
+                self.db.execute(
+                    'INSERT INTO entries_fts (rowid, code, description, '
+                    'longdescription) VALUES (?, ?, ?, ?)',
+                    (cursor.lastrowid, entry['id'], entry.get('description'),
+                     entry.get('longdescription')))
+                count += 1
+            self.db.commit()
+        return count
+
+    def harvest(self, client, kinds=None, page_size=PAGE_SIZE):
+        """
+        Loads the complete catalogues of client's site into the index,
+        requesting them in pages of page_size entries. Returns a dict
+        with the number of entries per kind.
+        """
+        counts = {}
+        for kind in kinds or sorted(KINDS):
+            entries = client.iter_catalogue(KINDS[kind][1], page_size=page_size)
+            if kind == 'property':
+                long = dict((e['id'], e['longdescription'])
+                            for e in client.iter_catalogue(
+                                'property_data', page_size=page_size))
+                entries = self._with_longdescription(entries, long)
+            counts[kind] = self.add(client.site, kind, entries)
+        return counts
+
+    def _with_longdescription(self, entries, long):
+        for entry in entries:
+            entry['longdescription'] = long.get(entry['id'])
+            yield entry
+
+    def search(self, site, searchterm, limit=500, category='alle'):
+        """
+        Full-text search like GenesisClient.search(). Returns a dict with
+        the number of hits per object type (meta) and the hits (results).
+        """
+        query = fts_query(searchterm)
+        out = {
+            'meta': {},
+            'results': []
+        }
+        if query is None:
+            sql = ('SELECT kind, code, description FROM entries '
+                   'WHERE site = ? ORDER BY code')
+            args = (site,)
+        elif not query:
+            return out
+        else:
+            sql = ('SELECT e.kind, e.code, e.description FROM entries_fts '
+                   'JOIN entries e ON e.id = entries_fts.rowid '
+                   'WHERE entries_fts MATCH ? AND e.site = ? ORDER BY rank')
+            args = (query, site)
+        with self.lock:
+            rows = self.db.execute(sql, args).fetchall()
+        for kind, code, description in rows:
+            otype = KINDS[kind][0]
+            if category != 'alle' and otype != category:
+                continue
+            out['meta'][otype] = out['meta'].get(otype, 0) + 1
+            if len(out['results']) < limit:
+                out['results'].append(Hit(code, otype, code, description))
+        return out
+
+    def lookup(self, site, filter, kinds=None, limit=500):
+        """
+        Returns entries whose code matches filter (supporting asterisk
+        notation) as a dict mapping kinds to lists of entries.
+        """
+        out = {}
+        with self.lock:
+            for kind in kinds or sorted(KINDS):
+                rows = self.db.execute(
+                    'SELECT code, description, longdescription FROM entries '
+                    "WHERE site = ? AND kind = ? AND code LIKE ? ESCAPE '\\' "
+                    'ORDER BY code LIMIT ?',
+                    (site, kind, like_pattern(filter), limit)).fetchall()
+                out[kind] = [Entry(*row) for row in rows]
+        return out
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
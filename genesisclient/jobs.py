@@ -0,0 +1,305 @@
+# encoding: utf8
+"""
+Resumable bulk downloads.
+
+A job spec (JSON) lists tables, region keys and formats; every
+combination is one download job:
+
+    {"tables": ["12411-0015", "12411-0017"],
+     "regions": ["", "05*"],
+     "formats": ["csv"],
+     "directory": "downloads"}
+
+JobQueue keeps the jobs and their state (pending, running, done or
+failed) in an SQLite file, committing every change at once. run()
+downloads the pending jobs concurrently. Files are written under a
+temporary name and renamed when complete. After a crash or an
+interruption, running the same spec again continues with the jobs not
+done yet. Failed jobs are retried up to max_attempts times in total,
+each time after a pause growing exponentially, while other jobs go on.
+"""
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+STATES = ('pending', 'running', 'done', 'failed')
+
+Job = namedtuple('Job', ['id', 'table_code', 'regionalschluessel', 'format',
+                         'path', 'attempts'])
+
+
+def job_path(directory, table_code, regionalschluessel, format):
+    """Returns the output file path of a job"""
+    if regionalschluessel and regionalschluessel != '*':
+        name = '%s_%s.%s' % (table_code, regionalschluessel, format)
+    else:
+        name = '%s.%s' % (table_code, format)
+    return os.path.join(directory, name)
+
+
+def load_spec(path):
+    """
+    Reads a job spec and returns a list of (table_code,
+    regionalschluessel, format, path) tuples.
+    """
+    with open(path) as f:
+        spec = json.load(f)
+    directory = spec.get('directory', '.')
+    jobs = []
+    for table_code in spec['tables']:
+        for region in spec.get('regions') or ['']:
+            for format in spec.get('formats') or ['csv']:
+                jobs.append((table_code, region, format,
+                             job_path(directory, table_code, region, format)))
+    return jobs
+
+
+class JobQueue(object):
+    """
+    Persistent queue of download jobs in an SQLite file. Safe to share
+    between threads. A failed job is queued again, but not claimed
+    before backoff, 2 * backoff, 4 * backoff, ... seconds have passed.
+    """
+
+    def __init__(self, path, max_attempts=3, backoff=10.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                        'id INTEGER PRIMARY KEY, '
+                        'table_code TEXT, '
+                        'regionalschluessel TEXT, '
+                        'format TEXT, '
+                        'path TEXT, '
+                        "state TEXT DEFAULT 'pending', "
+                        'attempts INTEGER DEFAULT 0, '
+                        'error TEXT, '
+                        'size INTEGER, '
+                        'updated REAL, '
+                        'not_before REAL DEFAULT 0, '
+                        'UNIQUE (table_code, regionalschluessel, format))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_state '
+                        'ON jobs (state)')
+        self.db.commit()
+
+    def add(self, jobs):
+        """
+        Adds (table_code, regionalschluessel, format, path) jobs, skipping
+        those already queued, and returns the number of new jobs.
+        """
+        with self.lock:
+            before = self.db.total_changes
+            self.db.executemany('INSERT OR IGNORE INTO jobs (table_code, '
+                                'regionalschluessel, format, path, updated) '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                [tuple(job) + (time.time(),) for job in jobs])
+            self.db.commit()
+            return self.db.total_changes - before
+
+    def recover(self):
+        """
+        Returns jobs left running by an interrupted run to pending and
+        returns their number.
+        """
+        return self._reset('running')
+
+    def retry_failed(self):
+        """Returns failed jobs to pending and returns their number"""
+        with self.lock:
+            self.db.execute("UPDATE jobs SET attempts = 0, not_before = 0 "
+                            "WHERE state = 'failed'")
+        return self._reset('failed')
+
+    def _reset(self, state):
+        with self.lock:
+            cursor = self.db.execute("UPDATE jobs SET state = 'pending', "
+                                     "updated = ? WHERE state = ?",
+                                     (time.time(), state))
+            self.db.commit()
+            return cursor.rowcount
+
+    def claim(self):
+        """
+        Marks the next pending job that is due as running and returns it,
+        or None if there is none.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT id, table_code, regionalschluessel, '
+                                  'format, path, attempts FROM jobs '
+                                  "WHERE state = 'pending' AND not_before <= ? "
+                                  'ORDER BY not_before, id LIMIT 1',
+                                  (time.time(),)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE jobs SET state = 'running', "
+                            'attempts = attempts + 1, updated = ? '
+                            'WHERE id = ?', (time.time(), row[0]))
+            self.db.commit()
+        return Job(*row[:5], attempts=row[5] + 1)
+
+    def next_due(self):
+        """
+        Returns the seconds until the next pending job is due (0 if one
+        is due now), or None if no job is pending.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT MIN(not_before) FROM jobs "
+                                  "WHERE state = 'pending'").fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def done(self, job, size):
+        with self.lock:
+            self.db.execute("UPDATE jobs SET state = 'done', size = ?, "
+                            'error = NULL, updated = ? WHERE id = ?',
+                            (size, time.time(), job.id))
+            self.db.commit()
+
+    def failed(self, job, error):
+        """
+        Records a failure. The job is queued again, to be claimed after a
+        pause, unless it has been attempted max_attempts times.
+        """
+        state = 'failed' if job.attempts >= self.max_attempts else 'pending'
+        now = time.time()
+        not_before = now + self.backoff * (2 ** (job.attempts - 1))
+        with self.lock:
+            self.db.execute('UPDATE jobs SET state = ?, error = ?, '
+                            'updated = ?, not_before = ? WHERE id = ?',
+                            (state, str(error), now, not_before, job.id))
+            self.db.commit()
+        return state
+
+    def counts(self):
+        """Returns a dict mapping each state to its number of jobs"""
+        counts = dict((state, 0) for state in STATES)
+        with self.lock:
+            for state, count in self.db.execute('SELECT state, COUNT(*) '
+                                                'FROM jobs GROUP BY state'):
+                counts[state] = count
+        return counts
+
+    def errors(self):
+        """
+        Returns (table_code, regionalschluessel, format, error) tuples
+        for the failed jobs.
+        """
+        with self.lock:
+            return self.db.execute('SELECT table_code, regionalschluessel, '
+                                   'format, error FROM jobs '
+                                   "WHERE state = 'failed' ORDER BY id"
+                                   ).fetchall()
+
+
+class Progress(object):
+    """
+    Prints the number of jobs per state and the download throughput to
+    stream every interval seconds.
+    """
+
+    def __init__(self, queue, interval=5.0, stream=None):
+        self.queue = queue
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.start = time.time()
+        self.bytes = 0
+        self.jobs = 0
+        self.lock = threading.Lock()
+        self.printed = 0.0
+
+    def add(self, size):
+        with self.lock:
+            self.bytes += size
+            self.jobs += 1
+
+    def report(self, force=False):
+        now = time.time()
+        with self.lock:
+            if not force and now - self.printed < self.interval:
+                return
+            self.printed = now
+            elapsed = max(now - self.start, 1e-9)
+            counts = self.queue.counts()
+            self.stream.write(
+                '%d done, %d failed, %d running, %d pending; '
+                '%.2f jobs/s, %.1f kB/s\n' % (
+                    counts['done'], counts['failed'], counts['running'],
+                    counts['pending'], self.jobs / elapsed,
+                    self.bytes / elapsed / 1024))
+            self.stream.flush()
+
+
+def run(client, queue, workers=4, progress=None):
+    """
+    Runs the pending jobs of queue with client using up to workers
+    threads, after returning jobs of interrupted runs to pending. A
+    download failing even after the retries of the client counts as a
+    failed attempt of its job. Returns the counts of queue.
+    """
+    queue.recover()
+
+    def download(job):
+        directory = os.path.dirname(job.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        tmp = job.path + '.part'
+        try:
+            with open(tmp, 'wb') as f:
+                size = client.table_export(
+                    job.table_code,
+                    regionalschluessel=job.regionalschluessel,
+                    format=job.format, fileobj=f)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        os.replace(tmp, job.path)
+        return size
+
+    def worker():
+        while True:
+            job = queue.claim()
+            if job is None:
+                delay = queue.next_due()
+                if delay is None:
+                    return
+                # wait for a job queued again after a failure
+                time.sleep(min(delay, 1.0))
+                continue
+            try:
+                size = download(job)
+            except Exception as e:
+                state = queue.failed(job, e)
+                logging.warning('Job %s %s %s failed (%s), %s',
+                                job.table_code, job.regionalschluessel,
+                                job.format, e,
+                                'giving up' if state == 'failed'
+                                else 'will retry')
+                continue
+            queue.done(job, size)
+            if progress is not None:
+                progress.add(size)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(worker) for _ in range(workers)]
+        running = futures
+        while running:
+            _, running = wait(running, timeout=progress.interval
+                              if progress is not None else None)
+            if progress is not None and running:
+                progress.report()
+        for future in futures:
+            future.result()
+    if progress is not None:
+        progress.report(force=True)
+    return queue.counts()
@@ -0,0 +1,121 @@
+# encoding: utf8
+"""
+Access to several Genesis sites from many threads.
+
+ClientManager creates one GenesisClient per site on first use and
+shares it between all threads, so the WSDLs of a site are only loaded
+and parsed once. GenesisClient itself gives every thread its own suds
+client (suds clients must not be used concurrently), cloned from the
+first one, and all clients share one HTTP connection pool.
+
+query() runs a client method on several sites concurrently:
+
+    manager = ClientManager(credentials={'REGIONAL': ('user', 'secret')})
+    results = manager.query('tables', ['DESTATIS', 'REGIONAL'], '12411*')
+    for site, entry in manager.merge(results):
+        ...
+"""
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SiteResult = namedtuple('SiteResult', ['site', 'result', 'error'])
+
+
+class ClientManager(object):
+    """
+    Thread-safe registry of GenesisClients, one per site.
+    credentials: dict mapping sites to (username, password) tuples
+    workers: number of threads used by query()
+    Further keyword arguments (cache, metrics, wsdl_cache, ...) are
+    passed on to every GenesisClient.
+    """
+
+    def __init__(self, credentials=None, workers=8, **options):
+        self.credentials = credentials or {}
+        self.workers = workers
+        self.options = options
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def client(self, site):
+        """Returns the GenesisClient for site, creating it on first use"""
+        with self.lock:
+            client = self.clients.get(site)
+            if client is None:
+                from genesisclient import GenesisClient
+                username, password = self.credentials.get(site, (None, None))
+                client = self.clients[site] = GenesisClient(
+                    site, username=username, password=password,
+                    **self.options)
+            return client
+
+    __getitem__ = client
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers)
+            return self.pool
+
+    def iter_query(self, method, sites, *args, **kwargs):
+        """
+        Calls method (a GenesisClient method name like 'tables') with the
+        given arguments on all sites concurrently. Yields a SiteResult
+        (site, result, error) per site as soon as its call is finished.
+        """
+        def call(site):
+            try:
+                client = self.client(site)
+                return SiteResult(site, getattr(client, method)(*args,
+                                                                 **kwargs),
+                                  None)
+            except Exception as e:
+                return SiteResult(site, None, e)
+        pool = self.get_pool()
+        futures = [pool.submit(call, site) for site in sites]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def query(self, method, sites, *args, **kwargs):
+        """
+        Like iter_query(), but returns an OrderedDict mapping the sites,
+        in the given order, to the results. Raises the error of the
+        first site failing.
+        """
+        results = dict((r.site, r) for r in
+                       self.iter_query(method, sites, *args, **kwargs))
+        out = OrderedDict()
+        for site in sites:
+            if results[site].error is not None:
+                raise results[site].error
+            out[site] = results[site].result
+        return out
+
+    def merge(self, results):
+        """
+        Merges the results of query() for a catalogue method into one
+        list of (site, entry) tuples. Search results (dicts with 'results')
+        are merged as well.
+        """
+        out = []
+        for site, result in results.items():
+            if isinstance(result, dict):
+                result = result.get('results', [])
+            out += [(site, entry) for entry in result]
+        return out
+
+    def close(self):
+        """Shuts down the threads of query()"""
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
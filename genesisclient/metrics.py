@@ -0,0 +1,182 @@
+# encoding: utf8
+"""
+Instrumentation of the requests made by GenesisClient.
+
+A client reports to its metrics object, per site and SOAP operation
+(Recherche, TabellenDownload, MerkmalsKatalog, ...), the latency and
+response size of every request, whether it failed, the time spent
+decoding its response and cache hits and misses. Metrics ignores all
+of it; MetricsCollector aggregates the measurements in memory and
+StatsdMetrics sends them to a StatsD server. Subclass Metrics to feed
+them into other monitoring systems.
+"""
+import socket
+import threading
+import time
+
+import suds
+
+
+def error_kind(exception):
+    """Returns 'fault' for SOAP faults, the exception class name otherwise"""
+    if isinstance(exception, suds.WebFault):
+        return 'fault'
+    return exception.__class__.__name__
+
+
+class RequestTimer(object):
+    """
+    Context manager measuring a request. Set size to the number of
+    bytes received before leaving it.
+    """
+
+    def __init__(self, metrics, site, operation):
+        self.metrics = metrics
+        self.site = site
+        self.operation = operation
+        self.size = 0
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        error = None
+        # GeneratorExit and the like mean the caller stopped reading,
+        # not that the request failed
+        if exc_value is not None and isinstance(exc_value, Exception):
+            error = error_kind(exc_value)
+        self.metrics.request(self.site, self.operation,
+                             time.time() - self.start, self.size, error)
+        return False
+
+
+class Metrics(object):
+    """
+    Receives measurements from a GenesisClient and ignores them.
+    """
+
+    def request(self, site, operation, seconds, size, error=None):
+        """
+        Called after every request. size is the number of bytes received,
+        error None for successful requests, 'fault' for SOAP faults and
+        the name of the exception class for other errors.
+        """
+
+    def parse(self, site, operation, seconds):
+        """Called after decoding a response"""
+
+    def cache(self, site, operation, hit):
+        """Called after looking up a response in the cache"""
+
+    def timer(self, site, operation):
+        """Returns a RequestTimer reporting to request()"""
+        return RequestTimer(self, site, operation)
+
+
+class MetricsCollector(Metrics):
+    """
+    Aggregates measurements in memory, safe to share between threads
+    and clients. snapshot() returns them as a dict.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def _stats(self, site, operation):
+        key = (site, operation)
+        stats = self.operations.get(key)
+        if stats is None:
+            stats = self.operations[key] = {
+                'requests': 0,
+                'errors': 0,
+                'faults': 0,
+                'seconds': 0.0,
+                'max_seconds': 0.0,
+                'bytes': 0,
+                'parse_seconds': 0.0,
+                'cache_hits': 0,
+                'cache_misses': 0,
+            }
+        return stats
+
+    def request(self, site, operation, seconds, size, error=None):
+        with self.lock:
+            stats = self._stats(site, operation)
+            stats['requests'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['bytes'] += size
+            if error == 'fault':
+                stats['faults'] += 1
+            elif error is not None:
+                stats['errors'] += 1
+
+    def parse(self, site, operation, seconds):
+        with self.lock:
+            self._stats(site, operation)['parse_seconds'] += seconds
+
+    def cache(self, site, operation, hit):
+        with self.lock:
+            stats = self._stats(site, operation)
+            stats['cache_hits' if hit else 'cache_misses'] += 1
+
+    def snapshot(self):
+        """
+        Returns a dict mapping sites to dicts mapping operations to their
+        counters: requests, errors, faults, seconds, max_seconds,
+        mean_seconds, bytes, parse_seconds, cache_hits and cache_misses.
+        """
+        out = {}
+        with self.lock:
+            for (site, operation), stats in self.operations.items():
+                stats = dict(stats)
+                stats['mean_seconds'] = (stats['seconds'] / stats['requests']
+                                         if stats['requests'] else 0.0)
+                out.setdefault(site, {})[operation] = stats
+        return out
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+
+
+class StatsdMetrics(Metrics):
+    """
+    Sends measurements to a StatsD server via UDP, as metrics named
+    prefix.SITE.OPERATION.requests, .latency, .bytes, .errors, .faults,
+    .parse, .cache_hits and .cache_misses.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='genesisclient'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, site, operation, *metrics):
+        name = '%s.%s.%s.' % (self.prefix, site, operation)
+        data = '\n'.join(name + metric for metric in metrics)
+        try:
+            self.socket.sendto(data.encode('utf-8'), self.address)
+        except socket.error:
+            # metrics must never break requests
+            pass
+
+    def request(self, site, operation, seconds, size, error=None):
+        metrics = ['requests:1|c',
+                   'latency:%d|ms' % round(seconds * 1000),
+                   'bytes:%d|c' % size]
+        if error == 'fault':
+            metrics.append('faults:1|c')
+        elif error is not None:
+            metrics.append('errors:1|c')
+        self.send(site, operation, *metrics)
+
+    def parse(self, site, operation, seconds):
+        self.send(site, operation, 'parse:%d|ms' % round(seconds * 1000))
+
+    def cache(self, site, operation, hit):
+        self.send(site, operation,
+                  'cache_hits:1|c' if hit else 'cache_misses:1|c')
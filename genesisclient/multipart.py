@@ -0,0 +1,185 @@
+# encoding: utf8
+"""
+Incremental decoder for the MIME multipart responses (SOAP with
+attachments) returned by the DownloadService.
+
+The response is read in chunks of constant size, so memory usage does
+not depend on the size of the attachment.
+"""
+import re
+
+CHUNK_SIZE = 64 * 1024
+
+_boundary_re = re.compile(r'boundary="?([^";]+)"?', re.I)
+
+
+def boundary_from_content_type(content_type):
+    """Returns the boundary parameter of a multipart content type or None"""
+    if not content_type:
+        return None
+    match = _boundary_re.search(content_type)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+class MultipartError(Exception):
+    pass
+
+
+class Part(object):
+    """
+    One part of a multipart message. The body can only be read once,
+    and only before the next part is requested.
+    """
+
+    def __init__(self, reader, headers):
+        self.reader = reader
+        self.headers = headers
+
+    @property
+    def content_type(self):
+        return self.headers.get('content-type', '')
+
+    def iter_chunks(self):
+        """Yields the body in chunks of bytes"""
+        return self.reader.iter_body()
+
+    def read(self):
+        """Returns the whole body. Only use for small parts."""
+        return b''.join(self.iter_chunks())
+
+    def write_to(self, fileobj):
+        """Writes the body to fileobj and returns the number of bytes"""
+        size = 0
+        for chunk in self.iter_chunks():
+            fileobj.write(chunk)
+            size += len(chunk)
+        return size
+
+
+class MultipartReader(object):
+    """
+    Reads the parts of a multipart message from the file-like object fp.
+    If boundary is None, it is taken from the first line of the message.
+    """
+
+    def __init__(self, fp, boundary=None, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        # Messages may start with the delimiter directly or with a line
+        # break, so a line break is prepended and delimiters are always
+        # matched including their leading line break.
+        self.buffer = b'\r\n'
+        self.eof = False
+        self.finished = False
+        self.in_body = False
+        if boundary is None:
+            boundary = self._detect_boundary()
+        if not isinstance(boundary, bytes):
+            boundary = boundary.encode('ascii')
+        self.delimiter = b'\r\n--' + boundary
+
+    def _fill(self):
+        """Reads the next chunk into the buffer. Returns False at EOF."""
+        if self.eof:
+            return False
+        data = self.fp.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer += data
+        return True
+
+    def _detect_boundary(self):
+        while True:
+            stripped = self.buffer.lstrip(b'\r\n')
+            pos = stripped.find(b'\r\n')
+            if pos >= 0:
+                break
+            if not self._fill():
+                raise MultipartError('No multipart boundary found')
+        line = stripped[:pos]
+        if not line.startswith(b'--'):
+            raise MultipartError('Message does not start with a boundary')
+        return line[2:]
+
+    def _skip_to_delimiter(self):
+        """Discards data up to and including the next delimiter"""
+        while True:
+            pos = self.buffer.find(self.delimiter)
+            if pos >= 0:
+                self.buffer = self.buffer[pos + len(self.delimiter):]
+                return
+            keep = len(self.delimiter) - 1
+            if len(self.buffer) > keep:
+                self.buffer = self.buffer[-keep:]
+            if not self._fill():
+                raise MultipartError('Unexpected end of multipart message')
+
+    def _read_headers(self):
+        """Parses part headers following a delimiter. None at the end."""
+        while len(self.buffer) < 2 and self._fill():
+            pass
+        if self.buffer.startswith(b'--'):
+            self.finished = True
+            return None
+        while True:
+            pos = self.buffer.find(b'\r\n\r\n')
+            if pos >= 0:
+                break
+            if not self._fill():
+                raise MultipartError('Unexpected end of part headers')
+        block = self.buffer[:pos].decode('latin-1')
+        self.buffer = self.buffer[pos + 4:]
+        headers = {}
+        for line in block.split('\r\n'):
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        return headers
+
+    def iter_body(self):
+        """Yields the body of the current part, up to the next delimiter"""
+        if not self.in_body:
+            return
+        keep = len(self.delimiter) - 1
+        while True:
+            pos = self.buffer.find(self.delimiter)
+            if pos >= 0:
+                if pos > 0:
+                    yield self.buffer[:pos]
+                self.buffer = self.buffer[pos + len(self.delimiter):]
+                self.in_body = False
+                return
+            if len(self.buffer) > keep:
+                yield self.buffer[:-keep]
+                self.buffer = self.buffer[-keep:]
+            if not self._fill():
+                raise MultipartError('Unexpected end of multipart message')
+
+    def parts(self):
+        """
+        Yields Part objects. Each part's body must be consumed (or is
+        skipped) before the next part is yielded.
+        """
+        self._skip_to_delimiter()
+        while not self.finished:
+            headers = self._read_headers()
+            if headers is None:
+                return
+            self.in_body = True
+            yield Part(self, headers)
+            for _ in self.iter_body():
+                pass
+
+
+def attachments(fp, boundary=None, chunk_size=CHUNK_SIZE):
+    """
+    Yields the parts of a SOAP response with attachments, skipping the
+    first part (the SOAP envelope).
+    """
+    reader = MultipartReader(fp, boundary=boundary, chunk_size=chunk_size)
+    for i, part in enumerate(reader.parts()):
+        if i > 0:
+            yield part
@@ -0,0 +1,178 @@
+# encoding: utf8
+"""
+Pagination of catalogue queries.
+
+Catalogue responses are silently truncated after listenLaenge entries.
+To get all entries matching a filter, a query returning a full page is
+replaced by narrower ones, one per character a code may continue with
+('1*' becomes '1', '10*', '11*', ...), recursively until every page has
+room to spare. The characters are those of CODE_CHARACTERS and
+EXTRA_CHARACTERS plus any other character following the prefix in the
+codes of the full page, so terms with umlauts or spaces are found as
+well. Entries of a full page the narrower queries did not return are
+still yielded, with a warning.
+"""
+import logging
+import string
+
+# Characters codes may continue with. Filters are matched ignoring case,
+# so lower case letters are not needed.
+CODE_CHARACTERS = string.digits + string.ascii_uppercase + '-_.'
+
+# Further characters of terms and descriptive codes
+EXTRA_CHARACTERS = 'ÄÖÜß ,/()&+\''
+
+# Characters that cannot be used in filters
+WILDCARDS = '*?'
+
+PAGE_SIZE = 500
+
+
+def split_filter(filter, characters=CODE_CHARACTERS):
+    """
+    Returns narrower filters matching the same codes as filter together,
+    or None if filter does not end with an asterisk.
+    """
+    if not filter.endswith('*'):
+        return None
+    prefix = filter[:-1]
+    filters = []
+    if prefix and not prefix.endswith('*'):
+        # the code equal to the prefix itself
+        filters.append(prefix)
+    filters.extend(prefix + c + '*' for c in characters)
+    return filters
+
+
+def page_characters(prefix, entries, characters=CODE_CHARACTERS):
+    """
+    Returns characters, EXTRA_CHARACTERS and every other character
+    following prefix in the codes of entries, each once ignoring case.
+    """
+    out = []
+    seen = set()
+    found = [entry['id'][len(prefix)] for entry in entries
+             if len(entry['id']) > len(prefix)
+             and entry['id'][:len(prefix)].lower() == prefix.lower()]
+    for c in list(characters) + list(EXTRA_CHARACTERS) + found:
+        if c.lower() not in seen and c not in WILDCARDS:
+            seen.add(c.lower())
+            out.append(c)
+    return ''.join(out)
+
+
+def narrower_filters(filter, entries, page_size, characters=CODE_CHARACTERS):
+    """
+    Returns the filters to query instead of filter if entries, its
+    response, is a full page. Returns None if entries is complete or
+    filter cannot be split.
+    """
+    if len(entries) < page_size:
+        return None
+    filters = None
+    if filter.endswith('*'):
+        filters = split_filter(filter, page_characters(filter[:-1], entries,
+                                                       characters))
+    if filters is None:
+        logging.warning('Catalogue page for filter %r is full and cannot be '
+                        'split, entries may be missing', filter)
+    return filters
+
+
+class Pager(object):
+    """
+    State of paging through a catalogue: the filters still to query
+    and the full pages being split. For each response to the filter
+    returned by next(), add() returns the entries to yield, followed by
+    the entries of split full pages that none of their narrower queries
+    returned, as soon as these queries are done. Memory use depends on
+    the depth of splitting, not on the number of entries: only the open
+    full pages are kept, and every code seen only if filter has inner
+    asterisks, as its narrower filters may match an entry twice.
+    """
+
+    def __init__(self, filter='*', page_size=PAGE_SIZE,
+                 characters=CODE_CHARACTERS):
+        self.page_size = page_size
+        self.characters = characters
+        self.pending = [filter]
+        self.seen = set() if '*' in filter[:-1] else None
+        # (filter, entries, their codes, codes not returned yet,
+        # len(pending) before its narrower filters) of the split pages,
+        # innermost last
+        self.split_pages = []
+
+    def next(self):
+        """Returns the next filter to query, or None when done"""
+        if not self.pending:
+            return None
+        return self.pending.pop()
+
+    def add(self, filter, entries):
+        filters = narrower_filters(filter, entries, self.page_size,
+                                   self.characters)
+        if filters is not None:
+            codes = set(entry['id'] for entry in entries)
+            self.split_pages.append((filter, entries, codes, set(codes),
+                                     len(self.pending)))
+            self.pending.extend(reversed(filters))
+            return []
+        out = [entry for entry in entries if self._first(entry)]
+        # the narrower queries of the innermost pages may be done now
+        while (self.split_pages
+               and len(self.pending) <= self.split_pages[-1][4]):
+            out.extend(self._close())
+        return out
+
+    def _first(self, entry):
+        """Returns whether entry is new, and records it"""
+        code = entry['id']
+        if self.seen is not None:
+            if code in self.seen:
+                return False
+            self.seen.add(code)
+        new = True
+        for _, _, codes, missing, _ in self.split_pages:
+            if code in missing:
+                missing.discard(code)
+            elif code in codes:
+                # returned before
+                new = False
+        return new
+
+    def _close(self):
+        """Returns the entries of the innermost split page not yielded yet"""
+        filter, entries, _, missing, _ = self.split_pages.pop()
+        out = [entry for entry in entries
+               if entry['id'] in missing and self._first(entry)]
+        if out:
+            logging.warning('%d entries of the full catalogue page for '
+                            'filter %r were not returned by narrower '
+                            'queries, others may be missing',
+                            len(out), filter)
+        return out
+
+    def leftovers(self):
+        """Returns the entries of split pages not yielded yet"""
+        out = []
+        while self.split_pages:
+            out.extend(self._close())
+        return out
+
+
+def iter_pages(fetch, filter='*', page_size=PAGE_SIZE,
+               characters=CODE_CHARACTERS):
+    """
+    Yields all catalogue entries matching filter. fetch(filter, limit)
+    must return the entries for one query. Pages are fetched only as the
+    entries are consumed.
+    """
+    pager = Pager(filter, page_size, characters)
+    while True:
+        current = pager.next()
+        if current is None:
+            break
+        for entry in pager.add(current, fetch(current, page_size)):
+            yield entry
+    for entry in pager.leftovers():
+        yield entry
@@ -0,0 +1,371 @@
+# encoding: utf8
+"""
+Parser for tables exported in Genesis' CSV format.
+
+An exported table consists of a few lines of metadata (table code and
+title), one or more header lines naming the columns, the data lines and
+a footer starting with a line of underscores. Cells are separated by
+";", numbers use a decimal comma, and missing or confidential values
+are given as placeholders like "-", "." or "x".
+
+parse_table() separates these blocks and returns the data as typed
+NumPy column arrays. Requires numpy; pandas is used if installed.
+"""
+import io
+import re
+from collections import OrderedDict
+
+# numpy and pandas are optional and imported on first use, so that
+# importing genesisclient stays fast.
+np = None
+pd = None
+
+
+def _import():
+    global np, pd
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError('parse_table requires numpy')
+        np = numpy
+        try:
+            import pandas
+            pd = pandas
+        except ImportError:
+            pd = False
+
+
+# Placeholders used by the statistical offices instead of numbers
+PLACEHOLDERS = ('-', '.', 'x', 'X', '...', '/', '()', '')
+
+FOOTER_PREFIX = '__________'
+
+_number_re = re.compile(r'^-?(\d{1,3}(\.\d{3})+|\d+)(,\d+)?$')
+_time_name_re = re.compile(r'jahr|zeit|stichtag|monat|quartal|datum', re.I)
+_time_value_re = re.compile(r'^(\d{4}|\d{2}\.\d{2}\.\d{4}|\d{4}-\d{2}'
+                            r'|\d{4}(m|q)\d{1,2}|[A-Za-zäöü]+ \d{4})$', re.I)
+_region_name_re = re.compile(r'region|kreis|gemeinde|land|bezirk|ags', re.I)
+_year_re = re.compile(r'(?<!\d)((?:18|19|20|21)\d{2})')
+_region_value_re = re.compile(r'^\d{2,12}$')
+
+SAMPLE_SIZE = 200
+
+
+def _is_value(cell):
+    return cell in PLACEHOLDERS or _number_re.match(cell) is not None
+
+
+def _last_cell(cells):
+    for cell in reversed(cells):
+        if cell != '':
+            return cell
+    return ''
+
+
+def split_blocks(text):
+    """
+    Splits an exported table into metadata lines, header lines, the data
+    block and footer lines. Returns a dict with these entries. The
+    data block is returned as one string, without splitting it into
+    lines, and extends from the first line holding a value in its last
+    cell to the footer. "head" is the raw text above the data block.
+    """
+    footer = []
+    footer_pos = text.find('\n' + FOOTER_PREFIX)
+    if footer_pos >= 0:
+        footer = text[footer_pos + 1:].splitlines()
+        text = text[:footer_pos]
+    text = text.rstrip()
+    while text and text[text.rfind('\n') + 1:].strip(';') == '':
+        text = text[:max(text.rfind('\n'), 0)].rstrip()
+    head = []
+    pos = 0
+    while pos < len(text):
+        newline = text.find('\n', pos)
+        if newline < 0:
+            newline = len(text)
+        line = text[pos:newline].rstrip('\r')
+        if ';' in line and _is_value(_last_cell(line.split(';'))):
+            break
+        head.append(line)
+        pos = newline + 1
+    data = text[pos:]
+    # Header lines are the lines right above the data with the same
+    # number of cells, except for title lines with only the first cell set.
+    width = data[:data.find('\n')].count(';')
+    header_begin = len(head)
+    while (header_begin > 0
+           and head[header_begin - 1].count(';') == width
+           and head[header_begin - 1].split(';', 1)[-1].strip(';') != ''):
+        header_begin -= 1
+    return {
+        'meta': [l.strip(';') for l in head[:header_begin]],
+        'header': head[header_begin:],
+        'head': text[:pos],
+        'data': data,
+        'footer': footer,
+    }
+
+
+def head_lines(text, n):
+    """Returns the first n lines of text without splitting all of it"""
+    lines = []
+    pos = 0
+    while len(lines) < n and pos < len(text):
+        newline = text.find('\n', pos)
+        if newline < 0:
+            newline = len(text)
+        lines.append(text[pos:newline].rstrip('\r'))
+        pos = newline + 1
+    return lines
+
+
+def time_column(blocks):
+    """
+    Returns the index of the time column in the output of split_blocks(),
+    or None if there is none.
+    """
+    rows = [line.split(';') for line in head_lines(blocks['data'],
+                                                   SAMPLE_SIZE)]
+    if not rows:
+        return None
+    names = _column_names(blocks['header'], len(rows[0]))
+    for i, name in enumerate(names):
+        column = [row[i] for row in rows if i < len(row)]
+        if _is_value_column(column, name):
+            break
+        if _dimension_type(column, name) == 'time':
+            return i
+    return None
+
+
+def region_key_column(blocks):
+    """
+    Returns the index of the column holding region keys (not region
+    names) in the output of split_blocks(), or None if there is none.
+    """
+    rows = [line.split(';') for line in head_lines(blocks['data'],
+                                                   SAMPLE_SIZE)]
+    if not rows:
+        return None
+    names = _column_names(blocks['header'], len(rows[0]))
+    columns = [[row[i].strip() for row in rows if i < len(row)]
+               for i in range(len(names))]
+    # region keys look like numbers, so only consider the columns
+    # left of the trailing value columns
+    first_value = len(names)
+    while (first_value > 0 and _is_value_column(columns[first_value - 1],
+                                                names[first_value - 1])):
+        first_value -= 1
+    for i, name in enumerate(names[:first_value]):
+        column = columns[i]
+        sample = [c for c in column if c]
+        keys = [c for c in sample if _region_value_re.match(c)]
+        # a few rows may use other keys, e.g. "DG" for Germany
+        if (len(keys) * 2 > len(sample)
+                and _dimension_type(keys, name) == 'region'):
+            return i
+    return None
+
+
+def period_year(value):
+    """Returns the year of a time period like "31.12.2019" or "2019m06" """
+    match = _year_re.search(value)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def _column_names(header_lines, width):
+    names = []
+    rows = [line.split(';') for line in header_lines]
+    for i in range(width):
+        parts = [row[i].strip() for row in rows if i < len(row) and row[i].strip()]
+        names.append(' '.join(parts) or 'column%d' % i)
+    seen = {}
+    for i, name in enumerate(names):
+        if name in seen:
+            seen[name] += 1
+            names[i] = '%s_%d' % (name, seen[name])
+        else:
+            seen[name] = 1
+    return names
+
+
+def split_cells(data, width):
+    """
+    Returns the data block as a 2D array of strings with width columns.
+    Short rows are padded with empty cells, surplus cells are dropped.
+    """
+    if pd:
+        frame = pd.read_csv(io.StringIO(data), sep=';', header=None,
+                            dtype=str, keep_default_na=False, quoting=3,
+                            names=list(range(width)),
+                            usecols=list(range(width)), index_col=False)
+        return frame.fillna('').values.astype(str)
+    rows = []
+    for line in data.splitlines():
+        row = line.split(';')[:width]
+        rows.append(row + [''] * (width - len(row)))
+    return np.array(rows, dtype=str).reshape(len(rows), width)
+
+
+def to_float(column):
+    """
+    Converts an array of strings in German number format to float64.
+    Placeholders become NaN. Raises ValueError for other strings.
+    """
+    column = np.asarray(column, dtype=str)
+    missing = np.isin(column, PLACEHOLDERS)
+    cleaned = np.where(missing, 'nan', column)
+    cleaned = np.char.replace(cleaned, '.', '')
+    cleaned = np.char.replace(cleaned, ',', '.')
+    return cleaned.astype(np.float64)
+
+
+def _is_text(column):
+    """Returns a mask of the cells that are neither numbers nor placeholders"""
+    return np.array([not _is_value(cell) for cell in column], dtype=bool)
+
+
+def _is_value_column(column, name):
+    if _time_name_re.search(name):
+        return False
+    sample = column[:SAMPLE_SIZE]
+    if all(cell in PLACEHOLDERS for cell in sample):
+        return True
+    return all(_is_value(cell) for cell in sample)
+
+
+def _dimension_type(column, name):
+    sample = [c for c in column[:SAMPLE_SIZE] if c]
+    if _time_name_re.search(name) or (
+            sample and all(_time_value_re.match(c) for c in sample)):
+        return 'time'
+    if _region_name_re.search(name) or (
+            sample and all(_region_value_re.match(c) for c in sample)):
+        return 'region'
+    return 'property'
+
+
+def parse_table(data, encoding='latin-1'):
+    """
+    Parses a table exported in CSV format (str or bytes, as returned by
+    GenesisClient.table_export) and returns a dict:
+        meta: list of metadata lines above the table
+        footer: list of lines below the table
+        dimensions: list of dicts with the name and type ("time",
+            "region" or "property") of each dimension column
+        values: list of names of value columns
+        columns: OrderedDict mapping column names to NumPy arrays,
+            strings for dimensions, float64 for values (NaN for
+            placeholders)
+        flags: dict mapping value column names to string arrays holding
+            the placeholder where a value is missing, "" elsewhere
+    """
+    _import()
+    if isinstance(data, bytes):
+        data = data.decode(encoding)
+    blocks = split_blocks(data)
+    out = {
+        'meta': blocks['meta'],
+        'footer': blocks['footer'],
+        'dimensions': [],
+        'values': [],
+        'columns': OrderedDict(),
+        'flags': {},
+    }
+    if not blocks['data']:
+        return out
+    names = column_names(blocks)
+    cells = split_cells(blocks['data'], len(names))
+    types = column_types(names, cells)
+    out['columns'], out['flags'] = typed_columns(cells, types)
+    for name, kind in types.values():
+        if name in out['flags']:
+            out['values'].append(name)
+        else:
+            if kind == 'value':
+                # holds text after all
+                kind = 'property'
+            out['dimensions'].append({'name': name, 'type': kind})
+    return out
+
+
+def column_names(blocks):
+    """Returns the names of the columns in the output of split_blocks()"""
+    width = blocks['data'][:blocks['data'].find('\n')].count(';') + 1
+    return _column_names(blocks['header'], width)
+
+
+def column_types(names, cells):
+    """
+    Returns an OrderedDict mapping the indexes of the columns in cells
+    (see split_cells()) to (name, type), type being "value" for value
+    columns and the dimension type otherwise. Empty columns caused by
+    trailing separators are left out.
+    """
+    width = len(names)
+    # Values are the trailing columns holding numbers only
+    first_value = width
+    while (first_value > 0 and _is_value_column(cells[:, first_value - 1],
+                                                names[first_value - 1])):
+        first_value -= 1
+    types = OrderedDict()
+    for i in range(width):
+        column = cells[:, i]
+        name = names[i]
+        if name == 'column%d' % i and not np.any(column != ''):
+            # empty column caused by trailing separators
+            continue
+        if i < first_value:
+            types[i] = (name, _dimension_type(column, name))
+        else:
+            types[i] = (name, 'value')
+    return types
+
+
+def typed_columns(cells, types, text_as_flags=False):
+    """
+    Converts the columns of cells listed in types (see column_types())
+    and returns the columns and flags as described in parse_table().
+    Types are guessed from the first rows only, so a value column may
+    hold text further down. Such a column is returned as strings without
+    flags, or, if text_as_flags is true, its text cells become NaN and
+    are kept in the flags.
+    """
+    columns = OrderedDict()
+    flags = {}
+    for i, (name, kind) in types.items():
+        column = cells[:, i]
+        if kind != 'value':
+            columns[name] = column
+            continue
+        try:
+            columns[name] = to_float(column)
+        except ValueError:
+            if not text_as_flags:
+                columns[name] = column
+                continue
+            text = _is_text(column)
+            columns[name] = to_float(np.where(text, '', column))
+            flags[name] = np.where(np.isin(column, PLACEHOLDERS) | text,
+                                   column, '')
+            continue
+        flags[name] = np.where(np.isin(column, PLACEHOLDERS), column, '')
+    return columns, flags
+
+
+def to_dataframe(parsed):
+    """
+    Returns the result of parse_table() as a pandas DataFrame with
+    categorical dimension columns.
+    """
+    _import()
+    if not pd:
+        raise ImportError('to_dataframe requires pandas')
+    frame = pd.DataFrame(parsed['columns'])
+    for dim in parsed['dimensions']:
+        frame[dim['name']] = frame[dim['name']].astype('category')
+    return frame
@@ -0,0 +1,156 @@
+# encoding: utf8
+"""
+Client-side rate limiting per Genesis site.
+
+AdaptiveRateLimiter is a token bucket whose rate follows the server's
+health: every failed request halves the rate and pauses all requests
+for an exponentially growing time, slow responses reduce the rate, too,
+and every fast successful request raises it again a little, up to the
+configured maximum. Clients of the same site share one limiter (see
+site_limiter()), so the limit holds for all threads of the process.
+"""
+import threading
+import time
+
+from genesisclient.batch import RETRY_EXCEPTIONS, is_transient
+
+# Requests per second per site
+DEFAULT_RATE = 10.0
+
+_site_limiters = {}
+_site_limiters_lock = threading.Lock()
+
+
+class LimitedRequest(object):
+    """
+    Context manager waiting for permission to send a request and
+    reporting its outcome to the limiter. Only transient errors (see
+    genesisclient.batch.is_transient()) count as failures; a SOAP fault
+    is an answer of a working server.
+    """
+
+    exceptions = RETRY_EXCEPTIONS
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.start = None
+
+    def __enter__(self):
+        delay = self.limiter.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_value is None or (isinstance(exc_value, Exception) and
+                                 not is_transient(exc_value, self.exceptions)):
+            self.limiter.success(time.time() - self.start)
+        elif isinstance(exc_value, Exception):
+            self.limiter.failure()
+        return False
+
+
+class RateLimiter(object):
+    """
+    Does not limit requests. Base class for rate limiters; pass an
+    instance as rate_limiter to GenesisClient to disable rate limiting.
+    """
+
+    def reserve(self):
+        """
+        Reserves permission for one request and returns the number of
+        seconds to wait before sending it.
+        """
+        return 0.0
+
+    def success(self, seconds):
+        """Called after a successful request which took seconds"""
+
+    def failure(self):
+        """Called after a failed request"""
+
+    def request(self):
+        """Returns a LimitedRequest for a synchronous request"""
+        return LimitedRequest(self)
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    Token bucket allowing rate requests per second on average and
+    bursts of up to burst requests, safe to share between threads.
+    rate: initial requests per second
+    max_rate: the rate is never raised above this, by default rate
+    min_rate: the rate is never lowered below this, by default rate / 10
+    increase: requests per second added after each fast success, by
+        default rate / 20
+    decrease: factor applied to the rate after failures and slow
+        responses
+    slow: responses taking longer than this many seconds count as slow
+    backoff: seconds to pause after a failure, doubled for each further
+        consecutive failure up to max_backoff
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=None, max_rate=None,
+                 min_rate=None, increase=None, decrease=0.5, slow=30.0,
+                 backoff=1.0, max_backoff=60.0):
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.max_rate = float(max_rate or rate)
+        self.min_rate = float(min_rate or rate / 10.0)
+        self.increase = increase or rate / 20.0
+        self.decrease = decrease
+        self.slow = slow
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        with self.lock:
+            now = time.time()
+            self._refill(now)
+            self.tokens -= 1
+            delay = max(0.0, self.blocked_until - now)
+            if self.tokens < 0:
+                # wait until the token taken in advance has been refilled
+                delay = max(delay, -self.tokens / self.rate)
+            return delay
+
+    def success(self, seconds):
+        with self.lock:
+            self._refill(time.time())
+            self.failures = 0
+            if seconds > self.slow:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def failure(self):
+        with self.lock:
+            now = time.time()
+            self._refill(now)
+            self.failures += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            pause = min(self.max_backoff,
+                        self.backoff * (2 ** (self.failures - 1)))
+            self.blocked_until = max(self.blocked_until, now + pause)
+
+
+def site_limiter(site):
+    """
+    Returns the AdaptiveRateLimiter shared by all clients of site in the
+    process.
+    """
+    with _site_limiters_lock:
+        if site not in _site_limiters:
+            _site_limiters[site] = AdaptiveRateLimiter(DEFAULT_RATE)
+        return _site_limiters[site]
@@ -0,0 +1,289 @@
+# encoding: utf8
+"""
+Download of a table for many regions at once.
+
+export_regions() requests a table for batches of region keys (Amtliche
+Gemeindeschlüssel) concurrently and merges the CSV exports into one
+table with an additional first column holding the region key of each
+row. Rows returned for several batches, e.g. totals, are written once.
+Each export is downloaded into a temporary file and merged from there,
+in the order of the batches. Key patterns like '05*' are requested on
+their own, and a pattern whose export reaches max_rows lines is taken
+to be cut off and replaced by narrower patterns, recursively.
+"""
+import fnmatch
+import hashlib
+import heapq
+import string
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from genesisclient import batch, multipart, paging
+from genesisclient.parse import (FOOTER_PREFIX, SAMPLE_SIZE, head_lines,
+                                 split_blocks)
+
+# Number of region keys requested at once
+BATCH_SIZE = 20
+
+# Number of lines from which the export of a key pattern is split
+MAX_ROWS = 100000
+
+# Bytes read from the start of an export to find its header and columns
+HEAD_SIZE = 1024 * 1024
+
+REGION_COLUMN = 'regionalschluessel'
+
+ENCODING = 'latin-1'
+
+
+def region_keys(regions):
+    """
+    Returns the list of region keys and key patterns in regions, a list
+    or a comma separated string. Prefix patterns like '05*' are split
+    into the key itself and ten narrower patterns ('050*' to '059*'),
+    so they can be requested concurrently.
+    """
+    if isinstance(regions, str):
+        regions = regions.split(',')
+    keys = []
+    for region in regions:
+        region = region.strip()
+        if not region:
+            continue
+        for key in paging.split_filter(region, string.digits) or [region]:
+            if key not in keys:
+                keys.append(key)
+    return keys
+
+
+def key_batches(keys, batch_size=BATCH_SIZE):
+    """
+    Returns keys in batches of at most batch_size keys, each pattern in
+    a batch of its own.
+    """
+    patterns = [[key] for key in keys if '*' in key]
+    plain = [key for key in keys if '*' not in key]
+    return patterns + [plain[i:i + batch_size]
+                       for i in range(0, len(plain), batch_size)]
+
+
+def matches(value, keys):
+    """Whether value is one of keys or matches one of the patterns in it"""
+    for key in keys:
+        if value == key or ('*' in key and fnmatch.fnmatchcase(value, key)):
+            return True
+    return False
+
+
+def region_column(blocks, keys):
+    """
+    Returns the index of the column of a table (as returned by
+    split_blocks()) holding the region keys, i.e. the first column in
+    which most values match keys, or None.
+    """
+    rows = [line.split(';') for line in head_lines(blocks['data'],
+                                                   SAMPLE_SIZE)]
+    if not rows:
+        return None
+    for i in range(len(rows[0])):
+        hits = len([row for row in rows
+                    if i < len(row) and matches(row[i].strip(), keys)])
+        if hits * 2 > len(rows):
+            return i
+    return None
+
+
+class Export(object):
+    """
+    CSV export downloaded into the temporary binary file f. blocks are
+    those of its beginning (see split_blocks()); their footer is only
+    complete after reading all lines().
+    """
+
+    def __init__(self, f):
+        self.file = f
+        f.seek(0)
+        sample = f.read(HEAD_SIZE)
+        if len(sample) == HEAD_SIZE:
+            sample = sample[:sample.rfind(b'\n') + 1]
+        self.blocks = split_blocks(sample.decode(ENCODING))
+        self.data_start = len(self.blocks['head'].encode(ENCODING))
+        f.seek(0)
+        self.size = 0
+        for chunk in iter(lambda: f.read(multipart.CHUNK_SIZE), b''):
+            self.size += chunk.count(b'\n')
+
+    def lines(self):
+        """Yields the data lines holding values"""
+        footer = FOOTER_PREFIX.encode(ENCODING)
+        self.file.seek(self.data_start)
+        for line in self.file:
+            if line.startswith(footer):
+                self.blocks['footer'] = [
+                    l.decode(ENCODING).rstrip('\r\n')
+                    for l in [line] + list(self.file)]
+                return
+            line = line.decode(ENCODING).rstrip('\r\n')
+            if line.strip(';').strip():
+                yield line
+
+    def close(self):
+        self.file.close()
+
+
+class MergedTable(object):
+    """
+    Writes the merged CSV table to fileobj. The head and footer are
+    taken from the first export added.
+    """
+
+    def __init__(self, fileobj, column=None):
+        self.fileobj = fileobj
+        self.column = column
+        self.head_written = False
+        self.footer = None
+        self.newline = '\r\n'
+        self.seen = set()
+        self.rows = 0
+
+    def write(self, text):
+        self.fileobj.write(text.encode(ENCODING))
+
+    def write_head(self, blocks):
+        if '\r\n' not in blocks['head'] + blocks['data'][:1000]:
+            self.newline = '\n'
+        lines = blocks['head'].splitlines()
+        first_header = len(lines) - len(blocks['header'])
+        for i, line in enumerate(lines):
+            if i == len(lines) - 1:
+                line = REGION_COLUMN + ';' + line
+            elif i >= first_header:
+                line = ';' + line
+            self.write(line + self.newline)
+        self.head_written = True
+
+    def add(self, keys, export):
+        """Adds the rows of an Export for the region keys"""
+        first = not self.head_written
+        if first:
+            self.write_head(export.blocks)
+        out = []
+        for line in export.lines():
+            region = ''
+            if len(keys) == 1:
+                region = keys[0]
+            if self.column is not None:
+                cells = line.split(';')
+                if (self.column < len(cells)
+                        and matches(cells[self.column].strip(), keys)):
+                    region = cells[self.column].strip()
+            line = region + ';' + line
+            # digests instead of rows keep memory usage low. 128 bits make
+            # collisions, which would drop rows, practically impossible.
+            digest = hashlib.blake2b(line.encode(ENCODING),
+                                     digest_size=16).digest()
+            if digest in self.seen:
+                continue
+            self.seen.add(digest)
+            out.append(line + self.newline)
+            if len(out) >= 1000:
+                self.rows += len(out)
+                self.write(''.join(out))
+                out = []
+        self.rows += len(out)
+        self.write(''.join(out))
+        if first:
+            self.footer = export.blocks['footer']
+
+    def close(self):
+        for line in self.footer or []:
+            self.write(line + self.newline)
+
+
+def export_regions(client, table_code, regions, fileobj, batch_size=BATCH_SIZE,
+                   workers=4, max_rows=MAX_ROWS, **kwargs):
+    """
+    Downloads table_code for all regions (see region_keys()) and writes
+    the merged CSV table to fileobj. Returns the number of rows.
+    Batches of batch_size keys are requested concurrently using up to
+    workers threads. If the table has no column telling the regions of
+    a batch apart, every key is requested on its own. Further keyword
+    arguments are passed on to client.table_export(). Raises the error
+    of the first batch failing even after the retries of the client.
+    """
+    keys = region_keys(regions)
+    if not keys:
+        raise ValueError('No region keys given')
+    groups = key_batches(keys, batch_size)
+    semaphore = batch.site_semaphore(client.site)
+
+    def fetch(group):
+        f = tempfile.TemporaryFile()
+        try:
+            with semaphore:
+                client.table_export(table_code,
+                                    regionalschluessel=','.join(group),
+                                    format='csv', fileobj=f, **kwargs)
+            return Export(f)
+        except BaseException:
+            f.close()
+            raise
+
+    first = fetch(groups[0])
+    column = region_column(first.blocks, groups[0])
+    if column is None and len(groups[0]) > 1:
+        first.close()
+        groups = [[key] for key in keys]
+        first = fetch(groups[0])
+    merged = MergedTable(fileobj, column)
+
+    # Batches are identified by their position in the merged table: (i,)
+    # for the i-th one, position + (j,) for the narrower patterns
+    # replacing a cut off one. Downloads finished early wait in done.
+    todo = [((i,), group) for i, group in enumerate(groups)][1:]
+    pending = {}
+    done = [((0,), groups[0], first)]
+
+    def next_position():
+        positions = [position for position, _ in pending.values()]
+        if todo:
+            positions.append(todo[0][0])
+        return min(positions) if positions else None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            while todo or pending or done:
+                waiting = next_position()
+                if done and (waiting is None or done[0][0] < waiting):
+                    position, group, export = heapq.heappop(done)
+                    narrower = None
+                    if len(group) == 1 and export.size >= max_rows:
+                        narrower = paging.split_filter(group[0],
+                                                       string.digits)
+                    try:
+                        if narrower is None:
+                            merged.add(group, export)
+                    finally:
+                        export.close()
+                    for j, key in enumerate(narrower or []):
+                        heapq.heappush(todo, (position + (j,), [key]))
+                    continue
+                # keep at most 2 * workers downloads in flight or waiting,
+                # but always fetch those the merge is waiting for
+                if todo and len(pending) < 2 * workers and (
+                        len(pending) + len(done) < 2 * workers
+                        or todo[0][0] == waiting):
+                    position, group = heapq.heappop(todo)
+                    pending[executor.submit(fetch, group)] = (position, group)
+                    continue
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    position, group = pending.pop(future)
+                    heapq.heappush(done, (position, group, future.result()))
+        finally:
+            for future in pending:
+                future.cancel()
+            for _, _, export in done:
+                export.close()
+    merged.close()
+    return merged.rows
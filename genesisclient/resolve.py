@@ -0,0 +1,92 @@
+# encoding: utf8
+"""
+Batch resolution of catalogue codes.
+
+resolve() looks up the entries (descriptions) of many codes at once.
+Instead of one request per code, codes sharing a prefix are fetched by
+one wildcard query ('12411-0015' and '12411-0017' by '12411*'). A
+query returning a full page may have missed codes, so its unresolved
+codes are grouped again by a longer prefix. Codes alone in their group,
+and codes the wildcard queries did not return, are looked up one by one.
+All queries run concurrently.
+"""
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from genesisclient.paging import PAGE_SIZE
+
+# Catalogue method of each kind of code
+METHODS = {
+    'statistic': 'statistics',
+    'table': 'tables',
+    'property': 'properties',
+}
+
+# Length of the prefixes codes are first grouped by, e.g. the code of
+# the statistic a table belongs to
+PREFIX_LENGTH = 5
+
+
+def group_codes(codes, prefix_length=PREFIX_LENGTH):
+    """
+    Groups codes by their first prefix_length characters. Returns a list
+    of (filter, codes) tuples: a wildcard filter for groups of several
+    codes, the code itself for single ones.
+    """
+    groups = OrderedDict()
+    for code in codes:
+        groups.setdefault(code[:prefix_length], []).append(code)
+    out = []
+    for prefix, members in groups.items():
+        if len(members) == 1:
+            out.append((members[0], members))
+        else:
+            out.append((prefix + '*', members))
+    return out
+
+
+def resolve(client, codes, kind='table', prefix_length=PREFIX_LENGTH,
+            page_size=PAGE_SIZE):
+    """
+    Looks up codes, statistics, tables or properties depending on kind,
+    using client's thread pool. Returns an OrderedDict mapping every
+    distinct code, in the given order, to its catalogue entry or None
+    if it was not found.
+    """
+    if kind not in METHODS:
+        raise ValueError('Unknown kind %r, expected one of %s'
+                         % (kind, ', '.join(sorted(METHODS))))
+    method = getattr(client, METHODS[kind])
+    result = OrderedDict((code, None) for code in codes)
+    pool = client.get_pool()
+    pending = {}
+    queried = set()
+
+    def submit(filter, members, length):
+        if filter in queried:
+            return
+        queried.add(filter)
+        future = pool.submit(method, filter=filter, limit=page_size)
+        pending[future] = (filter, members, length)
+
+    for filter, members in group_codes(list(result), prefix_length):
+        submit(filter, members, prefix_length)
+    while pending:
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for future in done:
+            filter, members, length = pending.pop(future)
+            entries = future.result()
+            for entry in entries:
+                if entry['id'] in result and result[entry['id']] is None:
+                    result[entry['id']] = entry
+            missing = [code for code in members if result[code] is None]
+            if not missing or not filter.endswith('*'):
+                continue
+            if len(entries) >= page_size:
+                # the page may be truncated, narrow the groups down
+                groups = group_codes(missing, length + 1)
+            else:
+                groups = [(code, [code]) for code in missing]
+            for narrower, members in groups:
+                submit(narrower, members, length + 1)
+    return result
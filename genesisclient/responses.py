@@ -0,0 +1,195 @@
+# encoding: utf8
+"""
+Decoding of RechercheService_2010 responses.
+
+Responses are parsed incrementally with iterparse and every entry is
+discarded from the tree as soon as it has been decoded, so memory usage
+is dominated by the resulting records, which are compact objects with
+__slots__ instead of dicts.
+"""
+import io
+from collections.abc import Mapping
+
+from lxml import etree
+
+
+def clean(s):
+    """Clean up a string"""
+    if s is None:
+        return None
+    s = s.replace("\n", " ")
+    s = s.replace("  ", " ")
+    s = s.strip()
+    return s
+
+
+class Record(Mapping):
+    """
+    Base class of decoded response records. Fields are attributes, but
+    can be read and set like dict items, too (entry['id']). Records are
+    mappings of their field names: iterating yields the names, and
+    dict(record) returns a plain dict.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+        for name in self.__slots__[len(values):]:
+            setattr(self, name, None)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = dict(other)
+        return dict(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+            '%s=%r' % item for item in self.items()))
+
+    def copy(self):
+        """Returns a shallow copy"""
+        return self.__class__(*self.values())
+
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def values(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.__slots__]
+
+
+class Entry(Record):
+    """Catalogue entry. longdescription is only set by some catalogues."""
+    __slots__ = ('id', 'description', 'longdescription')
+
+
+class DataEntry(Record):
+    """DatenKatalog entry with the date the data was last updated (stand)"""
+    __slots__ = ('id', 'description', 'stand')
+
+
+class Hit(Record):
+    """Search result"""
+    __slots__ = ('id', 'type', 'name', 'description')
+
+
+def iter_elements(result, tags):
+    """
+    Yields (tag, fields) for all elements of the XML document result
+    named tags (a name or a tuple of names), fields being a dict
+    mapping the names of their child elements to their texts.
+    """
+    for _, element in etree.iterparse(io.BytesIO(result), tag=tags):
+        fields = {}
+        for child in element:
+            fields[child.tag] = child.text
+        yield element.tag, fields
+        # drop the element and all preceding siblings from the tree
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def parse_search(result):
+    """
+    Decodes a Recherche response into a dict with the number of hits per
+    object type (meta) and the list of hits (results).
+    """
+    out = {
+        'meta': {},
+        'results': []
+    }
+    for tag, fields in iter_elements(result,
+                                     ('trefferUebersicht', 'trefferListe')):
+        if tag == 'trefferUebersicht':
+            otype = fields.get('objektTyp')
+            num = fields.get('trefferAnzahl')
+            if otype is not None and num is not None:
+                out['meta'][otype] = int(num)
+        elif 'EVAS' in fields:
+            out['results'].append(Hit(fields['EVAS'],
+                                      fields.get('objektTyp'),
+                                      fields.get('name'),
+                                      clean(fields.get('kurztext'))))
+    return out
+
+
+def parse_entries(result, tag, long=False):
+    """
+    Decodes a catalogue response into a list of Entry records with id and
+    description, and longdescription if long is true, one per element
+    named tag.
+    """
+    out = []
+    for _, fields in iter_elements(result, tag):
+        if 'code' not in fields:
+            continue
+        longdescription = None
+        if long:
+            longdescription = clean(fields.get('beschriftungstext'))
+        out.append(Entry(fields['code'], clean(fields.get('inhalt')),
+                         longdescription))
+    return out
+
+
+def parse_data_entries(result):
+    """Decodes a DatenKatalog response into a list of DataEntry records"""
+    out = []
+    for _, fields in iter_elements(result, 'datenKatalogEintraege'):
+        if 'code' not in fields:
+            continue
+        out.append(DataEntry(fields['code'], clean(fields.get('inhalt')),
+                             clean(fields.get('stand'))))
+    return out
+
+
+def copy_result(result):
+    """
+    Returns a copy of a decoded response (records, or lists and dicts of
+    them) that can be modified without affecting the original.
+    """
+    if isinstance(result, Record):
+        return result.copy()
+    if isinstance(result, list):
+        return [copy_result(item) for item in result]
+    if isinstance(result, dict):
+        return dict((key, copy_result(value))
+                    for key, value in result.items())
+    return result
+
+
+def entries_parser(tag, long=False):
+    """Returns a function decoding catalogue responses, see parse_entries"""
+    def parser(result):
+        return parse_entries(result, tag, long=long)
+    return parser
@@ -0,0 +1,65 @@
+# encoding: utf8
+"""
+Coalescing of identical concurrent requests.
+
+When several threads ask for the same thing at the same time, e.g. right
+after a cached catalogue response expired, SingleFlight lets only the
+first of them make the request. The others wait for it and get the same
+result, or the same exception.
+"""
+import threading
+
+
+class Flight(object):
+    """A call in progress"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Runs functions at most once at a time per key. Safe to share between
+    threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def do(self, key, func, copy=None):
+        """
+        Returns func(), unless a call for key is already in progress. Then
+        waits for it and returns its result (or raises its exception)
+        instead. If given, copy is applied to the result handed to each
+        waiting caller, so that no two callers share a mutable result.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            if copy is not None:
+                return copy(flight.result)
+            return flight.result
+        try:
+            flight.result = func()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+    def __len__(self):
+        """Number of calls in progress"""
+        with self.lock:
+            return len(self.flights)
@@ -0,0 +1,108 @@
+# encoding: utf8
+"""
+Snapshots of the complete catalogue of a Genesis site.
+
+take_snapshot() harvests the statistics, the tables (with the Stand
+given by the DatenKatalog), the properties and the occurrences of every
+property of a site concurrently. A snapshot is a dict:
+
+    {'site': 'DESTATIS', 'created': '2020-01-01T10:00:00Z',
+     'statistics': {code: description},
+     'tables': {code: [description, stand]},
+     'properties': {code: description},
+     'occurrences': {property code: {code: description}}}
+
+save_snapshot() writes it as gzip compressed JSON. diff_snapshots()
+compares two snapshots and reports added, removed and changed entries,
+so that only tables with a new Stand need to be downloaded again.
+"""
+import gzip
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from genesisclient.paging import PAGE_SIZE
+
+KINDS = ('statistics', 'tables', 'properties', 'occurrences')
+
+
+def take_snapshot(client, workers=4, page_size=PAGE_SIZE):
+    """
+    Harvests the catalogues of client's site using up to workers threads
+    and returns a snapshot.
+    """
+    def harvest(method, **kwargs):
+        return dict((entry.id, entry.description) for entry in
+                    client.iter_catalogue(method, page_size=page_size,
+                                          **kwargs))
+
+    def harvest_tables():
+        return dict((entry.id, [entry.description, entry.stand])
+                    for entry in client.iter_catalogue('catalogue_entries',
+                                                       page_size=page_size))
+
+    snapshot = {
+        'site': client.site,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        statistics = executor.submit(harvest, 'statistics')
+        tables = executor.submit(harvest_tables)
+        properties = harvest('properties')
+        occurrences = dict(
+            (code, executor.submit(harvest, 'property_occurrences',
+                                   property_code=code))
+            for code in properties)
+        snapshot['statistics'] = statistics.result()
+        snapshot['tables'] = tables.result()
+        snapshot['properties'] = properties
+        snapshot['occurrences'] = dict(
+            (code, future.result()) for code, future in occurrences.items())
+    return snapshot
+
+
+def save_snapshot(snapshot, path):
+    """Writes snapshot to path as gzip compressed JSON"""
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        json.dump(snapshot, f, sort_keys=True, separators=(',', ':'))
+
+
+def load_snapshot(path):
+    """Reads a snapshot written by save_snapshot()"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def flatten(snapshot, kind):
+    """
+    Returns the entries of kind in snapshot as a dict mapping codes to
+    values, property occurrences with codes "PROPERTY:CODE".
+    """
+    entries = snapshot.get(kind) or {}
+    if kind != 'occurrences':
+        return entries
+    out = {}
+    for property_code, occurrences in entries.items():
+        for code, description in occurrences.items():
+            out['%s:%s' % (property_code, code)] = description
+    return out
+
+
+def diff_snapshots(old, new):
+    """
+    Compares two snapshots. Returns a dict mapping each kind to a dict
+    with the sorted lists of added, removed and changed codes (changed
+    meaning a different description or, for tables, Stand). Property
+    occurrences are given as "PROPERTY:CODE".
+    """
+    out = {}
+    for kind in KINDS:
+        before = flatten(old, kind)
+        after = flatten(new, kind)
+        out[kind] = {
+            'added': sorted(set(after) - set(before)),
+            'removed': sorted(set(before) - set(after)),
+            'changed': sorted(code for code in set(before) & set(after)
+                              if before[code] != after[code]),
+        }
+    return out
@@ -0,0 +1,81 @@
+# encoding: utf8
+"""
+Low level SOAP helpers for calls that bypass suds' own request handling,
+e.g. to stream large responses instead of reading them into memory.
+"""
+try:
+    from urllib.request import Request as UrllibRequest, urlopen
+    from urllib.error import HTTPError
+except ImportError:  # Python 2
+    from urllib2 import Request as UrllibRequest, urlopen, HTTPError
+
+import suds.client
+from suds.transport import Request, TransportError
+
+
+def build_request(client, method, params):
+    """
+    Returns a suds.transport.Request for invoking method with params
+    via the suds client, built just like suds would build it.
+    """
+    wsdl_method = getattr(client.service, method).method
+    soap_client = suds.client.SoapClient(client, wsdl_method)
+    binding = wsdl_method.binding.input
+    envelope = binding.get_message(wsdl_method, (), params)
+    request = Request(soap_client.location(),
+                      envelope.plain().encode('utf-8'))
+    request.headers = soap_client.headers()
+    return request
+
+
+def raise_fault(client, method, reply):
+    """
+    Raises the suds.WebFault contained in the SOAP reply to method.
+    """
+    wsdl_method = getattr(client.service, method).method
+    wsdl_method.binding.input.get_fault(reply)
+
+
+def http_error(exception):
+    """
+    Returns a TransportError for the plain Exception((status, reason))
+    suds raises for HTTP errors other than SOAP faults, or None if
+    exception is something else.
+    """
+    args = getattr(exception, 'args', ())
+    if (type(exception) is Exception and len(args) == 1
+            and isinstance(args[0], tuple) and len(args[0]) == 2
+            and isinstance(args[0][0], int)):
+        status, reason = args[0]
+        return TransportError(reason, status)
+    return None
+
+
+def open_stream(client, request):
+    """
+    Sends request and returns the response as a file-like object with
+    a `headers` attribute. Uses the transport's own open_stream() if it
+    has one. Raises suds.WebFault for SOAP faults.
+    """
+    transport = client.options.transport
+    if hasattr(transport, 'open_stream'):
+        return transport.open_stream(request)
+    u2request = UrllibRequest(request.url, request.message, request.headers)
+    return urlopen(u2request, timeout=transport.options.timeout)
+
+
+def call_stream(client, method, params):
+    """
+    Invokes method and returns the open response stream.
+    """
+    request = build_request(client, method, params)
+    try:
+        return open_stream(client, request)
+    except HTTPError as e:
+        if e.code == 500:
+            raise_fault(client, method, e.read())
+        raise
+    except TransportError as e:
+        if e.httpcode == 500 and e.fp is not None:
+            raise_fault(client, method, e.fp.read())
+        raise
@@ -0,0 +1,186 @@
+# encoding: utf8
+"""
+Local store of downloaded tables.
+
+TableStore keeps table exports on disk, keyed by site, table code,
+region key and format. Payloads are stored content-addressed (named by
+their SHA-256 digest), so identical downloads take up space only once.
+For every key the store records the digest, when the table was fetched
+and last checked, and the "Stand" of the table given by the
+DatenKatalog. fetch() only downloads a table again if its Stand has
+changed (or is unknown), and not at all within max_age seconds of the
+last check.
+
+Pass a TableStore as store to GenesisClient to serve table_export()
+from it.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+CHUNK_SIZE = 64 * 1024
+
+StoredTable = namedtuple('StoredTable', ['site', 'table_code',
+                                         'regionalschluessel', 'format',
+                                         'digest', 'size', 'stand',
+                                         'fetched', 'checked'])
+
+
+class TableStore(object):
+    """
+    Table store in directory, with an SQLite index (index.sqlite) and
+    the payloads in the subdirectory objects. Safe to share between
+    threads.
+    """
+
+    def __init__(self, directory, max_age=0):
+        self.directory = directory
+        self.max_age = max_age
+        self.objects = os.path.join(directory, 'objects')
+        if not os.path.isdir(self.objects):
+            os.makedirs(self.objects)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(directory, 'index.sqlite'),
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS tables ('
+                        'site TEXT, '
+                        'table_code TEXT, '
+                        'regionalschluessel TEXT, '
+                        'format TEXT, '
+                        'digest TEXT, '
+                        'size INTEGER, '
+                        'stand TEXT, '
+                        'fetched REAL, '
+                        'checked REAL, '
+                        'PRIMARY KEY (site, table_code, regionalschluessel, '
+                        'format))')
+        self.db.commit()
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def get(self, site, table_code, regionalschluessel='', format='csv'):
+        """Returns the StoredTable for a key or None"""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT site, table_code, regionalschluessel, format, digest, '
+                'size, stand, fetched, checked FROM tables WHERE site = ? '
+                'AND table_code = ? AND regionalschluessel = ? AND format = ?',
+                (site, table_code, regionalschluessel or '', format)
+            ).fetchone()
+        if row is None or not os.path.exists(self.object_path(row[4])):
+            return None
+        return StoredTable(*row)
+
+    def tables(self):
+        """Returns a list of all StoredTables"""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT site, table_code, regionalschluessel, format, digest, '
+                'size, stand, fetched, checked FROM tables').fetchall()
+        return [StoredTable(*row) for row in rows]
+
+    def put(self, site, table_code, chunks, regionalschluessel='',
+            format='csv', stand=None):
+        """
+        Stores a table, given as an iterable of byte strings, and returns
+        its StoredTable.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        tmp = os.path.join(self.objects, 'tmp-%s' % uuid.uuid4().hex)
+        try:
+            with open(tmp, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            digest = digest.hexdigest()
+            path = self.object_path(digest)
+            if os.path.exists(path):
+                os.remove(tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        now = time.time()
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO tables (site, table_code, '
+                            'regionalschluessel, format, digest, size, stand, '
+                            'fetched, checked) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (site, table_code, regionalschluessel or '',
+                             format, digest, size, stand, now, now))
+            self.db.commit()
+        return StoredTable(site, table_code, regionalschluessel or '', format,
+                           digest, size, stand, now, now)
+
+    def touch(self, stored):
+        """Records that stored has been checked and is up to date"""
+        now = time.time()
+        with self.lock:
+            self.db.execute('UPDATE tables SET checked = ? WHERE site = ? '
+                            'AND table_code = ? AND regionalschluessel = ? '
+                            'AND format = ?',
+                            (now, stored.site, stored.table_code,
+                             stored.regionalschluessel, stored.format))
+            self.db.commit()
+        return stored._replace(checked=now)
+
+    def iter_chunks(self, stored, chunk_size=CHUNK_SIZE):
+        """Yields the payload of stored in chunks of bytes"""
+        with open(self.object_path(stored.digest), 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def read(self, stored):
+        with open(self.object_path(stored.digest), 'rb') as f:
+            return f.read()
+
+    def fetch(self, client, table_code, regionalschluessel='', format='csv',
+              compress=False):
+        """
+        Returns the StoredTable for a table, downloading it with client
+        only if it is not stored yet, or its Stand has changed or is
+        unknown. Tables checked less than max_age seconds ago are not
+        checked again.
+        """
+        stored = self.get(client.site, table_code, regionalschluessel, format)
+        if stored is not None and time.time() - stored.checked < self.max_age:
+            return stored
+        stand = client.table_stand(table_code)
+        if stored is not None and stand is not None and stand == stored.stand:
+            return self.touch(stored)
+        chunks = client.iter_table_export(
+            table_code, regionalschluessel=regionalschluessel, format=format,
+            compress=compress)
+        return self.put(client.site, table_code, chunks,
+                        regionalschluessel=regionalschluessel, format=format,
+                        stand=stand)
+
+    def prune(self):
+        """
+        Deletes payloads no longer referenced by any table and returns
+        their number.
+        """
+        with self.lock:
+            digests = set(row[0] for row in
+                          self.db.execute('SELECT digest FROM tables'))
+        removed = 0
+        for directory, _, files in os.walk(self.objects):
+            for name in files:
+                if name not in digests and not name.startswith('tmp-'):
+                    os.remove(os.path.join(directory, name))
+                    removed += 1
+        return removed
@@ -0,0 +1,129 @@
+# encoding: utf8
+"""
+Incremental refresh of downloaded tables.
+
+IncrementalSync keeps local CSV copies of tables in a directory and
+remembers, per table and region key, the latest year already stored.
+Later runs only request data from that year on and merge it into the
+local copy, replacing rows of that year (which may have been revised)
+and appending newer ones.
+"""
+import datetime
+import json
+import os
+import threading
+
+from genesisclient import parse
+
+STATE_FILE = 'sync-state.json'
+
+
+class IncrementalSync(object):
+
+    def __init__(self, client, directory, state_file=None):
+        self.client = client
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.state_file = state_file or os.path.join(directory, STATE_FILE)
+        self.lock = threading.Lock()
+        self.state = {}
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                self.state = json.load(f)
+
+    def key(self, table_code, regionalschluessel=''):
+        return '%s|%s|%s' % (self.client.site, table_code,
+                             regionalschluessel or '')
+
+    def path(self, table_code, regionalschluessel=''):
+        if regionalschluessel and regionalschluessel != '*':
+            name = '%s_%s.csv' % (table_code, regionalschluessel)
+        else:
+            name = '%s.csv' % table_code
+        return os.path.join(self.directory, name)
+
+    def save_state(self):
+        with self.lock:
+            tmp = self.state_file + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.state, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.state_file)
+
+    def sync(self, table_code, regionalschluessel=''):
+        """
+        Brings the local copy of a table up to date. Returns a dict with
+        the path, the latest year stored, the number of rows received
+        and whether the full table had to be downloaded.
+        """
+        key = self.key(table_code, regionalschluessel)
+        path = self.path(table_code, regionalschluessel)
+        entry = self.state.get(key) or {}
+        merged = None
+        rows = []
+        full = entry.get('latest') is None or not os.path.exists(path)
+        if not full:
+            text = self.client.table_export(
+                table_code, regionalschluessel=regionalschluessel,
+                startjahr=entry['latest']).decode('latin-1')
+            new = parse.split_blocks(text)
+            column = parse.time_column(new)
+            rows = [l.rstrip('\r') for l in new['data'].splitlines()
+                    if l.strip()]
+            years = self._years(rows, column) if column is not None else None
+            if not years:
+                # rows without a recognizable time period can't be merged
+                full = bool(rows)
+            else:
+                with open(path, 'rb') as f:
+                    old = parse.split_blocks(f.read().decode('latin-1'))
+                cutoff = min(years)
+                kept = [l.rstrip('\r') for l in old['data'].splitlines()
+                        if l.strip() and (parse.period_year(
+                            self._cell(l, column)) or 0) < cutoff]
+                newline = '\r\n' if '\r\n' in text else '\n'
+                merged = (new['head'] + newline.join(kept + rows) + newline
+                          + newline.join(new['footer']) + newline)
+        if full:
+            merged = self.client.table_export(
+                table_code,
+                regionalschluessel=regionalschluessel).decode('latin-1')
+            rows = parse.split_blocks(merged)['data'].splitlines()
+        latest = entry.get('latest')
+        if merged is not None:
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(merged.encode('latin-1'))
+            os.replace(tmp, path)
+            blocks = parse.split_blocks(merged)
+            column = parse.time_column(blocks)
+            if column is not None:
+                years = self._years(blocks['data'].splitlines(), column)
+                latest = max(years) if years else None
+        self.state[key] = {
+            'path': path,
+            'latest': latest,
+            'checked': datetime.datetime.now(
+                datetime.timezone.utc).isoformat(),
+        }
+        self.save_state()
+        return {
+            'path': path,
+            'latest': latest,
+            'rows': len(rows),
+            'full': full,
+        }
+
+    def _cell(self, line, column):
+        cells = line.split(';')
+        if column < len(cells):
+            return cells[column]
+        return ''
+
+    def _years(self, lines, column):
+        years = set()
+        for line in lines:
+            year = parse.period_year(self._cell(line, column))
+            if year is not None:
+                years.add(year)
+        return years
@@ -0,0 +1,271 @@
+# encoding: utf8
+"""
+Random access to downloaded tables.
+
+GenesisTable.open() memory-maps a table exported in CSV format and
+keeps an index of its data lines by region key and year next to it
+(files PATH.idx.json and PATH.idx.npy, built on first use and rebuilt
+whenever the table file changes). select() then only reads the index
+entries and data lines of the requested regions and years:
+
+    with GenesisTable.open('12411-0015.csv') as table:
+        data = table.select(region='05315', years=range(2010, 2020))
+
+The index is a NumPy array sorted by region and year, itself memory
+mapped, so opening a table does not read it either. Requires numpy.
+"""
+import json
+import mmap
+import os
+import uuid
+
+from genesisclient import parse
+from genesisclient.parse import (FOOTER_PREFIX, parse_table, period_year,
+                                 region_key_column, split_blocks,
+                                 time_column)
+
+INDEX_VERSION = 1
+
+# Bytes read from the start of a table to find its header and columns
+HEAD_SIZE = 1024 * 1024
+
+# Year of lines without a recognizable time period
+NO_YEAR = -1
+
+
+def index_paths(path):
+    return path + '.idx.json', path + '.idx.npy'
+
+
+def build_index(path, encoding='latin-1'):
+    """
+    Scans the table at path and writes its index files. Returns the
+    index metadata.
+    """
+    parse._import()
+    np = parse.np
+    with open(path, 'rb') as f:
+        sample = f.read(HEAD_SIZE)
+    if len(sample) == HEAD_SIZE:
+        sample = sample[:sample.rfind(b'\n') + 1]
+    blocks = split_blocks(sample.decode(encoding))
+    if not blocks['data']:
+        raise ValueError('%s contains no data' % path)
+    region_column = region_key_column(blocks)
+    year_column = time_column(blocks)
+    data_start = len(blocks['head'].encode(encoding))
+    footer_start = None
+    footer = FOOTER_PREFIX.encode(encoding)
+    keep = max(c for c in (region_column, year_column, 0) if c is not None)
+    starts = []
+    ends = []
+    regions = []
+    years = []
+    codes = {}
+    with open(path, 'rb') as f:
+        f.seek(data_start)
+        offset = data_start
+        for line in f:
+            if line.startswith(footer):
+                footer_start = offset
+                break
+            end = offset + len(line)
+            if line.strip(b'; \t\r\n'):
+                cells = line.rstrip(b'\r\n').split(b';', keep + 1)
+                region = b''
+                if region_column is not None and region_column < len(cells):
+                    region = cells[region_column].strip()
+                year = NO_YEAR
+                if year_column is not None and year_column < len(cells):
+                    year = period_year(cells[year_column].decode(encoding))
+                    if year is None:
+                        year = NO_YEAR
+                code = codes.get(region)
+                if code is None:
+                    code = codes[region] = len(codes)
+                starts.append(offset)
+                ends.append(end)
+                regions.append(code)
+                years.append(year)
+            offset = end
+    # number regions in sort order, so that the index sorted by region
+    # number is sorted by region key, too
+    keys = sorted(codes)
+    order = np.empty(len(keys), dtype=np.int32)
+    for i, key in enumerate(keys):
+        order[codes[key]] = i
+    index = np.empty(len(starts), dtype=[('start', '<i8'), ('end', '<i8'),
+                                         ('region', '<i4'), ('year', '<i4')])
+    index['start'] = starts
+    index['end'] = ends
+    index['region'] = order[np.asarray(regions, dtype=np.int32)]
+    index['year'] = years
+    index = index[np.lexsort((index['start'], index['year'],
+                              index['region']))]
+    stat = os.stat(path)
+    meta = {
+        'version': INDEX_VERSION,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'encoding': encoding,
+        'data_start': data_start,
+        'footer_start': footer_start,
+        'region_column': region_column,
+        'time_column': year_column,
+        'regions': [key.decode(encoding) for key in keys],
+        'years': sorted(set(years) - set([NO_YEAR])),
+    }
+    # write both files under temporary names first, so that readers
+    # never see a partly written index
+    meta_path, array_path = index_paths(path)
+    suffix = '.tmp-%s' % uuid.uuid4().hex
+    try:
+        with open(array_path + suffix, 'wb') as f:
+            np.save(f, index)
+        with open(meta_path + suffix, 'w') as f:
+            json.dump(meta, f)
+        os.replace(array_path + suffix, array_path)
+        os.replace(meta_path + suffix, meta_path)
+    finally:
+        for tmp in (array_path + suffix, meta_path + suffix):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+    return meta
+
+
+def load_index_meta(path):
+    """
+    Returns the index metadata of the table at path, or None if there is
+    no index or it is outdated.
+    """
+    meta_path, array_path = index_paths(path)
+    if not (os.path.exists(meta_path) and os.path.exists(array_path)):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    stat = os.stat(path)
+    if (meta.get('version') != INDEX_VERSION or meta['size'] != stat.st_size
+            or meta['mtime'] != stat.st_mtime):
+        return None
+    return meta
+
+
+class GenesisTable(object):
+    """
+    A table exported in CSV format, memory mapped and indexed by region
+    key and year. Use GenesisTable.open() to create one.
+    """
+
+    def __init__(self, path, meta, index, data):
+        self.path = path
+        self.meta = meta
+        self.index = index
+        self.data = data
+        self.encoding = meta['encoding']
+        self.region_codes = dict((key, i)
+                                 for i, key in enumerate(meta['regions']))
+
+    @classmethod
+    def open(cls, path, encoding='latin-1', rebuild=False):
+        """
+        Opens the table at path, building its index if there is none yet
+        or the table has changed.
+        """
+        parse._import()
+        meta = None if rebuild else load_index_meta(path)
+        if meta is None or meta['encoding'] != encoding:
+            meta = build_index(path, encoding=encoding)
+        index = parse.np.load(index_paths(path)[1], mmap_mode='r')
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(path, meta, index, data)
+
+    @property
+    def regions(self):
+        """Sorted list of the region keys in the table"""
+        return self.meta['regions']
+
+    @property
+    def years(self):
+        """Sorted list of the years in the table"""
+        return self.meta['years']
+
+    def __len__(self):
+        return len(self.index)
+
+    def head(self):
+        """Returns the text above the data lines"""
+        return self.data[:self.meta['data_start']].decode(self.encoding)
+
+    def footer(self):
+        """Returns the text below the data lines"""
+        if self.meta['footer_start'] is None:
+            return ''
+        return self.data[self.meta['footer_start']:].decode(self.encoding)
+
+    def _rows(self, region=None, years=None):
+        np = parse.np
+        index = self.index
+        if region is not None:
+            if isinstance(region, str):
+                region = [region]
+            parts = []
+            for key in region:
+                code = self.region_codes.get(key)
+                if code is None:
+                    continue
+                begin, end = np.searchsorted(index['region'],
+                                             [code, code + 1])
+                parts.append(index[begin:end])
+            if not parts:
+                return index[:0]
+            index = np.concatenate(parts)
+        if years is not None:
+            index = index[np.isin(index['year'], list(years))]
+        # back to the order of the file
+        return np.sort(index, order='start')
+
+    def select_bytes(self, region=None, years=None):
+        """
+        Returns the data lines for region (a key or list of keys) and
+        years (an iterable of ints), both None for all, in their original
+        order and encoding. Adjacent lines are read at once.
+        """
+        rows = self._rows(region, years)
+        if not len(rows):
+            return b''
+        starts = rows['start']
+        ends = rows['end']
+        # ranges begin where a line does not follow the previous one
+        breaks = parse.np.flatnonzero(starts[1:] != ends[:-1]) + 1
+        range_starts = [starts[0]] + list(starts[breaks])
+        range_ends = list(ends[breaks - 1]) + [ends[-1]]
+        return b''.join(self.data[s:e] for s, e in zip(range_starts,
+                                                       range_ends))
+
+    def select_text(self, region=None, years=None):
+        """
+        Returns the selected data lines as a complete table in CSV
+        format, with the head and footer of the original table.
+        """
+        return (self.head()
+                + self.select_bytes(region, years).decode(self.encoding)
+                + self.footer())
+
+    def select(self, region=None, years=None):
+        """
+        Returns the selected data lines parsed by parse_table(). See
+        select_bytes() for the arguments.
+        """
+        return parse_table(self.select_text(region, years))
+
+    def close(self):
+        self.data.close()
+        self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,235 @@
+# encoding: utf8
+"""
+HTTP transport for suds with connection pooling and keep-alive.
+
+suds' default transport opens a new connection, including the TLS
+handshake, for every request. A ConnectionPool keeps idle connections
+per host for reuse. suds requires every client to have a transport of
+its own, so each gets a PooledTransport, and these share one pool.
+"""
+import gzip
+import io
+import logging
+import threading
+import zlib
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2
+    import httplib
+    from urlparse import urlsplit
+
+from suds.transport import Reply, Transport, TransportError
+
+
+# Unread response bodies up to this size are read when a streamed response
+# is closed early, to keep the connection reusable
+DRAIN_LIMIT = 64 * 1024
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+# Errors raised when the server has closed an idle keep-alive connection.
+# Timeouts are not among them: a request that timed out may have reached
+# the server and must not be sent again silently.
+STALE_CONNECTION_ERRORS = (httplib.BadStatusLine,
+                           getattr(httplib, 'RemoteDisconnected',
+                                   httplib.BadStatusLine),
+                           ConnectionResetError, BrokenPipeError)
+
+
+class ConnectionPool(object):
+    """
+    Idle HTTP(S) connections by host, safe to share between threads.
+    size: maximum number of idle connections kept per host
+    timeout: socket timeout in seconds
+    gzip: whether to ask servers for gzip compressed responses
+    """
+
+    def __init__(self, size=8, timeout=90, gzip=True):
+        self.size = size
+        self.timeout = timeout
+        self.gzip = gzip
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def key(self, url):
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        return (parts.scheme, parts.hostname, port)
+
+    def get(self, key):
+        """Returns (connection, reused)"""
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool:
+                return pool.pop(), True
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(host, port, timeout=self.timeout)
+        return conn, False
+
+    def release(self, key, conn):
+        """Returns a connection to the pool, or closes it if it is full"""
+        with self.lock:
+            pool = self.pools.setdefault(key, [])
+            if len(pool) < self.size:
+                pool.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Closes all idle connections"""
+        with self.lock:
+            pools, self.pools = self.pools, {}
+        for pool in pools.values():
+            for conn in pool:
+                conn.close()
+
+
+class PooledTransport(Transport):
+    """
+    suds transport sending requests over connections from pool, a
+    ConnectionPool (by default the one shared by the whole process).
+    """
+
+    def __init__(self, pool=None):
+        Transport.__init__(self)
+        self.pool = pool or default_pool()
+        self.options.timeout = self.pool.timeout
+
+    def __deepcopy__(self, memo):
+        # copies share the pool
+        return PooledTransport(self.pool)
+
+    def _request(self, method, request):
+        """
+        Sends request and returns (pool key, connection, response). Retries
+        once on a fresh connection if a reused one turns out to be stale.
+        """
+        key = self.pool.key(request.url)
+        parts = urlsplit(request.url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(request.headers or {})
+        headers.update(self.options.headers)
+        if self.pool.gzip:
+            headers['Accept-Encoding'] = 'gzip'
+        while True:
+            conn, reused = self.pool.get(key)
+            try:
+                conn.request(method, path, body=request.message,
+                             headers=headers)
+                response = conn.getresponse()
+                return key, conn, response
+            except STALE_CONNECTION_ERRORS as e:
+                conn.close()
+                if not reused:
+                    raise TransportError(str(e), None)
+                logging.debug('Stale connection to %s, reconnecting', key[1])
+            except (IOError, httplib.HTTPException) as e:
+                conn.close()
+                raise TransportError(str(e), None)
+
+    def _check(self, key, conn, response):
+        if response.status in (200, 202, 204):
+            return
+        body = self._decode(response, response.read())
+        self._finish(key, conn, response)
+        raise TransportError(response.reason, response.status,
+                             io.BytesIO(body))
+
+    def _decode(self, response, body):
+        if response.getheader('Content-Encoding', '').lower() == 'gzip':
+            return gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        return body
+
+    def _finish(self, key, conn, response):
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.release(key, conn)
+
+    def open(self, request):
+        key, conn, response = self._request('GET', request)
+        self._check(key, conn, response)
+        body = self._decode(response, response.read())
+        self._finish(key, conn, response)
+        return io.BytesIO(body)
+
+    def send(self, request):
+        key, conn, response = self._request('POST', request)
+        self._check(key, conn, response)
+        body = self._decode(response, response.read())
+        self._finish(key, conn, response)
+        if response.status in (202, 204):
+            return None
+        return Reply(response.status, dict(response.getheaders()), body)
+
+    def open_stream(self, request):
+        """
+        Sends request and returns the response body as a file-like
+        object. The connection returns to the pool once the response
+        has been read completely and closed.
+        """
+        key, conn, response = self._request('POST', request)
+        self._check(key, conn, response)
+        return PooledResponse(self.pool, key, conn, response)
+
+
+class PooledResponse(object):
+    """
+    File-like wrapper around a streamed response, decompressing gzip
+    content on the fly.
+    """
+
+    def __init__(self, pool, key, conn, response):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.headers = response.msg
+        self.decompressor = None
+        if response.getheader('Content-Encoding', '').lower() == 'gzip':
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.closed = False
+
+    def read(self, size=-1):
+        if self.decompressor is None:
+            return self.response.read(size if size >= 0 else None)
+        while True:
+            data = self.response.read(size if size >= 0 else None)
+            if not data:
+                return self.decompressor.flush()
+            out = self.decompressor.decompress(data)
+            if out:
+                return out
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if (not self.response.isclosed() and self.response.length is not None
+                and self.response.length < DRAIN_LIMIT):
+            # read what is left (e.g. the end of a multipart message)
+            # so the connection can be reused
+            self.response.read()
+        if self.response.isclosed() and not self.response.will_close:
+            # fully read, the connection can be reused
+            self.pool.release(self.key, self.conn)
+        else:
+            self.response.close()
+            self.conn.close()
+
+
+def default_pool():
+    """Returns the ConnectionPool shared by all clients of the process"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = ConnectionPool()
+        return _default_pool
@@ -10,9 +10,16 @@ setup(name='genesisclient',
       url='https://github.com/marians/genesisclient',
       license="MIT",
       packages=['genesisclient'],
+      package_data={'genesisclient': ['wsdl/*/*.wsdl']},
       install_requires=[
         'lxml',
         'suds-py3'],
+      extras_require={
+        'parse': ['numpy'],
+        'pandas': ['numpy', 'pandas'],
+        'async': ['aiohttp'],
+        'arrow': ['numpy', 'pyarrow'],
+      },
       entry_points={
         'console_scripts': [
             'genesiscl = genesisclient:main'
@@ -0,0 +1,45 @@
+# encoding: utf8
+"""
+Fixtures running GenesisClient against the mock webservice of the
+benchmarks (benchmarks/mockserver.py) in a background thread.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from mockserver import Dataset, MockGenesis, MockServer  # noqa: E402
+
+from genesisclient import GenesisClient, RateLimiter  # noqa: E402
+
+
+def make_client(server, **options):
+    """Returns a GenesisClient for server without rate limiting"""
+    options.setdefault('wsdl_dir', None)
+    options.setdefault('rate_limiter', RateLimiter())
+    options.setdefault('backoff', 0)
+    return GenesisClient('MOCK', sites={'MOCK': {'webservice_url': server.url}},
+                         **options)
+
+
+@pytest.fixture
+def dataset():
+    """A small synthetic catalogue, which tests may modify"""
+    return Dataset(statistics=10, tables_per_statistic=5, properties=20,
+                   occurrences=10, terms=50, regions=30, years=5)
+
+
+@pytest.fixture
+def server(dataset):
+    server = MockServer(MockGenesis(dataset)).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server):
+    return make_client(server)
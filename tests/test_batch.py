@@ -0,0 +1,81 @@
+# encoding: utf8
+import pytest
+import suds
+from suds.transport import TransportError
+
+from genesisclient import RateLimiter, batch
+from genesisclient.multipart import MultipartError
+
+from conftest import make_client
+
+
+class CountingLimiter(RateLimiter):
+
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+
+    def success(self, seconds):
+        self.successes += 1
+
+    def failure(self):
+        self.failures += 1
+
+
+@pytest.mark.parametrize('exception,transient', [
+    (TransportError('Service Unavailable', 503), True),
+    (TransportError('Too Many Requests', 429), True),
+    (TransportError('connection refused', None), True),
+    (TransportError('Not Found', 404), False),
+    (TransportError('Unauthorized', 401), False),
+    (ConnectionResetError(), True),
+    (MultipartError('Unexpected end of multipart message'), True),
+    (suds.WebFault('unknown table', None), False),
+    (ValueError(), False),
+])
+def test_is_transient(exception, transient):
+    assert batch.is_transient(exception) is transient
+
+
+def test_retry_stops_at_permanent_errors():
+    calls = []
+
+    def fail(exception):
+        calls.append(exception)
+        raise exception
+
+    with pytest.raises(TransportError):
+        batch.retry(lambda: fail(TransportError('Not Found', 404)),
+                    retries=3, backoff=0)
+    assert len(calls) == 1
+    with pytest.raises(TransportError):
+        batch.retry(lambda: fail(TransportError('Bad Gateway', 502)),
+                    retries=3, backoff=0)
+    assert len(calls) == 5
+
+
+def test_fault_is_not_retried(server):
+    limiter = CountingLimiter()
+    client = make_client(server, rate_limiter=limiter)
+    with pytest.raises(suds.WebFault):
+        client._call('TestService', 'exception', {})
+    assert server.genesis.requests['exception'] == 1
+    assert (limiter.successes, limiter.failures) == (1, 0)
+
+
+def test_server_errors_are_retried(server):
+    limiter = CountingLimiter()
+    client = make_client(server, rate_limiter=limiter, retries=2)
+    server.genesis.fault_rate = 1.0
+    with pytest.raises(TransportError):
+        client.tables('10000*')
+    assert server.genesis.requests['TabellenKatalog'] == 3
+    assert (limiter.successes, limiter.failures) == (0, 3)
+
+
+def test_export_server_errors_are_retried(server, dataset):
+    client = make_client(server, retries=2)
+    server.genesis.fault_rate = 1.0
+    with pytest.raises(TransportError):
+        client.table_export('10000-0001')
+    assert server.genesis.requests['TabellenDownload'] == 3
@@ -0,0 +1,49 @@
+# encoding: utf8
+from genesisclient.cache import MemoryCache, SqliteCache, make_key
+
+PARAMS = {'kennung': 'user', 'passwort': 'secret', 'filter': '12411*'}
+
+
+def test_key_depends_on_credentials():
+    key = make_key('DESTATIS', 'TabellenKatalog', PARAMS)
+    assert 'secret' not in key
+    assert key == make_key('DESTATIS', 'TabellenKatalog', dict(PARAMS))
+    for name, value in (('passwort', 'wrong'), ('kennung', 'other'),
+                        ('filter', '12412*')):
+        params = dict(PARAMS)
+        params[name] = value
+        assert key != make_key('DESTATIS', 'TabellenKatalog', params)
+    assert key != make_key('REGIONAL', 'TabellenKatalog', PARAMS)
+
+
+def test_sqlite_cache(tmpdir):
+    path = str(tmpdir.join('cache.sqlite'))
+    cache = SqliteCache(path, maxsize=2)
+    cache.set('a', b'<a/>')
+    cache.set('b', b'<b/>')
+    assert cache.get('a') == b'<a/>'
+    cache.set('c', b'<c/>')
+    # b was used least recently
+    assert cache.get('b') is None
+    assert SqliteCache(path).get('c') == b'<c/>'
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 2}
+
+
+def test_expiry():
+    cache = MemoryCache(ttl=-1)
+    cache.set('a', b'x')
+    assert cache.get('a') is None
+
+
+def test_cached_catalogue(server):
+    from conftest import make_client
+    cache = MemoryCache()
+    client = make_client(server, cache=cache, username='user',
+                         password='secret')
+    client.tables('10000*')
+    client.tables('10000*')
+    assert server.genesis.requests['TabellenKatalog'] == 1
+    other = make_client(server, cache=cache, username='user',
+                        password='wrong')
+    other.tables('10000*')
+    assert server.genesis.requests['TabellenKatalog'] == 2
@@ -0,0 +1,86 @@
+# encoding: utf8
+import gzip
+import io
+import zipfile
+
+import pytest
+
+from genesisclient.compression import Decompressor
+
+DATA = b''.join(b'31.12.2019;%05d;Region %d;%d;1,5\r\n' % (i, i, i * 37)
+                for i in range(2000))
+
+
+class Unseekable(io.RawIOBase):
+    """Write-only stream, makes zipfile use data descriptors"""
+
+    def __init__(self):
+        self.data = b''
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += bytes(data)
+        return len(data)
+
+
+def make_zip(data, method=zipfile.ZIP_DEFLATED, seekable=True):
+    out = io.BytesIO() if seekable else Unseekable()
+    with zipfile.ZipFile(out, 'w', method) as z:
+        z.writestr('table.csv', data)
+    return out.getvalue() if seekable else out.data
+
+
+def decompress(data, size):
+    decompressor = Decompressor()
+    out = [decompressor.decompress(data[i:i + size])
+           for i in range(0, len(data), size)]
+    return b''.join(out) + decompressor.flush()
+
+
+@pytest.mark.parametrize('size', [1, 3, 29, 30, 31, 1000, 10 ** 6])
+def test_zip_deflated(size):
+    assert decompress(make_zip(DATA), size) == DATA
+
+
+@pytest.mark.parametrize('size', [1, 7, 10 ** 6])
+def test_zip_with_data_descriptor(size):
+    assert decompress(make_zip(DATA, seekable=False), size) == DATA
+
+
+@pytest.mark.parametrize('size', [1, 7, 10 ** 6])
+def test_zip_stored(size):
+    assert decompress(make_zip(DATA, zipfile.ZIP_STORED), size) == DATA
+
+
+def test_zip_empty_file():
+    assert decompress(make_zip(b'', zipfile.ZIP_STORED), 5) == b''
+
+
+@pytest.mark.parametrize('size', [1, 11, 10 ** 6])
+def test_gzip(size):
+    assert decompress(gzip.compress(DATA), size) == DATA
+
+
+@pytest.mark.parametrize('data', [DATA, b'', b'PK', b'abc'])
+def test_plain_data_passes_through(data):
+    assert decompress(data, 2) == data
+
+
+@pytest.mark.parametrize('data', [make_zip(DATA)[:500],
+                                  make_zip(DATA, zipfile.ZIP_STORED)[:500],
+                                  make_zip(DATA)[:20],
+                                  gzip.compress(DATA)[:500]])
+def test_truncated(data):
+    with pytest.raises(ValueError):
+        decompress(data, 64)
+
+
+def test_compressed_export(client, dataset):
+    expected = dataset.table_csv('10000-0001', None, None, '')
+    keep = io.BytesIO()
+    data = client.table_export('10000-0001', compress=True, keep=keep)
+    assert data == expected
+    with zipfile.ZipFile(io.BytesIO(keep.getvalue())) as z:
+        assert z.read(z.namelist()[0]) == expected
@@ -0,0 +1,58 @@
+# encoding: utf8
+import pytest
+
+from genesisclient import MetricsCollector
+
+from conftest import make_client
+
+
+def operation_stats(metrics, operation):
+    return metrics.snapshot()['MOCK'][operation]
+
+
+def test_every_export_attempt_is_measured(server, dataset):
+    metrics = MetricsCollector()
+    client = make_client(server, metrics=metrics)
+    expected = dataset.table_csv('10000-0001', None, None, '')
+    server.genesis.cut_downloads = 2
+    assert client.table_export('10000-0001') == expected
+    stats = operation_stats(metrics, 'TabellenDownload')
+    assert stats['requests'] == 3
+    assert stats['errors'] == 2
+    assert stats['bytes'] >= len(expected)
+
+
+def test_every_call_attempt_is_measured(server):
+    metrics = MetricsCollector()
+    client = make_client(server, metrics=metrics, retries=1)
+    server.genesis.fault_rate = 1.0
+    with pytest.raises(Exception):
+        client.tables('10000*')
+    stats = operation_stats(metrics, 'TabellenKatalog')
+    assert (stats['requests'], stats['errors']) == (2, 2)
+
+
+def test_async_export_attempts_are_measured(server, dataset):
+    pytest.importorskip('aiohttp')
+    import asyncio
+
+    from genesisclient import RateLimiter
+    from genesisclient.aio import AsyncGenesisClient
+
+    metrics = MetricsCollector()
+    expected = dataset.table_csv('10000-0001', None, None, '')
+
+    async def export():
+        async with AsyncGenesisClient(
+                'MOCK', sites={'MOCK': {'webservice_url': server.url}},
+                wsdl_dir=None, rate_limiter=RateLimiter(), backoff=0,
+                metrics=metrics) as client:
+            server.genesis.fault_rate = 1.0
+            with pytest.raises(Exception):
+                await client.table_export('10000-0001')
+            server.genesis.fault_rate = 0.0
+            return await client.table_export('10000-0001')
+
+    assert asyncio.run(export()) == expected
+    stats = operation_stats(metrics, 'TabellenDownload')
+    assert (stats['requests'], stats['errors']) == (5, 4)
@@ -0,0 +1,129 @@
+# encoding: utf8
+import io
+
+import pytest
+
+from genesisclient.multipart import (MultipartError, MultipartReader,
+                                     attachments, boundary_from_content_type)
+
+BOUNDARY = 'MIMEBoundary_0123abc'
+
+
+def message(*bodies, **kwargs):
+    boundary = kwargs.get('boundary', BOUNDARY).encode('ascii')
+    out = b''
+    for i, body in enumerate(bodies):
+        out += (b'\r\n--' + boundary + b'\r\nContent-Type: text/plain\r\n'
+                b'Content-Id: <part%d>\r\n\r\n' % i + body)
+    return out + b'\r\n--' + boundary + b'--\r\n'
+
+
+class SlowFile(object):
+    """File returning at most size bytes per read, like a slow socket"""
+
+    def __init__(self, data, size):
+        self.fp = io.BytesIO(data)
+        self.size = size
+
+    def read(self, n=-1):
+        return self.fp.read(min(n, self.size) if n >= 0 else self.size)
+
+
+BODIES = [
+    b'<soapenv:Envelope/>',
+    # line breaks and partial delimiters inside the attachment
+    b'a;b;c\r\n1;2;3\r\n\r\n--MIMEBoundary_0123\r\n--MIME\r\n' * 50,
+]
+
+
+@pytest.mark.parametrize('read_size', [1, 2, 3, 7, 23, 64, 4096])
+@pytest.mark.parametrize('chunk_size', [1, 5, 32, 65536])
+def test_boundaries_split_across_chunks(read_size, chunk_size):
+    fp = SlowFile(message(*BODIES), read_size)
+    reader = MultipartReader(fp, boundary=BOUNDARY, chunk_size=chunk_size)
+    bodies = [part.read() for part in reader.parts()]
+    assert bodies == BODIES
+
+
+def test_detects_boundary():
+    parts = [(part.headers['content-id'], part.read()) for part in
+             attachments(io.BytesIO(message(*BODIES)), chunk_size=3)]
+    assert parts == [('<part1>', BODIES[1])]
+
+
+def test_unread_parts_are_skipped():
+    reader = MultipartReader(io.BytesIO(message(b'one', b'two', b'three')),
+                             boundary=BOUNDARY, chunk_size=4)
+    ids = [part.headers['content-id'] for part in reader.parts()]
+    assert ids == ['<part0>', '<part1>', '<part2>']
+
+
+def test_empty_body():
+    fp = io.BytesIO(message(b'envelope', b''))
+    assert [p.read() for p in attachments(fp, boundary=BOUNDARY)] == [b'']
+
+
+def test_truncated_message():
+    data = message(*BODIES)[:-40]
+    with pytest.raises(MultipartError):
+        for part in attachments(io.BytesIO(data), boundary=BOUNDARY,
+                                chunk_size=16):
+            part.read()
+
+
+def test_boundary_from_content_type():
+    assert boundary_from_content_type(
+        'multipart/related; type="text/xml"; boundary="abc=_1"') == 'abc=_1'
+    assert boundary_from_content_type('multipart/related; boundary=x1') == 'x1'
+    assert boundary_from_content_type('text/xml') is None
+
+
+def test_table_export(client, dataset):
+    expected = dataset.table_csv('10000-0001', None, None, '')
+    assert client.table_export('10000-0001') == expected
+    out = io.BytesIO()
+    assert client.table_export('10000-0001', fileobj=out) == len(expected)
+    assert out.getvalue() == expected
+
+
+class WriteOnlyFile(object):
+    """File that cannot seek, like a pipe"""
+
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+
+def test_broken_off_export_is_retried(client, server, dataset):
+    expected = dataset.table_csv('10000-0001', None, None, '')
+    server.genesis.cut_downloads = 1
+    assert client.table_export('10000-0001') == expected
+    assert server.genesis.requests['TabellenDownload'] == 2
+
+    server.genesis.cut_downloads = 1
+    out = io.BytesIO()
+    out.write(b'before\n')
+    assert client.table_export('10000-0001', fileobj=out) == len(expected)
+    assert out.getvalue() == b'before\n' + expected
+
+    server.genesis.cut_downloads = 2
+    out = WriteOnlyFile()
+    keep = WriteOnlyFile()
+    client.table_export('10000-0001', fileobj=out, compress=True, keep=keep)
+    assert out.data == expected
+    assert keep.data.startswith(b'PK')
+
+    server.genesis.cut_downloads = 1
+    assert b''.join(client.iter_table_export('10000-0001')) == expected
+    assert server.genesis.requests['TabellenDownload'] == 9
+
+
+def test_broken_off_export_fails_after_retries(server):
+    from conftest import make_client
+    client = make_client(server, retries=1)
+    server.genesis.cut_downloads = 2
+    with pytest.raises(MultipartError):
+        client.table_export('10000-0001')
+    assert server.genesis.requests['TabellenDownload'] == 2
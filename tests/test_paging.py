@@ -0,0 +1,135 @@
+# encoding: utf8
+import logging
+
+from genesisclient import paging
+from genesisclient.paging import iter_pages, page_characters, split_filter
+
+TERMS = ['aal', 'bach', 'bär', 'bäume', 'bü', 'gas wasser', 'gas-preis',
+         'gas/strom', 'größe', 'grün', 'straße', 'straßen', 'ä', 'äpfel',
+         'öl', 'ölpreis', 'österreich', 'ökologie', 'über alles', 'üben',
+         'übersee', 'zahl', 'zeit', 'zoll', 'zug']
+
+
+def entry(code):
+    return {'id': code, 'description': code}
+
+
+def fetcher(codes, calls=None):
+    """Returns fetch() matching codes like Genesis, ignoring case"""
+    import fnmatch
+
+    def fetch(filter, limit):
+        if calls is not None:
+            calls.append(filter)
+        return [entry(c) for c in codes
+                if fnmatch.fnmatch(c.lower(), filter.lower())][:limit]
+    return fetch
+
+
+def test_split_filter():
+    assert split_filter('12*', '01') == ['12', '120*', '121*']
+    assert split_filter('*', '01') == ['0*', '1*']
+    assert split_filter('12', '01') is None
+
+
+def test_page_characters():
+    characters = page_characters('gr', [entry('größe'), entry('grün'),
+                                        entry('gr'), entry('GRAU'),
+                                        entry('x*y')], 'AB')
+    assert characters.startswith('AB')
+    assert 'ö' in characters.lower() and 'ü' in characters.lower()
+    assert 'a' not in characters and '*' not in characters
+
+
+def test_pages_of_numeric_codes():
+    codes = ['%05d' % i for i in range(0, 3000, 7)]
+    assert sorted(e['id'] for e in iter_pages(fetcher(codes), '*', 20)) == codes
+
+
+def test_terms_with_umlauts_and_spaces(caplog):
+    with caplog.at_level(logging.WARNING):
+        found = [e['id'] for e in iter_pages(fetcher(TERMS), '*', 3)]
+    assert sorted(found) == sorted(TERMS)
+    assert not caplog.records
+
+
+def test_characters_only_seen_on_the_full_page():
+    codes = ['a', 'ałx', 'ały', 'ałz', 'ab']
+    found = [e['id'] for e in iter_pages(fetcher(codes), 'a*', 3)]
+    assert sorted(found) == sorted(codes)
+
+
+def test_missing_entries_of_full_page_are_reported(caplog):
+    codes = ['a', 'a€x', 'a€y', 'ab']
+    # a backend unable to match this character in filters
+    fetch = fetcher(codes)
+
+    def broken(filter, limit):
+        if '€' in filter:
+            return []
+        return fetch(filter, limit)
+    with caplog.at_level(logging.WARNING):
+        found = [e['id'] for e in iter_pages(broken, '*', 3)]
+    assert sorted(found) == sorted(codes)
+    assert 'not returned by narrower queries' in caplog.text
+
+
+def test_iter_terms(client, dataset):
+    dataset.terms = sorted(TERMS + dataset.terms[:10])
+    assert len(client.terms(limit=1000)) == len(dataset.terms)
+    found = [e.id for e in client.iter_terms(page_size=4)]
+    assert sorted(found) == dataset.terms
+
+
+def test_pager_counts_every_entry_once():
+    pager = paging.Pager('*', page_size=2, characters='AB')
+    assert pager.next() == '*'
+    assert pager.add('*', [entry('A1'), entry('B1')]) == []
+    assert pager.next() == 'A*'
+    assert pager.add('A*', [entry('A1')]) == [entry('A1')]
+    assert pager.add('A*', [entry('A1')]) == []
+
+
+def test_pager_keeps_only_open_pages():
+    codes = ['%05d' % i for i in range(0, 3000, 7)]
+    fetch = fetcher(codes)
+    pager = paging.Pager('*', page_size=20)
+    found = []
+    most_open = 0
+    while True:
+        current = pager.next()
+        if current is None:
+            break
+        found += pager.add(current, fetch(current, 20))
+        most_open = max(most_open, len(pager.split_pages))
+    assert pager.seen is None
+    assert most_open <= 4
+    assert pager.split_pages == []
+    assert sorted(e['id'] for e in found) == codes
+
+
+def test_missing_entries_are_yielded_when_their_subtree_is_done():
+    codes = ['a1', 'a€x', 'a€y', 'b1']
+    fetch = fetcher(codes)
+    calls = []
+
+    def broken(filter, limit):
+        calls.append(filter)
+        if '€' in filter:
+            return []
+        return fetch(filter, limit)
+    for e in iter_pages(broken, '*', 3):
+        if e['id'] == 'a€x':
+            # before any query of the next subtree
+            assert not [f for f in calls if f.startswith('b')]
+            break
+    else:
+        assert False, 'a€x not found'
+
+
+def test_inner_asterisks_yield_entries_once():
+    # 'abxb' matches both 'a*b' and 'a*bX*'
+    codes = ['ab', 'abx', 'aby', 'axb', 'abxb', 'b']
+    found = [e['id'] for e in iter_pages(fetcher(codes), 'a*b*', 4,
+                                         characters='ABXY')]
+    assert sorted(found) == sorted(codes[:-1])
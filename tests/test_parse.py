@@ -0,0 +1,124 @@
+# encoding: utf8
+import pytest
+
+from genesisclient import parse
+from genesisclient.parse import head_lines, period_year, split_blocks
+
+TABLE = (
+    'GENESIS-Tabelle: 12411-0001\r\n'
+    'Bevölkerung: Deutschland, Stichtag;;\r\n'
+    'Fortschreibung des Bevölkerungsstandes;;\r\n'
+    ';Bevölkerungsstand;Anteil\r\n'
+    'Stichtag;Anzahl;Prozent\r\n'
+    '31.12.2017;82.792.351;1,5\r\n'
+    '31.12.2018;83.019.213;-\r\n'
+    '31.12.2019;...;x\r\n'
+    ';;\r\n'
+    '__________\r\n'
+    '(C)opyright Statistisches Bundesamt (Destatis), 2020\r\n'
+    'Stand: 01.01.2020 10:00:00\r\n'
+)
+
+
+def test_split_blocks():
+    blocks = split_blocks(TABLE)
+    assert blocks['meta'] == ['GENESIS-Tabelle: 12411-0001',
+                              'Bevölkerung: Deutschland, Stichtag',
+                              'Fortschreibung des Bevölkerungsstandes']
+    assert blocks['header'] == [';Bevölkerungsstand;Anteil',
+                                'Stichtag;Anzahl;Prozent']
+    assert blocks['data'].splitlines() == ['31.12.2017;82.792.351;1,5',
+                                           '31.12.2018;83.019.213;-',
+                                           '31.12.2019;...;x']
+    assert blocks['footer'][0] == '__________'
+    assert blocks['footer'][-1] == 'Stand: 01.01.2020 10:00:00'
+    assert TABLE.startswith(blocks['head'] + blocks['data'])
+
+
+def test_split_blocks_without_footer():
+    blocks = split_blocks(TABLE[:TABLE.index('__________')])
+    assert blocks['footer'] == []
+    assert len(blocks['data'].splitlines()) == 3
+
+
+def test_split_blocks_mock_table(dataset):
+    text = dataset.table_csv('10000-0001', None, None, '').decode('latin-1')
+    blocks = split_blocks(text)
+    assert blocks['header'][-1] == 'Jahr;Regionalschl.;Region;Anzahl;Prozent'
+    assert (len(blocks['data'].splitlines())
+            == len(dataset.years) * len(dataset.regions))
+    assert parse.time_column(blocks) == 0
+    assert parse.region_key_column(blocks) == 1
+
+
+def test_head_lines():
+    assert head_lines(TABLE, 2) == ['GENESIS-Tabelle: 12411-0001',
+                                    'Bevölkerung: Deutschland, Stichtag;;']
+    assert head_lines('a\nb', 5) == ['a', 'b']
+
+
+@pytest.mark.parametrize('value,year', [('2019', 2019), ('31.12.2019', 2019),
+                                        ('2019-03', 2019), ('2019q2', 2019),
+                                        ('März 2019', 2019),
+                                        ('Region 05315', None), ('', None)])
+def test_period_year(value, year):
+    assert period_year(value) == year
+
+
+def test_to_float():
+    np = pytest.importorskip('numpy')
+    parse._import()
+    values = parse.to_float(['82.792.351', '1,5', '-1.234,25', '0', '-', '.',
+                             'x', '...', ''])
+    assert list(values[:4]) == [82792351.0, 1.5, -1234.25, 0.0]
+    assert np.isnan(values[4:]).all()
+
+
+def test_to_float_rejects_text():
+    pytest.importorskip('numpy')
+    parse._import()
+    with pytest.raises(ValueError):
+        parse.to_float(['1', 'Region'])
+
+
+def test_parse_table():
+    np = pytest.importorskip('numpy')
+    parsed = parse.parse_table(TABLE.encode('latin-1'))
+    assert parsed['footer'][-1] == 'Stand: 01.01.2020 10:00:00'
+    assert [d['type'] for d in parsed['dimensions']] == ['time']
+    assert len(parsed['values']) == 2
+    values = parsed['columns'][parsed['values'][0]]
+    assert list(values[:2]) == [82792351.0, 83019213.0]
+    assert np.isnan(values[2])
+    assert list(parsed['flags'][parsed['values'][0]]) == ['', '', '...']
+
+
+@pytest.mark.parametrize('use_pandas', [True, False])
+def test_split_cells_ragged_rows(monkeypatch, use_pandas):
+    pytest.importorskip('numpy')
+    parse._import()
+    if not use_pandas:
+        monkeypatch.setattr(parse, 'pd', False)
+    elif not parse.pd:
+        pytest.skip('pandas is not installed')
+    cells = parse.split_cells('a;1;2\nb;3\nc;4;5;6\n', 3)
+    assert cells.tolist() == [['a', '1', '2'], ['b', '3', ''],
+                              ['c', '4', '5']]
+
+
+def test_parse_table_text_after_sample(monkeypatch):
+    np = pytest.importorskip('numpy')
+    monkeypatch.setattr(parse, 'SAMPLE_SIZE', 2)
+    text = TABLE.replace('31.12.2019;...;x', '31.12.2019;...;siehe Fn. 1')
+    parsed = parse.parse_table(text)
+    assert len(parsed['values']) == 1
+    assert parsed['dimensions'][-1] == {'name': 'Anteil Prozent',
+                                        'type': 'property'}
+    assert list(parsed['columns']['Anteil Prozent']) == ['1,5', '-',
+                                                         'siehe Fn. 1']
+    cells = parse.split_cells(split_blocks(text)['data'], 3)
+    types = parse.column_types(['Stichtag', 'Anzahl', 'Anteil'], cells)
+    columns, flags = parse.typed_columns(cells, types, text_as_flags=True)
+    assert list(columns['Anteil'][:1]) == [1.5]
+    assert np.isnan(columns['Anteil'][1:]).all()
+    assert list(flags['Anteil']) == ['', '-', 'siehe Fn. 1']
@@ -0,0 +1,49 @@
+# encoding: utf8
+from genesisclient import regions
+
+
+def data_lines(dataset, key=''):
+    text = dataset.table_csv('10000-0001', None, None, key).decode('latin-1')
+    return text.split('Prozent\r\n', 1)[1].split('\r\n__________')[0].split(
+        '\r\n')
+
+
+def merged_lines(data):
+    text = data.decode('latin-1')
+    assert '\r\nregionalschluessel;Jahr;' in text
+    body = text.split('Prozent\r\n', 1)[1].split('\r\n__________')[0]
+    return [line.split(';', 1) for line in body.split('\r\n')]
+
+
+def test_key_batches():
+    assert regions.key_batches(['1', '2*', '3', '4', '5'], 2) == [
+        ['2*'], ['1', '3'], ['4', '5']]
+
+
+def test_export_regions_in_order(client, server, dataset):
+    keys = dataset.regions[::-1]
+    data = client.export_regions('10000-0001', keys, batch_size=4,
+                                 workers=3)
+    rows = merged_lines(data)
+    assert server.genesis.requests['TabellenDownload'] == 8
+    # batches are merged in order, each in the server's order
+    expected = []
+    for i in range(0, len(keys), 4):
+        expected += data_lines(dataset, ','.join(keys[i:i + 4]))
+    assert [line for _, line in rows] == expected
+    assert all(line.split(';')[1] == key for key, line in rows)
+    assert data.decode('latin-1').endswith(
+        '__________\r\n(C)opyright Mock Statistisches Amt\r\n'
+        'Stand: %s\r\n' % dataset.stand)
+
+
+def test_full_pattern_exports_are_split(client, server, dataset):
+    data = client.export_regions('10000-0001', '*', workers=4,
+                                 max_rows=len(dataset.years) * 8)
+    # values depend on the regions requested together, so compare the
+    # year and region of each row
+    cells = set(tuple(line.split(';')[:2]) for _, line in merged_lines(data))
+    assert sorted(cells) == sorted(tuple(line.split(';')[:2])
+                                   for line in data_lines(dataset))
+    # '*' is split into '0*' ... '9*', the full '0*' further
+    assert server.genesis.requests['TabellenDownload'] > 11
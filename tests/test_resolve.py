@@ -0,0 +1,53 @@
+# encoding: utf8
+import pytest
+
+from genesisclient.resolve import group_codes
+
+
+def test_group_codes():
+    groups = group_codes(['12411-0001', '12411-0002', '12613-0001', '1241'])
+    assert groups == [('12411*', ['12411-0001', '12411-0002']),
+                      ('12613-0001', ['12613-0001']),
+                      ('1241', ['1241'])]
+    assert group_codes(['12411-0001', '12411-0002'], 7) == [
+        ('12411-0*', ['12411-0001', '12411-0002'])]
+    assert group_codes(['12411-0001', '12411-0002'], 10) == [
+        ('12411-0001', ['12411-0001']), ('12411-0002', ['12411-0002'])]
+
+
+def test_resolve_tables(client, dataset, server):
+    codes = [code for code, _ in dataset.tables]
+    wanted = codes[::2] + ['99999-0001', codes[0]]
+    result = client.resolve(wanted, kind='table')
+    assert list(result) == wanted[:-1]
+    assert result['99999-0001'] is None
+    descriptions = dict(dataset.tables)
+    for code in codes[::2]:
+        assert result[code].id == code
+        assert result[code].description == descriptions[code]
+    # one wildcard query per statistic, one for the unknown code
+    assert server.genesis.requests['TabellenKatalog'] == (
+        len(dataset.statistics) + 1)
+
+
+def test_resolve_full_pages(client, dataset, server):
+    codes = [code for code, _ in dataset.tables]
+    result = client.resolve(codes, kind='table', page_size=2)
+    assert all(result[code] is not None for code in codes)
+    assert server.genesis.requests['TabellenKatalog'] < 2 * len(codes)
+
+
+def test_resolve_statistics_and_properties(client, dataset):
+    statistics = client.resolve([code for code, _ in dataset.statistics],
+                                kind='statistic')
+    assert [e.id for e in statistics.values()] == [
+        code for code, _ in dataset.statistics]
+    properties = client.resolve(['MK0001', 'MK0002', 'MK9999'],
+                                kind='property')
+    assert properties['MK0002'].description == 'Merkmal Nummer 2'
+    assert properties['MK9999'] is None
+
+
+def test_resolve_unknown_kind(client):
+    with pytest.raises(ValueError):
+        client.resolve(['12411-0001'], kind='tabelle')
@@ -0,0 +1,44 @@
+# encoding: utf8
+from genesisclient.responses import (Entry, Hit, copy_result, entries_parser,
+                                     parse_search)
+
+
+def test_record_is_a_mapping():
+    entry = Entry('12411', 'Bevölkerung')
+    assert list(entry) == ['id', 'description', 'longdescription']
+    assert len(entry) == 3
+    assert dict(entry) == {'id': '12411', 'description': 'Bevölkerung',
+                           'longdescription': None}
+    assert entry['id'] == entry.id == '12411'
+    assert entry == dict(entry)
+    assert 'id' in entry and 'foo' not in entry
+    assert entry.get('foo', 1) == 1
+    entry['longdescription'] = 'Lang'
+    assert entry.values() == ['12411', 'Bevölkerung', 'Lang']
+
+
+def test_copy_result():
+    entries = [Entry('a', 'A'), Entry('b', 'B')]
+    copied = copy_result({'results': entries, 'meta': {'Tabelle': 2}})
+    assert copied['results'] == entries
+    copied['results'][0]['description'] = 'changed'
+    assert entries[0].description == 'A'
+
+
+def test_parsers(client, dataset):
+    entries = client.tables(filter='10000*')
+    assert [e.id for e in entries] == [c for c, _ in dataset.tables
+                                      if c.startswith('10000')]
+    result = client.search('Tabelle 1 der')
+    assert result['meta']['Tabelle'] == len(result['results'])
+    assert all(isinstance(hit, Hit) for hit in result['results'])
+
+
+def test_parse_entries_long():
+    xml = (b'<r><e><code>K1</code><inhalt>Kurz\nText </inhalt>'
+           b'<beschriftungstext>Lang</beschriftungstext></e>'
+           b'<e><inhalt>ohne Code</inhalt></e></r>')
+    assert entries_parser('e', long=True)(xml) == [
+        Entry('K1', 'Kurz Text', 'Lang')]
+    assert entries_parser('e')(xml)[0].longdescription is None
+    assert parse_search(b'<r/>') == {'meta': {}, 'results': []}
@@ -0,0 +1,94 @@
+# encoding: utf8
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from genesisclient import singleflight
+from genesisclient.singleflight import Flight, SingleFlight
+
+CALLERS = 8
+
+
+class CountingEvent(threading.Event):
+    """Event counting the threads that waited for it"""
+
+    waiters = 0
+    lock = threading.Lock()
+
+    def wait(self, timeout=None):
+        with self.lock:
+            CountingEvent.waiters += 1
+        return threading.Event.wait(self, timeout)
+
+
+class CountingFlight(Flight):
+
+    def __init__(self):
+        Flight.__init__(self)
+        self.done = CountingEvent()
+
+
+@pytest.fixture
+def flights(monkeypatch):
+    monkeypatch.setattr(singleflight, 'Flight', CountingFlight)
+    monkeypatch.setattr(CountingEvent, 'waiters', 0)
+    return SingleFlight()
+
+
+def leader(func, calls):
+    """Returns func to run once all other callers wait for it"""
+    def call():
+        calls.append(1)
+        deadline = time.time() + 5
+        while CountingEvent.waiters < CALLERS - 1 and time.time() < deadline:
+            time.sleep(0.001)
+        return func()
+    return call
+
+
+def run_concurrently(flights, func, **kwargs):
+    """Calls flights.do('key', func) from CALLERS threads at once"""
+    with ThreadPoolExecutor(max_workers=CALLERS) as pool:
+        futures = [pool.submit(flights.do, 'key', func, **kwargs)
+                   for _ in range(CALLERS)]
+        return [f.exception() or f.result() for f in futures]
+
+
+def test_concurrent_callers_share_one_call(flights):
+    calls = []
+    results = run_concurrently(flights, leader(lambda: 'result', calls))
+    assert results == ['result'] * CALLERS
+    assert len(calls) == 1
+    assert len(flights) == 0
+
+
+def test_exception_reaches_every_caller(flights):
+    calls = []
+
+    def fail():
+        raise ValueError('failed')
+    results = run_concurrently(flights, leader(fail, calls))
+    assert len(calls) == 1
+    assert all(isinstance(r, ValueError) for r in results)
+    # the next call runs again
+    assert flights.do('key', lambda: 'again') == 'again'
+
+
+def test_waiting_callers_get_copies(flights):
+    calls = []
+    results = run_concurrently(flights, leader(lambda: {'a': [1]}, calls),
+                               copy=lambda d: dict(d, a=list(d['a'])))
+    assert len(calls) == 1
+    assert all(r == {'a': [1]} for r in results)
+    assert len(set(id(r) for r in results)) == CALLERS
+    assert len(set(id(r['a']) for r in results)) == CALLERS
+
+
+def test_different_keys_run_separately(flights):
+    assert flights.do('a', lambda: 1) == 1
+    assert flights.do('b', lambda: 2) == 2
+    with pytest.raises(KeyError):
+        flights.do('c', lambda: {}['missing'])
+    assert len(flights) == 0
@@ -0,0 +1,65 @@
+# encoding: utf8
+import os
+
+from genesisclient.parse import split_blocks
+from genesisclient.sync import IncrementalSync
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def data_lines(data):
+    return split_blocks(data.decode('latin-1'))['data'].splitlines()
+
+
+def test_first_sync_downloads_table(tmpdir, client, dataset):
+    sync = IncrementalSync(client, str(tmpdir))
+    result = sync.sync('10000-0001')
+    assert result['full']
+    assert result['latest'] == dataset.years[-1]
+    assert read(result['path']) == dataset.table_csv('10000-0001', None,
+                                                     None, '')
+    assert os.path.exists(sync.state_file)
+
+
+def test_sync_merges_new_years(tmpdir, client, dataset, server):
+    first = IncrementalSync(client, str(tmpdir)).sync('10000-0001')
+    old = data_lines(read(first['path']))
+    latest = dataset.years[-1]
+    dataset.years.append(latest + 1)
+    # a new instance reads the state written by the first one
+    sync = IncrementalSync(client, str(tmpdir))
+    result = sync.sync('10000-0001')
+    assert not result['full']
+    assert result['latest'] == latest + 1
+    # the latest stored year is requested again, it may have been revised
+    # (the mock server returns other values for it when asked so)
+    new = data_lines(dataset.table_csv('10000-0001', str(latest), None, ''))
+    assert result['rows'] == len(new) == 2 * len(dataset.regions)
+    kept = [l for l in old if not l.startswith('31.12.%d' % latest)]
+    merged = read(result['path'])
+    assert data_lines(merged) == kept + new
+    assert merged.endswith(b'Stand: 01.01.2020 10:00:00\r\n')
+    assert server.genesis.requests['TabellenDownload'] == 2
+
+
+def test_sync_replaces_rows_of_latest_year(tmpdir, client, dataset):
+    sync = IncrementalSync(client, str(tmpdir))
+    path = sync.sync('10000-0001')['path']
+    removed = ';%s;' % dataset.regions.pop()
+    sync.sync('10000-0001')
+    rows = [l for l in data_lines(read(path)) if removed in l]
+    # rows of earlier years are kept, those of the latest year replaced
+    assert len(rows) == len(dataset.years) - 1
+    assert not any(l.startswith('31.12.%d' % dataset.years[-1])
+                   for l in rows)
+
+
+def test_sync_per_region(tmpdir, client, dataset):
+    sync = IncrementalSync(client, str(tmpdir))
+    result = sync.sync('10000-0001', regionalschluessel='01003')
+    assert result['path'].endswith('10000-0001_01003.csv')
+    assert read(result['path']) == dataset.table_csv('10000-0001', None, None,
+                                                     '01003')
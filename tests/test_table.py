@@ -0,0 +1,63 @@
+# encoding: utf8
+import os
+
+import pytest
+
+from genesisclient import table
+from genesisclient.table import GenesisTable, build_index, index_paths
+
+pytest.importorskip('numpy')
+
+
+@pytest.fixture
+def path(tmpdir, dataset):
+    path = str(tmpdir.join('10000-0001.csv'))
+    with open(path, 'wb') as f:
+        f.write(dataset.table_csv('10000-0001', None, None, ''))
+    return path
+
+
+def test_build_index(path, dataset):
+    meta = build_index(path)
+    assert meta['regions'] == sorted(dataset.regions)
+    assert meta['years'] == sorted(dataset.years)
+    assert all(os.path.exists(p) for p in index_paths(path))
+    # no temporary files are left behind
+    assert sorted(os.listdir(os.path.dirname(path))) == sorted(
+        [os.path.basename(path)]
+        + [os.path.basename(p) for p in index_paths(path)])
+
+
+def test_open_reuses_index(path, dataset, monkeypatch):
+    region = dataset.regions[1]
+    year = dataset.years[0]
+    with GenesisTable.open(path) as t:
+        assert len(t) == len(dataset.regions) * len(dataset.years)
+        first = t.select_bytes(region=region, years=[year])
+    assert first.count(b'\n') == 1
+    assert region.encode('latin-1') in first
+
+    def fail(*args, **kwargs):
+        raise AssertionError('index rebuilt')
+
+    monkeypatch.setattr(table, 'build_index', fail)
+    with GenesisTable.open(path) as t:
+        assert t.select_bytes(region=region, years=[year]) == first
+        parsed = t.select(region=region)
+    assert len(parsed['columns']['Jahr']) == len(dataset.years)
+
+
+def test_index_rebuilt_after_change(path, dataset):
+    build_index(path)
+    with open(path, 'rb') as f:
+        text = f.read()
+    region = dataset.regions[0].encode('latin-1')
+    with open(path, 'wb') as f:
+        f.write(text.replace(b';%s;' % region, b';99999;'))
+    # same size, so make sure the modification time differs
+    mtime = os.stat(path).st_mtime + 10
+    os.utime(path, (mtime, mtime))
+    assert table.load_index_meta(path) is None
+    with GenesisTable.open(path) as t:
+        assert t.regions[-1] == '99999'
+        assert dataset.regions[0] not in t.regions
@@ -0,0 +1,74 @@
+# encoding: utf8
+from genesisclient.transport import ConnectionPool, DRAIN_LIMIT
+
+from conftest import make_client
+
+
+class RecordingPool(ConnectionPool):
+    """ConnectionPool recording whether each connection was reused"""
+
+    def __init__(self, **kwargs):
+        ConnectionPool.__init__(self, **kwargs)
+        self.reused = []
+
+    def get(self, key):
+        conn, reused = ConnectionPool.get(self, key)
+        self.reused.append(reused)
+        return conn, reused
+
+    def idle(self):
+        return sum(len(conns) for conns in self.pools.values())
+
+
+def test_connections_are_reused(server):
+    pool = RecordingPool()
+    client = make_client(server, connection_pool=pool)
+    client.tables('10000*')
+    client.statistics('1000*')
+    client.table_export('10000-0001')
+    # the first request to each service opens a connection, the WSDLs
+    # are served by the mock from the same host
+    assert pool.reused[-1] is True
+    assert pool.reused.count(False) == 1
+    assert pool.idle() == 1
+
+
+def test_stale_connection_is_replaced(server):
+    pool = RecordingPool()
+    client = make_client(server, connection_pool=pool)
+    server.genesis.keep_alive = False
+    client.tables('10000*')
+    client.tables('10001*')
+    client.tables('10002*')
+    # the WSDL is fetched on a new connection, which is reused for the
+    # first request. After that, each time the pooled connection closed
+    # by the server is tried first, then the request is sent on a new one.
+    assert pool.reused == [False, True, True, False, True, False]
+    assert server.genesis.requests['TabellenKatalog'] == 3
+
+
+def test_streamed_response_returns_connection(server, dataset):
+    pool = RecordingPool()
+    client = make_client(server, connection_pool=pool)
+    method, params = client.export_request('10000-0001')
+    response = client._stream('DownloadService', method, params)
+    assert pool.idle() == 0
+    response.read()
+    response.close()
+    assert pool.idle() == 1
+
+
+def test_unread_large_response_closes_connection(server, dataset):
+    dataset.regions = dataset.regions * 20
+    pool = RecordingPool()
+    client = make_client(server, connection_pool=pool)
+    method, params = client.export_request('10000-0001')
+    response = client._stream('DownloadService', method, params)
+    assert response.response.length > DRAIN_LIMIT
+    response.read(100)
+    response.close()
+    assert pool.idle() == 0
+    # the next request opens a new connection
+    before = len(pool.reused)
+    client.tables('10000*')
+    assert pool.reused[before] is False